@@ -0,0 +1,119 @@
+"""
+Energy-based activity detection, used to skip silence before running models.
+
+Audio is cut into short frames and each frame's RMS level is computed in one
+vectorized pass. Chunks whose loudest frame stays below SILENCE_THRESHOLD_DB
+are not worth separating, and only the regions of the vocal stem above
+VOICE_THRESHOLD_DB need to go through diarization.
+"""
+import os
+import numpy as np
+
+SILENCE_THRESHOLD_DB = float(os.getenv("SILENCE_THRESHOLD_DB", -60.0))  # dBFS; chunks below get zero stems
+VOICE_THRESHOLD_DB = float(os.getenv("VOICE_THRESHOLD_DB", -45.0))  # dBFS; quieter vocal frames are not diarized
+FRAME_SECONDS = 0.05
+VOICE_MIN_GAP_SECONDS = 0.5  # Shorter pauses do not split a voiced region
+VOICE_PADDING_SECONDS = 0.25  # Kept around every voiced region
+
+def frame_levels_db(audio, frame_length):
+    """
+    RMS level of consecutive frames in dBFS.
+
+    Args:
+        audio (np.ndarray): [..., samples]; the last partial frame is zero-padded
+        frame_length (int): Samples per frame
+
+    Returns:
+        np.ndarray: [..., frames] levels (-inf for digital silence)
+    """
+    audio = np.asarray(audio, dtype=np.float32)
+    num_frames = max(1, -(-audio.shape[-1] // frame_length))
+    full = audio.shape[-1] // frame_length
+    # Whole frames are a reshaped view of the input; only the last partial frame is copied
+    frames = audio[..., :full * frame_length].reshape(*audio.shape[:-1], full, frame_length)
+    power = np.zeros(audio.shape[:-1] + (num_frames,), dtype=np.float32)
+    power[..., :full] = np.einsum("...i,...i->...", frames, frames) / frame_length
+    if full < num_frames:
+        tail = audio[..., full * frame_length:]
+        power[..., full] = np.einsum("...i,...i->...", tail, tail) / frame_length
+    with np.errstate(divide="ignore"):
+        return 10.0 * np.log10(power)
+
+def silent_chunks(chunks, sr, threshold_db=SILENCE_THRESHOLD_DB, frame_seconds=FRAME_SECONDS):
+    """
+    Flag chunks whose loudest frame is below threshold_db.
+
+    Args:
+        chunks (list): Mono float32 arrays
+        sr (int): Sample rate
+
+    Returns:
+        np.ndarray: Boolean flag per chunk
+    """
+    frame_length = max(1, int(sr * frame_seconds))
+    # One chunk at a time, so only a chunk-sized copy exists besides the input
+    return np.array([len(chunk) == 0 or frame_levels_db(chunk, frame_length).max() < threshold_db
+                     for chunk in chunks], dtype=bool)
+
+def active_regions(audio, sr, threshold_db=VOICE_THRESHOLD_DB, frame_seconds=FRAME_SECONDS,
+                   min_gap=VOICE_MIN_GAP_SECONDS, padding=VOICE_PADDING_SECONDS):
+    """
+    Find the regions of a mono signal above threshold_db.
+
+    Returns:
+        np.ndarray: [regions, 2] start and end sample of each region, in order
+    """
+    frame_length = max(1, int(sr * frame_seconds))
+    active = frame_levels_db(audio, frame_length) >= threshold_db
+    if not active.any():
+        return np.zeros((0, 2), dtype=np.int64)
+    # Rising and falling edges of the activity mask give the frame ranges
+    edges = np.diff(np.concatenate([[0], active.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1) * frame_length
+    ends = np.flatnonzero(edges == -1) * frame_length
+    starts = np.maximum(starts - int(sr * padding), 0)
+    ends = np.minimum(ends + int(sr * padding), len(audio))
+    # Merge regions separated by less than min_gap
+    keep = np.concatenate([[True], starts[1:] - ends[:-1] >= int(sr * min_gap)])
+    group = np.cumsum(keep) - 1
+    merged_ends = np.zeros(keep.sum(), dtype=np.int64)
+    np.maximum.at(merged_ends, group, ends)
+    return np.stack([starts[keep], merged_ends], axis=1).astype(np.int64)
+
+def compact(audio, regions, gap):
+    """
+    Concatenate the regions of audio, separated by `gap` samples of silence.
+
+    Returns:
+        tuple: (compacted audio, start sample of each region in it)
+    """
+    pieces, offsets, position = [], [], 0
+    silence = np.zeros((gap,) + audio.shape[1:], dtype=audio.dtype)
+    for start, end in regions:
+        if pieces:
+            pieces.append(silence)
+            position += gap
+        pieces.append(audio[start:end])
+        offsets.append(position)
+        position += end - start
+    if not pieces:
+        return audio[:0], np.zeros(0, dtype=np.int64)
+    return np.concatenate(pieces), np.asarray(offsets, dtype=np.int64)
+
+def map_turns(turns, regions, offsets, sr):
+    """
+    Map (start, end, label) turns found on compacted audio back to the original timeline.
+
+    A turn that spans several regions is split at the gaps between them.
+    """
+    lengths = regions[:, 1] - regions[:, 0]
+    mapped = []
+    for start, end, label in turns:
+        start, end = start * sr, end * sr
+        # Overlap of the turn with every region, in compacted samples
+        lo = np.maximum(start, offsets)
+        hi = np.minimum(end, offsets + lengths)
+        for i in np.flatnonzero(hi > lo):
+            shift = regions[i, 0] - offsets[i]
+            mapped.append(((lo[i] + shift) / sr, (hi[i] + shift) / sr, label))
+    return mapped
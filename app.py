@@ -1,32 +1,73 @@
-from flask import Flask, request, render_template, send_file, redirect, url_for, send_from_directory, jsonify
+from flask import Flask, request, render_template, send_file, redirect, url_for, send_from_directory, jsonify, Response, stream_with_context
 import os
-import time
+import re
 import atexit
 import shutil
-import zipfile
-from separation_model import separate_audio
-from process import split_audio, merge_audio
-from enhancement import enhance_audio, enhance_all_components
+import multiprocessing
+from pipeline import process_upload, result_cache, select_stems
+from jobs import JobQueue
+from model_registry import warmup
+from instrumentation import render_metrics
+from bundle import get_bundle, bundle_size, BUNDLE_NAME
+from artifact_store import ArtifactIndex, Janitor, MAX_ARTIFACT_AGE
+from streaming import StreamingSeparator, separate_stream, PCM_FORMATS, SAMPLE_RATE as STREAM_SAMPLE_RATE
+from separation_model import LABELS, chunk_cache
 from speaker_separation import separate_speakers
-from audio_processing import normalize_volume
-from pydub import AudioSegment
+from audio_processing import normalize_volume, normalize_files
+import soundfile as sf
+from werkzeug.utils import secure_filename, safe_join
 
 app = Flask(__name__)
 UPLOAD_FOLDER = "static/uploads"
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 
-# Maximum age of files in seconds (24 hours)
-MAX_FILE_AGE = 24 * 60 * 60
+# Uploads, stems and speaker files of every job, with their audio metadata and last access
+artifacts = ArtifactIndex()
+
+# Stems that were not requested with an upload are queued on their first download
+LAZY_STEM_PATTERN = re.compile(r"^denoised_merged_(\w+)\.wav$")
+
+def process_job(filepath, output_folder, stems=None):
+    """Job handler: run the pipeline and record the job's files in the artifact index"""
+    enhanced_files = process_upload(filepath, output_folder, stems=stems)
+    job_id = os.path.basename(output_folder)
+    artifacts.register(filepath, job_id, kind="upload")
+    for component, path in enhanced_files.items():
+        artifacts.register(path, job_id, kind="stem", stem=component)
+        merged_path = os.path.join(output_folder, f"merged_{component}.wav")
+        if os.path.exists(merged_path):
+            artifacts.register(merged_path, job_id, kind="intermediate", stem=component)
+    return enhanced_files
+
+# Uploads are processed by background workers, each job in its own folder
+job_queue = JobQueue(process_job)
+
+def contains_result_cache(path):
+    """Check whether path is or contains the result cache folder"""
+    path = os.path.abspath(path)
+    cache_root = os.path.abspath(result_cache.root)
+    return os.path.commonpath([path, cache_root]) == path
 
 def cleanup_on_exit():
     """Clean up all files when the application shuts down"""
+    if multiprocessing.parent_process() is not None:
+        # Worker processes re-import this module; only the main process cleans up
+        return
     print("\n=== Cleaning up files before shutdown ===")
+    janitor.stop()
+    artifacts.close()
     try:
         # Clean up all files in the upload folder
         for filename in os.listdir(UPLOAD_FOLDER):
             filepath = os.path.join(UPLOAD_FOLDER, filename)
             try:
-                if os.path.isfile(filepath):
+                if contains_result_cache(filepath):
+                    # Cached results outlive the process; only trim them to size
+                    for cache in (result_cache, chunk_cache):
+                        cache.prune_stale(0)
+                        cache.evict()
+                    print(f"Kept result cache: {filename}")
+                elif os.path.isfile(filepath):
                     os.remove(filepath)
                     print(f"Removed file: {filename}")
                 elif os.path.isdir(filepath):
@@ -41,87 +82,161 @@ def cleanup_on_exit():
 # Register the cleanup function to run on application exit
 atexit.register(cleanup_on_exit)
 
-def cleanup_old_files():
-    """Remove files older than MAX_FILE_AGE seconds"""
-    current_time = time.time()
-    for filename in os.listdir(UPLOAD_FOLDER):
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        try:
-            # Skip if it's a directory
-            if os.path.isdir(filepath):
-                continue
-                
-            # Get file's last modification time
-            file_time = os.path.getmtime(filepath)
-            
-            # Remove if file is older than MAX_FILE_AGE
-            if current_time - file_time > MAX_FILE_AGE:
-                try:
-                    os.remove(filepath)
-                    print(f"Cleaned up old file: {filename}")
-                except Exception as e:
-                    print(f"Error removing file {filename}: {str(e)}")
-        except Exception as e:
-            print(f"Error processing file {filename}: {str(e)}")
+def has_live_artifacts(job_id):
+    """Keep job folders while the index still has files of theirs"""
+    return bool(artifacts.find(job_id))
+
+def remove_old_jobs():
+    """Remove expired job folders and forget their artifacts"""
+    for job_id in job_queue.cleanup_old_jobs(MAX_ARTIFACT_AGE, keep=has_live_artifacts):
+        artifacts.forget_job(job_id)
+
+# Expires artifacts by age and disk quota in the background, so requests never scan the upload folder
+janitor = Janitor(artifacts, extra_tasks=[remove_old_jobs])
+
+def get_job_id():
+    """Return the job_id of this request, or None when it works on the shared upload folder"""
+    return request.values.get("job_id") or None
+
+def get_work_folder():
+    """Return the folder for this request: the job's folder when a job_id is given"""
+    job_id = get_job_id()
+    if job_id:
+        return job_queue.job_dir(job_id)
+    return UPLOAD_FOLDER
+
+def resolve_file(filename):
+    """Return the index record of a file of the request's job (marking it as used), or None"""
+    job_id = get_job_id()
+    if job_id:
+        job_queue.job_dir(job_id)  # Validates the id
+    record = artifacts.lookup(job_id, filename)
+    if record is None and job_id is None:
+        record = register_upload_folder_file(filename)
+    if record is None or not os.path.exists(record["path"]):
+        return None
+    return record
+
+def register_upload_folder_file(filename):
+    """Index a file outside any job, found where the shared upload folder keeps it, or return None"""
+    if filename.startswith("speaker_"):
+        kind, stem, path = "speaker", None, safe_join(UPLOAD_FOLDER, "speakers", filename)
+    else:
+        match = LAZY_STEM_PATTERN.match(filename)
+        stem = match.group(1) if match and match.group(1) in LABELS else None
+        kind, path = "stem" if stem else "file", safe_join(UPLOAD_FOLDER, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    artifacts.register(path, None, kind=kind, stem=stem)
+    return artifacts.lookup(None, filename)
+
+def index_upload_folder():
+    """Index the stems and speaker files the shared upload folder holds outside any job"""
+    names = [f"denoised_merged_{label}.wav" for label in LABELS]
+    speakers_dir = os.path.join(UPLOAD_FOLDER, "speakers")
+    if os.path.isdir(speakers_dir):
+        names += [name for name in os.listdir(speakers_dir) if name.startswith("speaker_") and name.endswith(".wav")]
+    for name in names:
+        if artifacts.lookup(None, name, touch=False) is None:
+            register_upload_folder_file(name)
+
+def get_requested_stems():
+    """Return the stems named in the request ("stems=vocal,drum" or repeated fields), or None for all"""
+    stems = [name.strip() for value in request.values.getlist("stems") for name in value.split(",") if name.strip()]
+    return select_stems(stems) if stems else None
+
+def queue_stem(filename):
+    """
+    Queue a stem that was not requested with the job's upload.
+
+    Only applies to denoised_merged_<stem>.wav files of finished jobs. The
+    stem is recorded as pending in the job's state, so downloads of it from
+    any worker process wait for the same run instead of starting another.
+
+    Returns:
+        str: The stem name, or None if it cannot be computed
+    """
+    job_id = get_job_id()
+    match = LAZY_STEM_PATTERN.match(filename)
+    if not job_id or not match or match.group(1) not in LABELS:
+        return None
+    uploads = artifacts.find(job_id, kind="upload")
+    if not uploads or not os.path.exists(uploads[0]["path"]):
+        return None
+    component = match.group(1)
+    state = job_queue.submit_outputs(job_id, uploads[0]["path"], [component], stems=[component])
+    if state is None or component not in state["pending"]:
+        return None  # Only answer 202 while the stem is actually being computed
+    print(f"   ✓ Job {job_id}: {component} queued")
+    return component
 
 @app.route("/", methods=["GET", "POST"])
 def upload_file():
     if request.method == "POST":
-        # Clean up old files before processing new upload
-        cleanup_old_files()
-        
+        janitor.start()
+
+        try:
+            stems = get_requested_stems()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
         file = request.files["file"]
         if file:
-            print("\n=== Starting Audio Processing Pipeline ===")
-            print(f"1. Uploading file: {file.filename}")
-            filepath = os.path.join(app.config["UPLOAD_FOLDER"], file.filename)
+            print(f"\n=== Queueing upload: {file.filename} ===")
+            job_id, filepath = job_queue.create_job(secure_filename(file.filename) or "upload")
             file.save(filepath)
-            print("   ✓ File uploaded successfully")
-
-            print("\n2. Splitting audio into chunks...")
-            chunk_files, sr = split_audio(filepath)
-            print(f"   ✓ Split into {len(chunk_files)} chunks")
-
-            print("\n3. Processing each chunk for separation...")
-            separated_files = {"bass": [], "vocal": [], "drum": [], "music": []}
-            for i, chunk in enumerate(chunk_files, 1):
-                print(f"   Processing chunk {i}/{len(chunk_files)}...")
-                outputs = separate_audio(chunk)
-                if outputs:
-                    separated_files["bass"].append(outputs["bass"])
-                    separated_files["vocal"].append(outputs["vocal"])
-                    separated_files["drum"].append(outputs["drum"])
-                    separated_files["music"].append(outputs["music"])
-            print("   ✓ All chunks processed successfully")
-
-            print("\n4. Merging separated components...")
-            merged_files = {}
-            for component in ["bass", "vocal", "drum", "music"]:
-                print(f"   Merging {component}...")
-                merged_files[component] = merge_audio(separated_files[component], sr, f"merged_{component}.wav")
-            print("   ✓ All components merged successfully")
-
-            print("\n5. Applying enhancement to denoise files...")
-            enhanced_files = enhance_all_components(merged_files, UPLOAD_FOLDER)
-            print("   ✓ Enhancement completed successfully")
-
-            print("\n=== Audio Processing Completed Successfully ===")
-            return render_template(
-                "download.html", 
-                bass_file="denoised_merged_bass.wav",
-                vocal_file="denoised_merged_vocal.wav",
-                drum_file="denoised_merged_drum.wav",
-                music_file="denoised_merged_music.wav",
-                show_speaker_separation=True
-            )
+            job_queue.submit(job_id, filepath, stems=stems)
+            print(f"   ✓ Job {job_id} queued")
+            return jsonify({
+                "job_id": job_id,
+                "status_url": url_for("job_status", job_id=job_id),
+                "result_url": url_for("job_result", job_id=job_id)
+            }), 202
 
     return render_template("index.html")
 
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    try:
+        state = job_queue.get(job_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if state is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(state)
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    try:
+        state = job_queue.get(job_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if state is None:
+        return jsonify({"error": "Job not found."}), 404
+    if state["status"] == "failed":
+        return jsonify(state), 500
+    if state["status"] != "done":
+        return jsonify(state), 202
+
+    # Stems that were not requested are still linked; their first download computes them
+    files = {label: state["files"].get(label, f"denoised_merged_{label}.wav") for label in LABELS}
+    return render_template(
+        "download.html",
+        job_id=job_id,
+        bass_file=files["bass"],
+        vocal_file=files["vocal"],
+        drum_file=files["drum"],
+        music_file=files["music"],
+        show_speaker_separation=True
+    )
+
 @app.route("/separate_speakers", methods=["POST"])
 def separate_speakers_route():
     try:
+        work_folder = get_work_folder()
+
         # Check if vocal file exists
-        vocal_file = os.path.join(UPLOAD_FOLDER, "denoised_merged_vocal.wav")
+        vocal_file = os.path.join(work_folder, "denoised_merged_vocal.wav")
         if not os.path.exists(vocal_file):
             return jsonify({"error": "Vocal file not found. Please process the audio first."}), 404
             
@@ -129,53 +244,55 @@ def separate_speakers_route():
         if os.path.getsize(vocal_file) == 0:
             return jsonify({"error": "Vocal file is empty or corrupted."}), 400
             
-        # Validate file format
+        # Validate file format (header only, the audio is decoded once for diarization)
         try:
-            audio = AudioSegment.from_wav(vocal_file)
-            if len(audio) == 0:
+            if sf.info(vocal_file).frames == 0:
                 return jsonify({"error": "Invalid audio file format."}), 400
         except Exception as e:
             return jsonify({"error": f"Invalid audio file format: {str(e)}"}), 400
         
         # Create speakers directory if it doesn't exist
-        speakers_dir = os.path.join(UPLOAD_FOLDER, "speakers")
+        speakers_dir = os.path.join(work_folder, "speakers")
         os.makedirs(speakers_dir, exist_ok=True)
         
         # Clean up old speaker files
-        for old_file in os.listdir(speakers_dir):
-            if old_file.startswith("speaker_"):
-                try:
-                    os.remove(os.path.join(speakers_dir, old_file))
-                except Exception as e:
-                    print(f"Warning: Could not remove old speaker file {old_file}: {str(e)}")
+        job_id = get_job_id()
+        for record in artifacts.find(job_id, kind="speaker"):
+            try:
+                artifacts.delete(record["path"])
+            except Exception as e:
+                print(f"Warning: Could not remove old speaker file {record['name']}: {str(e)}")
         
         # Get speaker files
-        speaker_files = separate_speakers(vocal_file, speakers_dir)
+        keep_timing = request.values.get("keep_timing", "").lower() in ("1", "true", "yes")
+        timeline_path = os.path.join(speakers_dir, "diarization.rttm")
+        speaker_files = separate_speakers(vocal_file, speakers_dir, keep_timing=keep_timing,
+                                          timeline_path=timeline_path)
         
         if not speaker_files:
             return jsonify({"error": "No speakers detected in the audio."}), 400
+        if os.path.exists(timeline_path):
+            artifacts.register(timeline_path, job_id, kind="timeline")
         
-        # Normalize all audio files (main components and speakers)
-        normalized_files = {}
-        
-        # Normalize main components
+        # Normalize all audio files (main components and speakers) in one parallel batch
+        to_normalize = {}
         for component in ['bass', 'vocal', 'drum', 'music']:
-            file_path = os.path.join(UPLOAD_FOLDER, f"denoised_merged_{component}.wav")
+            file_path = os.path.join(work_folder, f"denoised_merged_{component}.wav")
             if os.path.exists(file_path):
-                try:
-                    normalized_path = normalize_volume(file_path)
-                    normalized_files[component] = os.path.basename(normalized_path)
-                except Exception as e:
-                    print(f"Warning: Could not normalize {component}: {str(e)}")
-        
-        # Normalize speaker files
+                to_normalize[component] = file_path
+        speaker_names = set()
         for speaker, file_path in speaker_files.items():
             if os.path.exists(file_path):
-                try:
-                    normalized_path = normalize_volume(file_path)
-                    normalized_files[f"speaker_{speaker}"] = os.path.basename(normalized_path)
-                except Exception as e:
-                    print(f"Warning: Could not normalize speaker {speaker}: {str(e)}")
+                to_normalize[f"speaker_{speaker}"] = file_path
+                speaker_names.add(f"speaker_{speaker}")
+                artifacts.register(file_path, job_id, kind="speaker", stem=speaker)
+
+        normalized_paths, errors = normalize_files(to_normalize)
+        for name, error in errors.items():
+            print(f"Warning: Could not normalize {name}: {error}")
+        for name, path in normalized_paths.items():
+            artifacts.register(path, job_id, kind="speaker" if name in speaker_names else "normalized", stem=name)
+        normalized_files = {name: os.path.basename(path) for name, path in normalized_paths.items()}
 
         if not normalized_files:
             return jsonify({"error": "Failed to process any audio files."}), 500
@@ -194,68 +311,77 @@ def separate_speakers_route():
 @app.route("/download/<filename>")
 def download_file(filename):
     try:
-        # Check if the file is in the speakers directory
-        if filename.startswith("speaker_"):
-            file_path = os.path.join(UPLOAD_FOLDER, "speakers", filename)
-        else:
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            
-        if not os.path.exists(file_path):
-            print(f"Error: File not found at {file_path}")
+        record = resolve_file(filename)
+        if record is None:
+            component = queue_stem(filename)
+            if component:
+                job_id = get_job_id()
+                return jsonify({
+                    "job_id": job_id,
+                    "stem": component,
+                    "status_url": url_for("job_status", job_id=job_id),
+                    "download_url": url_for("download_file", filename=filename, job_id=job_id)
+                }), 202
+
+        if record is None:
+            print(f"Error: File not found: {filename}")
             return "File not found", 404
             
         print(f"Downloading file: {filename}")
         return send_file(
-            file_path,
+            record["path"],
             as_attachment=True,
-            download_name=filename
+            download_name=filename,
+            conditional=True  # ETag, If-Modified-Since and Range requests for resumable downloads
         )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error during download: {str(e)}")
         return f"Error downloading file: {str(e)}", 500
 
-def create_zip_file():
-    """Create a zip file containing all processed audio files"""
-    zip_path = os.path.join(UPLOAD_FOLDER, "all_separated_files.zip")
-    
-    # Create a zip file
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        # Add main components
-        main_components = [
-            "denoised_merged_bass.wav",
-            "denoised_merged_vocal.wav",
-            "denoised_merged_drum.wav",
-            "denoised_merged_music.wav"
-        ]
-        
-        for component in main_components:
-            file_path = os.path.join(UPLOAD_FOLDER, component)
-            if os.path.exists(file_path):
-                zipf.write(file_path, component)
-        
-        # Add speaker files if they exist
-        speakers_dir = os.path.join(UPLOAD_FOLDER, "speakers")
-        if os.path.exists(speakers_dir):
-            for speaker_file in os.listdir(speakers_dir):
-                if speaker_file.endswith('.wav'):
-                    file_path = os.path.join(speakers_dir, speaker_file)
-                    zipf.write(file_path, os.path.join("speakers", speaker_file))
-    
-    return zip_path
-
-@app.route("/download_all", methods=["POST"])
+@app.route("/download_all", methods=["GET", "POST"])  # GET lets clients resume with Range
 def download_all():
     try:
-        print("\n=== Creating zip file with all separated files ===")
-        zip_path = create_zip_file()
-        print("✓ Zip file created successfully")
-        
-        return send_file(
-            zip_path,
-            as_attachment=True,
-            download_name="all_separated_files.zip",
-            mimetype="application/zip"
+        job_id = get_job_id()
+        if job_id is None:
+            index_upload_folder()
+        stems = [(record["path"], record["name"]) for record in artifacts.find(job_id, kind="stem")]
+        speakers = [(record["path"], os.path.join("speakers", record["name"]))
+                    for record in artifacts.find(job_id, kind="speaker")]
+        members = stems + speakers
+
+        def register_bundle(path):
+            for record in artifacts.find(job_id, kind="bundle"):
+                if record["path"] != os.path.abspath(path):
+                    artifacts.delete(record["path"])  # Bundle of an earlier set of files
+            artifacts.register(path, job_id, kind="bundle")
+
+        cached_path, chunks = get_bundle(get_work_folder(), members, on_cached=register_bundle)
+        if cached_path:
+            artifacts.touch(cached_path)
+            print("✓ Serving cached zip file")
+            return send_file(
+                cached_path,
+                as_attachment=True,
+                download_name=BUNDLE_NAME,
+                mimetype="application/zip",
+                conditional=True
+            )
+
+        print("\n=== Streaming zip file with all separated files ===")
+        return Response(
+            stream_with_context(chunks),
+            mimetype="application/zip",
+            headers={
+                "Content-Disposition": f"attachment; filename={BUNDLE_NAME}",
+                "Content-Length": str(bundle_size(members)),
+            }
         )
+    except FileNotFoundError as e:
+        return str(e), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error creating zip file: {str(e)}")
         return f"Error creating zip file: {str(e)}", 500
@@ -263,17 +389,19 @@ def download_all():
 @app.route("/normalize/<filename>")
 def normalize_file(filename):
     try:
-        # Check if the file is in the speakers directory
-        if filename.startswith("speaker_"):
-            file_path = os.path.join(UPLOAD_FOLDER, "speakers", filename)
-        else:
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            
-        if not os.path.exists(file_path):
+        record = resolve_file(filename)
+
+        if record is None:
             return "File not found", 404
             
         print(f"Normalizing volume for: {filename}")
-        normalized_path = normalize_volume(file_path)
+        normalized_path = normalize_volume(
+            record["path"],
+            target_dBFS=float(request.args.get("target_dBFS", -20.0)),
+            mode=request.args.get("mode", "rms")
+        )
+        kind = "speaker" if record["kind"] == "speaker" else "normalized"
+        artifacts.register(normalized_path, record["job_id"], kind=kind, stem=record["stem"])
         
         # Get the normalized filename
         normalized_filename = os.path.basename(normalized_path)
@@ -282,6 +410,8 @@ def normalize_file(filename):
             "success": True,
             "normalized_file": normalized_filename
         })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error during normalization: {str(e)}")
         return jsonify({
@@ -292,24 +422,20 @@ def normalize_file(filename):
 @app.route("/get_audio_info/<filename>")
 def get_audio_info(filename):
     try:
-        # Check if the file is in the speakers directory
-        if filename.startswith("speaker_"):
-            file_path = os.path.join(UPLOAD_FOLDER, "speakers", filename)
-        else:
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            
-        if not os.path.exists(file_path):
+        record = resolve_file(filename)
+
+        if record is None:
             return "File not found", 404
-            
-        audio = AudioSegment.from_wav(file_path)
-        duration = len(audio) / 1000.0  # Convert to seconds
-        
+
+        # Read from the file header when the file was indexed, no decoding needed
         return jsonify({
             "success": True,
-            "duration": duration,
-            "sample_rate": audio.frame_rate,
-            "channels": audio.channels
+            "duration": record["duration"],
+            "sample_rate": record["sample_rate"],
+            "channels": record["channels"]
         })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error getting audio info: {str(e)}")
         return jsonify({
@@ -317,8 +443,54 @@ def get_audio_info(filename):
             "error": str(e)
         }), 500
 
+@app.route("/stream", methods=["POST"])
+def stream_separation():
+    """
+    Separate live audio sent as a chunked request body of raw PCM.
+
+    Query parameters: sample_rate, format ("f32" or "s16"), channels, and the
+    block, lookahead, context and crossfade lengths in seconds. The response
+    streams each block as soon as it is separated, as interleaved float32
+    frames with one channel per stem (see the X-Stems header).
+    """
+    try:
+        sample_rate = int(request.args.get("sample_rate", STREAM_SAMPLE_RATE))
+        sample_format = request.args.get("format", "f32")
+        channels = int(request.args.get("channels", 1))
+        if sample_format not in PCM_FORMATS:
+            raise ValueError(f"Unsupported format: {sample_format}")
+        if sample_rate <= 0 or channels <= 0:
+            raise ValueError("sample_rate and channels must be positive")
+        settings = {name: float(request.args[name]) for name in ("block", "lookahead", "context", "crossfade")
+                    if name in request.args}
+        separator = StreamingSeparator(**settings)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    print(f"\n=== Streaming separation: {separator.latency_seconds:.3f}s algorithmic latency ===")
+    chunks = separate_stream(request.stream.read, separator, sample_rate, sample_format, channels)
+    return Response(
+        stream_with_context(chunks),
+        mimetype="application/octet-stream",
+        headers={
+            "X-Stems": ",".join(LABELS),
+            "X-Sample-Rate": str(STREAM_SAMPLE_RATE),
+            "X-Sample-Format": "f32",
+            "X-Block-Samples": str(separator.block),
+            "X-Algorithmic-Latency": f"{separator.latency_seconds:.6f}",
+        }
+    )
+
+@app.route("/metrics")
+def metrics():
+    """Stage latencies, job outcomes and cache hit rates in the Prometheus text format."""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     print("=== Starting Audio Processing Application ===")
-    # Clean up old files on startup
-    cleanup_old_files()
+    # Expire old files in the background
+    janitor.start()
+    # Models load lazily on first use; WARMUP_MODELS=separation,enhancement preloads them
+    if os.getenv("WARMUP_MODELS"):
+        warmup(os.getenv("WARMUP_MODELS").split(","))
     app.run(debug=True)
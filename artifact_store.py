@@ -0,0 +1,222 @@
+"""
+Persistent index of the files produced for each job, and the janitor that expires them.
+
+Every upload, stem, speaker track, normalized file and bundle is recorded in
+a SQLite database together with its size and audio metadata (read from the
+file header only) and the time it was last served. Routes resolve files and
+report audio info through the index, and a background janitor thread removes
+artifacts past MAX_ARTIFACT_AGE and evicts the least recently used ones once
+their total size goes over ARTIFACT_QUOTA_BYTES, so request handlers never
+scan the upload folder.
+"""
+import os
+import time
+import sqlite3
+import weakref
+import threading
+import soundfile as sf
+
+ARTIFACT_INDEX_PATH = os.getenv("ARTIFACT_INDEX_PATH", os.path.join("static", "uploads", "artifacts.db"))
+MAX_ARTIFACT_AGE = int(os.getenv("MAX_ARTIFACT_AGE", 24 * 60 * 60))  # Seconds since last access
+ARTIFACT_QUOTA_BYTES = int(os.getenv("ARTIFACT_QUOTA_BYTES", 10 * 1024**3))
+JANITOR_INTERVAL = int(os.getenv("JANITOR_INTERVAL", 300))  # Seconds between janitor passes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    path TEXT PRIMARY KEY,
+    job_id TEXT,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    stem TEXT,
+    size INTEGER NOT NULL,
+    duration REAL,
+    sample_rate INTEGER,
+    channels INTEGER,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_job_name ON artifacts (job_id, name);
+CREATE INDEX IF NOT EXISTS artifacts_last_access ON artifacts (last_access);
+"""
+
+def read_audio_metadata(path):
+    """Return (duration, sample_rate, channels) from the file header, or Nones for non-audio files."""
+    try:
+        info = sf.info(path)
+        return info.duration, info.samplerate, info.channels
+    except Exception:
+        return None, None, None
+
+class ArtifactIndex:
+    """
+    SQLite-backed record of job artifacts.
+
+    One connection is shared by all threads behind a lock; separate processes
+    open their own connection to the same database file.
+    """
+
+    def __init__(self, db_path=ARTIFACT_INDEX_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        _indexes.add(self)
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute(sql, params).fetchall()
+
+    def register(self, path, job_id=None, kind="file", stem=None):
+        """
+        Record a file (or refresh its record after it was rewritten).
+
+        Args:
+            path (str): File to record
+            job_id (str, optional): Job the file belongs to; None for files outside a job
+            kind (str): "upload", "stem", "intermediate", "speaker", "normalized", "timeline" or "bundle"
+            stem (str, optional): Component or speaker name
+
+        Returns:
+            dict: The stored record
+        """
+        duration, sample_rate, channels = read_audio_metadata(path)
+        now = time.time()
+        record = {
+            "path": os.path.abspath(path), "job_id": job_id, "name": os.path.basename(path), "kind": kind,
+            "stem": stem, "size": os.path.getsize(path), "duration": duration, "sample_rate": sample_rate,
+            "channels": channels, "created": now, "last_access": now,
+        }
+        self._execute(
+            "INSERT OR REPLACE INTO artifacts (path, job_id, name, kind, stem, size, duration, sample_rate, "
+            "channels, created, last_access) VALUES (:path, :job_id, :name, :kind, :stem, :size, :duration, "
+            ":sample_rate, :channels, :created, :last_access)", record)
+        return record
+
+    def lookup(self, job_id, name, touch=True):
+        """Return the record of a job's file by name (marking it as used), or None."""
+        rows = self._execute("SELECT * FROM artifacts WHERE job_id IS ? AND name = ?", (job_id, name))
+        if not rows:
+            return None
+        record = dict(rows[0])
+        if touch:
+            self.touch(record["path"])
+        return record
+
+    def touch(self, path):
+        self._execute("UPDATE artifacts SET last_access = ? WHERE path = ?", (time.time(), os.path.abspath(path)))
+
+    def find(self, job_id, kind=None):
+        """Return the records of a job, optionally of one kind only."""
+        if kind is None:
+            rows = self._execute("SELECT * FROM artifacts WHERE job_id IS ? ORDER BY name", (job_id,))
+        else:
+            rows = self._execute("SELECT * FROM artifacts WHERE job_id IS ? AND kind = ? ORDER BY name",
+                                 (job_id, kind))
+        return [dict(row) for row in rows]
+
+    def delete(self, path):
+        """Remove a file and its record."""
+        path = os.path.abspath(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self._execute("DELETE FROM artifacts WHERE path = ?", (path,))
+
+    def forget_job(self, job_id):
+        self._execute("DELETE FROM artifacts WHERE job_id IS ?", (job_id,))
+
+    def total_size(self):
+        return self._execute("SELECT COALESCE(SUM(size), 0) FROM artifacts")[0][0]
+
+    def enforce(self, max_age=MAX_ARTIFACT_AGE, max_bytes=ARTIFACT_QUOTA_BYTES):
+        """
+        Remove expired artifacts, then the least recently used ones until the total fits in max_bytes.
+
+        Returns:
+            int: Number of files removed
+        """
+        removed = 0
+        for row in self._execute("SELECT path FROM artifacts WHERE last_access < ?", (time.time() - max_age,)):
+            self.delete(row["path"])
+            removed += 1
+
+        total = self.total_size()
+        if total > max_bytes:
+            for row in self._execute("SELECT path, size FROM artifacts ORDER BY last_access"):
+                if total <= max_bytes:
+                    break
+                self.delete(row["path"])
+                total -= row["size"]
+                removed += 1
+        return removed
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+# SQLite connections must not be used across fork; forked workers open their own
+_indexes = weakref.WeakSet()
+
+def _reset_indexes_after_fork():
+    for index in list(_indexes):
+        index._reset_after_fork()
+
+os.register_at_fork(after_in_child=_reset_indexes_after_fork)
+
+class Janitor:
+    """Background thread that periodically applies the age and quota limits to an ArtifactIndex."""
+
+    def __init__(self, index, interval=JANITOR_INTERVAL, max_age=MAX_ARTIFACT_AGE,
+                 max_bytes=ARTIFACT_QUOTA_BYTES, extra_tasks=()):
+        self.index = index
+        self.interval = interval
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.extra_tasks = list(extra_tasks)  # Callables run after each pass, e.g. removing old job folders
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the janitor thread (safe to call repeatedly)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="artifact-janitor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        try:
+            removed = self.index.enforce(self.max_age, self.max_bytes)
+            if removed:
+                print(f"🧹 Janitor removed {removed} artifacts")
+            for task in self.extra_tasks:
+                task()
+        except Exception as e:
+            print(f"Error in artifact janitor: {str(e)}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
@@ -0,0 +1,25 @@
+import torch
+
+def si_snr(pred, target, eps=1e-8):
+    """
+    Scale-invariant SNR in dB, reduced over the last (time) axis only.
+
+    Same formula as the training loss in train_model.ipynb, but without the
+    final mean, so [batch, stems, time] inputs give [batch, stems] scores.
+    """
+    target_energy = torch.sum(target**2, dim=-1, keepdim=True) + eps
+    scale = torch.sum(target * pred, dim=-1, keepdim=True) / target_energy
+    target_proj = scale * target
+    noise = pred - target_proj
+
+    ratio = torch.sum(target_proj**2, dim=-1) / (torch.sum(noise**2, dim=-1) + eps)
+    return 10 * torch.log10(ratio + eps)
+
+def sdr(pred, target, eps=1e-8):
+    """
+    Signal-to-distortion ratio in dB, reduced over the last (time) axis only.
+
+    Same formula as calculate_sdr in train_model.ipynb, which sums over the
+    whole batch; here [batch, stems, time] inputs give [batch, stems] scores.
+    """
+    return 10 * torch.log10(torch.sum(target**2, dim=-1) / (torch.sum((target - pred)**2, dim=-1) + eps))
@@ -1,38 +1,141 @@
-from pydub import AudioSegment
+import os
+import threading
 import numpy as np
+import soundfile as sf
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import span, CACHE_REQUESTS
 
-def normalize_volume(audio_path, target_dBFS=-20.0):
+NORMALIZE_WORKERS = int(os.getenv("NORMALIZE_WORKERS", 4))  # Files normalized in parallel
+
+# Measured loudness per (path, size, mtime); a rewritten file gets a new key
+_loudness_cache = {}
+# Settings each normalized output was produced with, keyed like _loudness_cache
+_normalized_outputs = {}
+_cache_lock = threading.Lock()
+
+def measure_loudness(audio):
+    """
+    Measure the RMS and peak level of an array in dBFS.
+
+    Args:
+        audio (np.ndarray): Float samples in [-1, 1], any shape
+
+    Returns:
+        dict: {"rms": dBFS, "peak": dBFS}; -inf for silence
+    """
+    audio = np.asarray(audio, dtype=np.float32)
+    if audio.size == 0:
+        return {"rms": -np.inf, "peak": -np.inf}
+    rms = np.sqrt(np.mean(np.square(audio, dtype=np.float64)))
+    peak = np.max(np.abs(audio))
+    with np.errstate(divide="ignore"):
+        return {"rms": float(20 * np.log10(rms)), "peak": float(20 * np.log10(peak))}
+
+def normalize_array(audio, target_dBFS=-20.0, mode="rms", loudness=None):
+    """
+    Scale an array so its RMS or peak level matches target_dBFS.
+
+    Args:
+        audio (np.ndarray): Float samples in [-1, 1]
+        target_dBFS (float): Target level in dBFS
+        mode (str): "rms" (like pydub's dBFS) or "peak"
+        loudness (dict, optional): Precomputed measure_loudness(audio)
+
+    Returns:
+        np.ndarray: Normalized samples, clipped to [-1, 1]
+    """
+    if mode not in ("rms", "peak"):
+        raise ValueError(f"Unknown normalization mode: {mode}")
+    loudness = loudness or measure_loudness(audio)
+    current_dBFS = loudness[mode]
+    if not np.isfinite(current_dBFS):
+        return np.asarray(audio, dtype=np.float32)
+    gain = np.float32(10 ** ((target_dBFS - current_dBFS) / 20))
+    return np.clip(np.asarray(audio, dtype=np.float32) * gain, -1.0, 1.0)
+
+def _file_key(audio_path):
+    stat = os.stat(audio_path)
+    return (os.path.abspath(audio_path), stat.st_size, stat.st_mtime_ns)
+
+def get_loudness(audio_path, audio=None):
+    """Return the cached loudness of a file, measuring (and decoding if needed) on a miss."""
+    key = _file_key(audio_path)
+    with _cache_lock:
+        if key in _loudness_cache:
+            return _loudness_cache[key]
+    if audio is None:
+        audio, _ = sf.read(audio_path, dtype="float32")
+    loudness = measure_loudness(audio)
+    with _cache_lock:
+        _loudness_cache[key] = loudness
+    return loudness
+
+def normalize_volume(audio_path, target_dBFS=-20.0, mode="rms"):
     """
     Normalize the volume of an audio file to a target dBFS level.
-    
+
+    Repeat requests with the same settings are served from the existing
+    `_normalized.wav` file without decoding the source again.
+
     Args:
         audio_path (str): Path to the input audio file
         target_dBFS (float): Target volume level in dBFS (default: -20.0)
-    
+        mode (str): "rms" or "peak" level to match (default: "rms")
+
     Returns:
         str: Path to the normalized audio file
     """
     try:
-        # Load the audio file
-        audio = AudioSegment.from_wav(audio_path)
-        
-        # Calculate the current dBFS
-        current_dBFS = audio.dBFS
-        
-        # Calculate the change in dB needed
-        change_in_dBFS = target_dBFS - current_dBFS
-        
-        # Apply the change
-        normalized_audio = audio + change_in_dBFS
-        
         # Generate output path
         output_path = audio_path.replace('.wav', '_normalized.wav')
-        
-        # Export the normalized audio
-        normalized_audio.export(output_path, format="wav")
-        
+        key = _file_key(audio_path)
+        settings = (target_dBFS, mode)
+        with _cache_lock:
+            up_to_date = _normalized_outputs.get(key) == settings and os.path.exists(output_path)
+        CACHE_REQUESTS.inc(cache="normalize", result="hit" if up_to_date else "miss")
+        if up_to_date:
+            return output_path
+
+        with span("normalize", file=os.path.basename(audio_path), mode=mode) as attrs:
+            # Load the audio file
+            audio, sr = sf.read(audio_path, dtype="float32")
+            subtype = sf.info(audio_path).subtype
+            attrs["audio_seconds"] = len(audio) / sr
+
+            # Apply the change
+            normalized_audio = normalize_array(audio, target_dBFS, mode, get_loudness(audio_path, audio))
+
+            # Export the normalized audio with the source sample format
+            sf.write(output_path, normalized_audio, sr, subtype=subtype)
+        with _cache_lock:
+            _normalized_outputs[key] = settings
+
         return output_path
-        
+
     except Exception as e:
         print(f"Error in volume normalization: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
+
+def normalize_files(audio_paths, target_dBFS=-20.0, mode="rms", max_workers=NORMALIZE_WORKERS):
+    """
+    Normalize several files in parallel.
+
+    Args:
+        audio_paths (dict): Mapping of names to input file paths
+        target_dBFS (float): Target volume level in dBFS
+        mode (str): "rms" or "peak"
+        max_workers (int): Files processed concurrently
+
+    Returns:
+        tuple: (dict of name -> normalized path, dict of name -> error message)
+    """
+    normalized, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {name: pool.submit(normalize_volume, path, target_dBFS, mode)
+                   for name, path in audio_paths.items()}
+        for name, future in futures.items():
+            try:
+                normalized[name] = future.result()
+            except Exception as e:
+                errors[name] = str(e)
+    return normalized, errors
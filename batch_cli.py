@@ -0,0 +1,222 @@
+"""
+Headless batch processing of a directory or manifest of audio files.
+
+Each file runs through the same split -> separate -> merge -> enhance chain
+as an upload (and optionally speaker separation on the vocal stem) in a
+pool of worker processes. The stems are written to <output>/<relative path>/.
+Every finished file is appended to a JSONL ledger. Rerunning the same
+command skips files recorded as done whose size and modification time have
+not changed, so an interrupted backfill resumes where it stopped.
+
+Usage:
+    python batch_cli.py --input /music/catalog --output /data/stems --workers 4
+    python batch_cli.py --manifest files.txt --output /data/stems --speakers
+    python batch_cli.py --input /podcasts --output /data/vocals --stems vocal
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".flac", ".ogg", ".m4a", ".aiff", ".aif"}
+LEDGER_NAME = "ledger.jsonl"
+
+def find_audio_files(input_dir):
+    """Return (path, path relative to input_dir) for every audio file below input_dir, sorted."""
+    files = []
+    for root, dirs, names in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                path = os.path.join(root, name)
+                files.append((path, os.path.relpath(path, input_dir)))
+    return files
+
+def read_manifest(manifest_path):
+    """
+    Read input files from a manifest: one path per line, or JSON lines with a "path" key.
+
+    Relative paths are resolved against the manifest's folder. The output
+    location of each file mirrors its path relative to that folder, or just
+    its file name for paths outside it.
+    """
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    files = []
+    with open(manifest_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = json.loads(line)["path"] if line.startswith("{") else line
+            path = os.path.normpath(os.path.join(base, path))
+            relative = os.path.relpath(path, base)
+            if relative.startswith(os.pardir):
+                relative = os.path.basename(path)
+            files.append((path, relative))
+    return files
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def output_dir_for(output_root, relative):
+    return os.path.join(output_root, os.path.splitext(relative)[0])
+
+class Ledger:
+    """Append-only JSONL record of processed files; the last entry per path wins."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Line cut short by an interruption
+                    self.entries[entry["path"]] = entry
+
+    def is_done(self, path):
+        """True if path was processed, is unchanged since, and its outputs still exist."""
+        entry = self.entries.get(os.path.abspath(path))
+        if not entry or entry.get("status") != "done":
+            return False
+        try:
+            if entry.get("fingerprint") != file_fingerprint(path):
+                return False
+        except OSError:
+            return False
+        return all(os.path.exists(output) for output in entry.get("outputs", {}).values())
+
+    def record(self, entry):
+        self.entries[entry["path"]] = entry
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+def _init_worker(intra_op_threads):
+    from separation_model import configure_threads
+    configure_threads(intra_op_threads)
+
+def process_file(path, output_dir, mode=None, use_cache=False, speakers=False, stems=None):
+    """
+    Run one file through the pipeline into output_dir (worker process entry point).
+
+    The pipeline's progress output goes to output_dir/process.log.
+
+    Returns:
+        dict: Ledger entry for the file
+    """
+    from pipeline import process_upload
+
+    start = time.perf_counter()
+    entry = {"path": os.path.abspath(path), "output_dir": os.path.abspath(output_dir),
+             "fingerprint": file_fingerprint(path)}
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "process.log"), "w") as log, contextlib.redirect_stdout(log):
+        try:
+            outputs = process_upload(path, output_dir, mode=mode, use_cache=use_cache, stems=stems)
+            if not outputs:
+                raise RuntimeError("Processing produced no output files")
+            if speakers and "vocal" in outputs:
+                from speaker_separation import separate_speakers
+                speakers_dir = os.path.join(output_dir, "speakers")
+                speaker_files = separate_speakers(outputs["vocal"], speakers_dir,
+                                                  timeline_path=os.path.join(speakers_dir, "diarization.rttm"))
+                if not speaker_files:
+                    # separate_speakers reports errors by returning {}
+                    raise RuntimeError("Speaker separation failed or found no speakers")
+                outputs.update(speaker_files)
+            entry.update(status="done", outputs={name: os.path.abspath(p) for name, p in outputs.items()})
+        except Exception as e:
+            traceback.print_exc(file=log)
+            entry.update(status="failed", error=f"{type(e).__name__}: {e}")
+    entry.update(seconds=round(time.perf_counter() - start, 3), finished=time.time())
+    return entry
+
+def run_batch(files, output_root, workers=1, ledger_path=None, mode=None, use_cache=False, speakers=False,
+              retry_failed=True, stems=None):
+    """
+    Process files in parallel, skipping those the ledger marks as done.
+
+    Args:
+        files (list): (path, relative path) pairs
+        output_root (str): Root of the output tree
+        workers (int): Files processed concurrently, one process each
+        ledger_path (str, optional): Defaults to <output_root>/ledger.jsonl
+        mode (str, optional): Pipeline mode ("memory", "stream" or "disk")
+        use_cache (bool): Use the pipeline's result and chunk caches
+        speakers (bool): Also separate speakers from the vocal stem
+        retry_failed (bool): Process files whose last attempt failed again
+        stems (list, optional): Stems to merge and enhance; defaults to all of them
+
+    Returns:
+        dict: Counts of done, failed and skipped files
+    """
+    os.makedirs(output_root, exist_ok=True)
+    ledger = Ledger(ledger_path or os.path.join(output_root, LEDGER_NAME))
+    pending = []
+    for path, relative in files:
+        entry = ledger.entries.get(os.path.abspath(path))
+        if ledger.is_done(path) or (not retry_failed and entry and entry.get("status") == "failed"):
+            continue
+        pending.append((path, output_dir_for(output_root, relative)))
+    counts = {"done": 0, "failed": 0, "skipped": len(files) - len(pending)}
+    print(f"🔹 {len(pending)} files to process, {counts['skipped']} already done")
+    if not pending:
+        return counts
+
+    intra_op_threads = max(1, (os.cpu_count() or 1) // workers)
+    # spawn: each worker imports torch and loads its models from scratch
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(intra_op_threads,)) as pool:
+        futures = {pool.submit(process_file, path, output_dir, mode, use_cache, speakers, stems): path
+                   for path, output_dir in pending}
+        for i, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                # The worker process itself died
+                entry = {"path": os.path.abspath(path), "status": "failed", "error": f"{type(e).__name__}: {e}",
+                         "finished": time.time()}
+            ledger.record(entry)
+            counts[entry["status"]] += 1
+            if entry["status"] == "done":
+                print(f"✓ [{i}/{len(pending)}] {path} ({entry['seconds']:.1f}s)")
+            else:
+                print(f"✗ [{i}/{len(pending)}] {path}: {entry['error']}")
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Separate a directory or manifest of audio files into stems.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="Directory searched recursively for audio files")
+    source.add_argument("--manifest", help="File listing one audio path (or JSON object with \"path\") per line")
+    parser.add_argument("--output", required=True, help="Root of the output tree")
+    parser.add_argument("--workers", type=int, default=1, help="Files processed in parallel")
+    parser.add_argument("--ledger", help=f"Progress ledger (default: <output>/{LEDGER_NAME})")
+    parser.add_argument("--mode", choices=["memory", "stream", "disk"], help="Pipeline mode (default: PIPELINE_MODE)")
+    parser.add_argument("--stems", help="Comma-separated stems to produce (default: bass,vocal,drum,music)")
+    parser.add_argument("--speakers", action="store_true", help="Also separate speakers from the vocal stem")
+    parser.add_argument("--cache", action="store_true", help="Use the pipeline's result and chunk caches (RESULT_CACHE_FOLDER, CHUNK_CACHE_FOLDER)")
+    parser.add_argument("--skip-failed", action="store_true", help="Do not retry files whose last attempt failed")
+    args = parser.parse_args()
+
+    stems = [name.strip() for name in args.stems.split(",") if name.strip()] if args.stems else None
+    files = find_audio_files(args.input) if args.input else read_manifest(args.manifest)
+    print(f"=== Batch processing {len(files)} files into {args.output} ===")
+    counts = run_batch(files, args.output, max(1, args.workers), args.ledger, args.mode, args.cache,
+                       args.speakers, retry_failed=not args.skip_failed, stems=stems)
+    print(f"✓ Done: {counts['done']}  failed: {counts['failed']}  skipped: {counts['skipped']}")
+    if counts["failed"]:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
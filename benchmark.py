@@ -0,0 +1,227 @@
+"""
+Reproducible performance benchmark for the audio processing pipeline.
+
+Synthetic audio is generated at several lengths and every stage runs against
+a randomly initialized DemucsModel and lightweight stand-ins for htdemucs and
+the pyannote pipeline, so no checkpoint, download or HuggingFace token is
+needed. Each (stage, length) case runs in a fresh process so its peak RSS is
+measured in isolation.
+
+Usage:
+    python benchmark.py --lengths 10 60 300 --output benchmark_results.json
+    python benchmark.py --baseline benchmark_baseline.json  # exit 1 on regressions
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+import soundfile as sf
+
+SAMPLE_RATE = 44100
+STAGES = ["split_audio_arrays", "separate_chunks", "merge_arrays", "enhance_audio", "normalize_volume",
+          "separate_speakers", "process_upload"]
+DEFAULT_LENGTHS = [10, 60, 300]  # Seconds of audio per case
+
+def synthetic_audio(seconds, seed=0):
+    """Deterministic music-like test signal: chords, a pulsing bass, noise bursts and silence."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    audio = 0.1 * np.sin(2 * np.pi * 55 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 2 * t))
+    for freq in (220, 277, 330):
+        audio += 0.05 * np.sin(2 * np.pi * freq * t)
+    bursts = (np.sin(2 * np.pi * 0.5 * t) > 0.9).astype(np.float64)
+    audio += 0.05 * bursts * rng.standard_normal(len(t))
+    audio[(t % 20) > 18] = 0.0  # Two silent seconds every 20 seconds
+    return audio.astype(np.float32)
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def install_stand_ins():
+    """Register a random DemucsModel and stand-ins for htdemucs and pyannote in the model registry."""
+    import torch
+    import torch.nn as nn
+    from models.model_architecture import DemucsModel
+    from model_registry import set_model
+
+    torch.manual_seed(0)
+    set_model("separation", DemucsModel().eval())
+
+    class EnhancementStandIn(nn.Module):
+        """Same interface as htdemucs for demucs.apply.apply_model, with a single conv layer."""
+        sources = ["drums", "bass", "other", "vocals"]
+        samplerate = SAMPLE_RATE
+        audio_channels = 2
+        segment = 7.8
+
+        def __init__(self):
+            super().__init__()
+            self.conv = nn.Conv1d(2, 2 * len(self.sources), kernel_size=9, padding=4)
+
+        def forward(self, mix):
+            out = self.conv(mix)
+            return out.view(mix.shape[0], len(self.sources), 2, mix.shape[-1])
+
+    set_model("enhancement", EnhancementStandIn().eval())
+
+    class DiarizationStandIn:
+        """Alternates two speakers every 2.5 seconds, like a pyannote Annotation."""
+
+        def __call__(self, file):
+            duration = file["waveform"].shape[-1] / file["sample_rate"]
+            return _StandInAnnotation(duration)
+
+    set_model("diarization", DiarizationStandIn())
+
+class _Turn:
+    def __init__(self, start, end):
+        self.start, self.end = start, end
+
+class _StandInAnnotation:
+    def __init__(self, duration, turn_length=2.5):
+        self.duration, self.turn_length = duration, turn_length
+
+    def itertracks(self, yield_label=False):
+        for i, start in enumerate(np.arange(0, self.duration, self.turn_length)):
+            yield _Turn(float(start), float(min(start + self.turn_length, self.duration))), None, f"SPEAKER_0{i % 2}"
+
+def _setup(stage, seconds, work_dir):
+    """Create the inputs a stage needs and return a zero-argument callable running it."""
+    from process import split_audio_arrays, merge_arrays
+
+    input_path = os.path.join(work_dir, "input.wav")
+    sf.write(input_path, synthetic_audio(seconds), SAMPLE_RATE)
+
+    if stage == "split_audio_arrays":
+        return lambda: split_audio_arrays(input_path)
+    if stage == "separate_chunks":
+        from separation_model import separate_chunks
+        chunks, _ = split_audio_arrays(input_path)
+        # Without the chunk cache every repeat runs the model
+        return lambda: separate_chunks(chunks, use_cache=False)
+    if stage == "merge_arrays":
+        chunks, sr = split_audio_arrays(input_path)
+        return lambda: merge_arrays(chunks, sr, "merged.wav", work_dir)
+    if stage == "enhance_audio":
+        from enhancement import enhance_audio
+        return lambda: enhance_audio(input_path, os.path.join(work_dir, "denoised.wav"))
+    if stage == "normalize_volume":
+        from audio_processing import normalize_volume
+        # Touch the input so repeats are not served from the normalization cache
+        return lambda: (os.utime(input_path), normalize_volume(input_path))
+    if stage == "separate_speakers":
+        from speaker_separation import separate_speakers
+        return lambda: separate_speakers(input_path, os.path.join(work_dir, "speakers"))
+    if stage == "process_upload":
+        from pipeline import process_upload
+        return lambda: process_upload(input_path, os.path.join(work_dir, "output"), mode="memory", use_cache=False)
+    raise ValueError(f"Unknown stage: {stage}")
+
+def _run_case(stage, seconds, repeats, queue):
+    """Child process entry point: time one stage at one input length."""
+    try:
+        import contextlib
+        install_stand_ins()
+        with tempfile.TemporaryDirectory() as work_dir:
+            run = _setup(stage, seconds, work_dir)
+            rss_before = _peak_rss_mb()
+            timings = []
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    run()
+                    timings.append(time.perf_counter() - start)
+            peak = _peak_rss_mb()
+        wall = statistics.median(timings)
+        queue.put({
+            "stage": stage,
+            "audio_seconds": seconds,
+            "wall_seconds": wall,
+            "min_wall_seconds": min(timings),
+            "rtf": wall / seconds,
+            "throughput_x": seconds / wall if wall else float("inf"),
+            "peak_rss_mb": peak,
+            "rss_increase_mb": max(0.0, peak - rss_before),
+        })
+    except Exception as e:
+        queue.put({"stage": stage, "audio_seconds": seconds, "error": f"{type(e).__name__}: {e}"})
+
+def run_benchmarks(stages, lengths, repeats=3):
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for seconds in lengths:
+        for stage in stages:
+            queue = ctx.Queue()
+            process = ctx.Process(target=_run_case, args=(stage, seconds, repeats, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            results.append(result)
+            if "error" in result:
+                print(f"✗ {stage:<18} {seconds:>6}s  {result['error']}")
+            else:
+                print(f"✓ {stage:<18} {seconds:>6}s  RTF {result['rtf']:.4f}  "
+                      f"{result['throughput_x']:8.1f}x realtime  peak RSS {result['peak_rss_mb']:.0f} MB")
+    return results
+
+def environment_info():
+    import torch
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+    }
+
+def compare(results, baseline, tolerance):
+    """Return (stage, seconds, baseline_rtf, rtf) for cases slower than baseline by more than tolerance."""
+    reference = {(r["stage"], r["audio_seconds"]): r for r in baseline["results"] if "rtf" in r}
+    regressions = []
+    for result in results:
+        base = reference.get((result["stage"], result["audio_seconds"]))
+        if base and "rtf" in result and result["rtf"] > base["rtf"] * (1 + tolerance):
+            regressions.append((result["stage"], result["audio_seconds"], base["rtf"], result["rtf"]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the audio pipeline stages on synthetic audio.")
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--lengths", nargs="+", type=float, default=DEFAULT_LENGTHS,
+                        help="Input lengths in seconds")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per case (median is reported)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative RTF increase before a case counts as a regression")
+    args = parser.parse_args()
+
+    print("=== Running pipeline benchmarks ===")
+    results = run_benchmarks(args.stages, args.lengths, args.repeats)
+    report = {"environment": environment_info(), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✓ Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for stage, seconds, base_rtf, rtf in regressions:
+            print(f"✗ Regression: {stage} at {seconds}s: RTF {base_rtf:.4f} -> {rtf:.4f}")
+        if regressions:
+            sys.exit(1)
+        print("✓ No regressions against baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Zip bundles of a work folder's stems, streamed while they are built.
+
+WAV data barely compresses, so members are stored (ZIP_STORED) rather than
+deflated. Since stored members take exactly their file size, the archive's
+size is known before it is built. The first download streams the archive to
+the client with that Content-Length and tees it into a cached copy named
+after a fingerprint of the members; later downloads of unchanged members are
+served from that copy with Range support.
+"""
+import os
+import hashlib
+import struct
+import tempfile
+import zipfile
+from instrumentation import span, CACHE_REQUESTS
+
+BUNDLE_NAME = "all_separated_files.zip"
+MAIN_COMPONENTS = [
+    "denoised_merged_bass.wav",
+    "denoised_merged_vocal.wav",
+    "denoised_merged_drum.wav",
+    "denoised_merged_music.wav",
+]
+COPY_BLOCK_SIZE = 1024 * 1024
+
+def bundle_members(work_folder):
+    """Return (path, archive name) pairs for the stems and speaker files in work_folder."""
+    members = []
+    for component in MAIN_COMPONENTS:
+        file_path = os.path.join(work_folder, component)
+        if os.path.exists(file_path):
+            members.append((file_path, component))
+
+    speakers_dir = os.path.join(work_folder, "speakers")
+    if os.path.exists(speakers_dir):
+        for speaker_file in sorted(os.listdir(speakers_dir)):
+            if speaker_file.endswith('.wav'):
+                members.append((os.path.join(speakers_dir, speaker_file), os.path.join("speakers", speaker_file)))
+    return members
+
+def bundle_fingerprint(members):
+    """Hash member names, sizes and modification times; changes whenever a member does."""
+    hasher = hashlib.sha256()
+    for file_path, arcname in members:
+        stat = os.stat(file_path)
+        hasher.update(f"{arcname}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    return hasher.hexdigest()
+
+def cached_bundle_path(work_folder, fingerprint):
+    return os.path.join(work_folder, f"all_separated_files_{fingerprint[:16]}.zip")
+
+def bundle_size(members):
+    """
+    Size in bytes of the archive stream_bundle builds from members.
+
+    Every member is written as a local header, its stored data and a data
+    descriptor (the output is unseekable), followed by the central directory
+    and the end record. ZIP64 records are counted where zipfile adds them.
+
+    Args:
+        members (list): (path, archive name) pairs from bundle_members
+
+    Returns:
+        int: Total archive size
+    """
+    limit = zipfile.ZIP64_LIMIT
+    offset = 0
+    central_dir_size = 0
+    for file_path, arcname in members:
+        info = zipfile.ZipInfo.from_file(file_path, arcname, strict_timestamps=False)
+        name_length = len(info.filename.encode("utf-8"))
+        zip64 = info.file_size * 1.05 > limit  # Same test as ZipFile.open(..., "w")
+        local_header = zipfile.sizeFileHeader + name_length + len(info.extra) + (20 if zip64 else 0)
+        descriptor = struct.calcsize("<LLQQ" if zip64 else "<LLLL")
+        large_fields = (info.file_size > limit) * 2 + (offset > limit)
+        central_extra = 4 + 8 * large_fields if large_fields else 0
+        central_dir_size += zipfile.sizeCentralDir + name_length + len(info.extra) + central_extra
+        offset += local_header + info.file_size + descriptor
+    end_record = zipfile.sizeEndCentDir
+    if len(members) >= zipfile.ZIP_FILECOUNT_LIMIT or offset > limit or central_dir_size > limit:
+        end_record += zipfile.sizeEndCentDir64 + zipfile.sizeEndCentDir64Locator
+    return offset + central_dir_size + end_record
+
+class _TeeWriter:
+    """Unseekable file object for ZipFile that buffers output for the client and copies it to disk."""
+
+    def __init__(self, copy):
+        self._copy = copy
+        self._pending = []
+
+    def write(self, data):
+        data = bytes(data)
+        self._pending.append(data)
+        self._copy.write(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._pending)
+        self._pending.clear()
+        return data
+
+def stream_bundle(members, cache_path, on_cached=None):
+    """
+    Yield a ZIP_STORED archive of members block by block while writing it to cache_path.
+
+    The cached copy only appears once the archive is complete, so an aborted
+    download never leaves a truncated bundle behind.
+
+    Args:
+        members (list): (path, archive name) pairs from bundle_members
+        cache_path (str): Where the finished archive is kept
+        on_cached (callable, optional): Called with cache_path once the archive is complete
+
+    Yields:
+        bytes: Consecutive pieces of the archive
+    """
+    cache_dir = os.path.dirname(cache_path)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".bundle_", suffix=".tmp")
+    completed = False
+    try:
+        with span("bundle", members=len(members)) as attrs, os.fdopen(fd, "wb") as copy:
+            writer = _TeeWriter(copy)
+            with zipfile.ZipFile(writer, "w", zipfile.ZIP_STORED) as zipf:
+                for file_path, arcname in members:
+                    info = zipfile.ZipInfo.from_file(file_path, arcname, strict_timestamps=False)
+                    with open(file_path, "rb") as src, zipf.open(info, "w") as dst:
+                        while True:
+                            block = src.read(COPY_BLOCK_SIZE)
+                            if not block:
+                                break
+                            dst.write(block)
+                            yield writer.drain()
+            yield writer.drain()  # Central directory
+            attrs["bytes"] = copy.tell()
+        os.replace(tmp_path, cache_path)
+        completed = True
+        print(f"✓ Bundle cached: {cache_path}")
+        if on_cached:
+            on_cached(cache_path)
+    finally:
+        if not completed and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def get_bundle(work_folder, members=None, on_cached=None):
+    """
+    Return (cached_path, None) when an up-to-date bundle exists, else (None, chunk generator).
+
+    Args:
+        work_folder (str): Folder the bundle is cached in
+        members (list, optional): (path, archive name) pairs; defaults to bundle_members(work_folder)
+        on_cached (callable, optional): Passed on to stream_bundle
+
+    Raises:
+        FileNotFoundError: If there is nothing to bundle
+    """
+    if members is None:
+        members = bundle_members(work_folder)
+    if not members:
+        raise FileNotFoundError("No separated files to download")
+    cache_path = cached_bundle_path(work_folder, bundle_fingerprint(members))
+    if os.path.exists(cache_path):
+        CACHE_REQUESTS.inc(cache="bundle", result="hit")
+        return cache_path, None
+    CACHE_REQUESTS.inc(cache="bundle", result="miss")
+    return None, stream_bundle(members, cache_path, on_cached)
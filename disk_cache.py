@@ -0,0 +1,138 @@
+import os
+import time
+import shutil
+import hashlib
+import threading
+
+def file_digest(path, hasher=None, block_size=1 << 20):
+    """Return the SHA-256 hex digest of a file, read in blocks."""
+    hasher = hasher or hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+_fingerprints = {}
+
+def checkpoint_fingerprint(path):
+    """Digest of a model checkpoint, recomputed only when the file changes."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return "missing"
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _fingerprints:
+        _fingerprints[key] = file_digest(path)
+    return _fingerprints[key]
+
+class DiskCache:
+    """
+    Size-bounded on-disk store of entries keyed by content hash.
+
+    Each entry is a directory of files. An entry's directory mtime records
+    its last access, and once the total size goes over `max_bytes` the least
+    recently used entries are evicted.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """Return the entry directory for key and mark it as used, or None."""
+        entry_dir = self.entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            return None
+        try:
+            os.utime(entry_dir)
+        except OSError:
+            return None
+        return entry_dir
+
+    def put(self, key, files):
+        """
+        Copy files into a new entry.
+
+        Args:
+            key (str): Content hash of the entry
+            files (dict): Mapping of names inside the entry to source paths
+
+        Returns:
+            str: The entry directory
+        """
+        def copy_files(tmp_dir):
+            for name, source in files.items():
+                shutil.copyfile(source, os.path.join(tmp_dir, name))
+        return self.write(key, copy_files)
+
+    def write(self, key, fill):
+        """
+        Create a new entry by writing its files in place.
+
+        Args:
+            key (str): Content hash of the entry
+            fill (callable): Called with a temporary directory to write the entry's files into
+
+        Returns:
+            str: The entry directory
+        """
+        entry_dir = self.entry_dir(key)
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        try:
+            fill(tmp_dir)
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                # Another worker stored the same key first
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self.evict()
+        return entry_dir
+
+    def entries(self):
+        """Return (last_access, size, path) for every complete entry."""
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if ".tmp-" in name or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                print(f"Evicted cache entry: {os.path.basename(path)}")
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def prune_stale(self, max_age):
+        """Remove leftovers of interrupted writes older than max_age seconds."""
+        if not os.path.isdir(self.root):
+            return
+        current_time = time.time()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if ".tmp-" in name and current_time - os.path.getmtime(path) > max_age:
+                shutil.rmtree(path, ignore_errors=True)
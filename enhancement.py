@@ -1,54 +1,228 @@
-import torch
 import numpy as np
 import soundfile as sf
 import os
 import librosa
-from demucs.apply import apply_model
-from demucs.pretrained import get_model
-from huggingface_hub import HfApi
+from itertools import zip_longest
+from process import stream_windows, OverlapAddWriter, SAMPLE_RATE
+from model_registry import get_model
+from instrumentation import span
 
-# Load the pretrained model (only once)
-model = get_model("htdemucs")  # Change to "hdemucs_mmi" if needed
-model.cpu()  # Run on CPU
-print(" Enhancement Model Loaded Successfully")
+ENHANCEMENT_MODEL_NAME = "htdemucs"  # Change to "hdemucs_mmi" if needed
 
-def enhance_audio(input_path, output_path):
+def load_enhancement_model():
+    """Load the pretrained model (use get_model("enhancement") to share it)."""
+    from demucs.pretrained import get_model as get_pretrained_model
+
+    model = get_pretrained_model(ENHANCEMENT_MODEL_NAME)
+    model.cpu()  # Run on CPU
+    print(" Enhancement Model Loaded Successfully")
+    return model
+
+# Demucs settings, overridable per deployment to trade quality for throughput
+ENHANCE_SEGMENT = float(os.getenv("ENHANCE_SEGMENT")) if os.getenv("ENHANCE_SEGMENT") else None  # Model default
+ENHANCE_OVERLAP = float(os.getenv("ENHANCE_OVERLAP", 0.25))
+ENHANCE_SHIFTS = int(os.getenv("ENHANCE_SHIFTS", 1))
+ENHANCE_SPLIT = os.getenv("ENHANCE_SPLIT", "1") != "0"
+ENHANCE_NUM_WORKERS = int(os.getenv("ENHANCE_NUM_WORKERS", 0))  # Demucs CPU threads, 0 = inline
+# Seconds of audio enhanced per window; output is written to disk window by window.
+# Set ENHANCE_WINDOW=0 to process the whole stem in one call.
+ENHANCE_WINDOW = float(os.getenv("ENHANCE_WINDOW", 60))
+ENHANCE_WINDOW_OVERLAP = 1.0  # Seconds crossfaded between consecutive windows
+
+# "per_stem" runs the model on each stem separately, "batched" runs all stems
+# through it as one batch, and "mix" runs it once on the original upload and
+# fuses the matching source estimate with each separated stem.
+ENHANCE_MODE = os.getenv("ENHANCE_MODE", "per_stem")
+ENHANCE_MODES = ["per_stem", "batched", "mix"]
+# Source of the enhancement model matching each of our stems, used in "mix" mode
+ENHANCE_SOURCE_MAP = {"bass": "bass", "vocal": "vocals", "drum": "drums", "music": "other"}
+# Share of the enhancement model's estimate in a fused "mix" stem, the rest is the separated stem
+ENHANCE_FUSION_WEIGHT = float(os.getenv("ENHANCE_FUSION_WEIGHT", 0.5))
+
+def _separate_windows(batch, segment, overlap, shifts, split, num_workers):
+    """Run the enhancement model on [n, samples] mono windows and return [n, sources, 2, samples]."""
+    import torch
+    from demucs.apply import apply_model
+
+    model = get_model("enhancement")
+
+    # Convert mono to stereo (Demucs expects stereo input)
+    waveform = torch.from_numpy(np.stack([batch, batch], axis=1))  # Shape: [n, 2, samples]
+
+    # Apply the enhancement model
+    with torch.no_grad():
+        sources = apply_model(model, waveform, device="cpu", segment=segment, overlap=overlap,
+                              shifts=shifts, split=split, num_workers=num_workers)
+    return sources.numpy()
+
+def _enhance_waveform(y, segment, overlap, shifts, split, num_workers):
+    """Run the enhancement model on a mono waveform and return the [2, samples] result."""
+    sources = _separate_windows(np.asarray(y, dtype=np.float32)[np.newaxis], segment, overlap, shifts, split,
+                                num_workers)
+
+    # The enhanced signal is the average of the source estimates
+    return np.mean(sources[0], axis=0)
+
+def _fit_length(audio, length):
+    audio = audio[..., :length]
+    if audio.shape[-1] < length:
+        audio = np.pad(audio, [(0, 0)] * (audio.ndim - 1) + [(0, length - audio.shape[-1])])
+    return audio
+
+def _lockstep_windows(paths, window, length_from=0):
+    """
+    Read several files window by window in step and yield [len(paths), T] arrays.
+
+    Every window is cut or zero-padded to the longest window of paths[length_from:],
+    so the output follows the length of those files.
+    """
+    if not window:
+        audios = [librosa.load(path, sr=SAMPLE_RATE)[0] for path in paths]
+        length = max(len(audio) for audio in audios[length_from:])
+        yield np.stack([_fit_length(audio, length) for audio in audios])
+        return
+    readers = [stream_windows(path, segment_length=window, overlap=ENHANCE_WINDOW_OVERLAP) for path in paths]
+    empty = np.zeros(0, dtype=np.float32)
+    for windows in zip_longest(*readers, fillvalue=empty):
+        length = max(len(w) for w in windows[length_from:])
+        if length:
+            yield np.stack([_fit_length(w, length) for w in windows])
+
+def enhance_audio(input_path, output_path, segment=ENHANCE_SEGMENT, overlap=ENHANCE_OVERLAP,
+                  shifts=ENHANCE_SHIFTS, split=ENHANCE_SPLIT, num_workers=ENHANCE_NUM_WORKERS,
+                  window=ENHANCE_WINDOW):
+    """
+    Denoise one audio file with the enhancement model.
+
+    Args:
+        input_path (str): Audio file to enhance
+        output_path (str): Where to write the 16-bit stereo result
+        segment (float, optional): Demucs segment length in seconds (None = model default)
+        overlap (float): Overlap between Demucs segments
+        shifts (int): Number of random shifts averaged by Demucs
+        split (bool): Let Demucs split the input into segments
+        num_workers (int): Demucs CPU worker threads
+        window (float): Seconds processed and written per window; 0 or None loads the whole file
+
+    Returns:
+        bool: True if the enhanced file was written
+    """
     if not os.path.exists(input_path):
         print(f"File not found: {input_path}")
         return False
     
+    settings = dict(segment=segment, overlap=overlap, shifts=shifts, split=split, num_workers=num_workers)
     try:
-        # Load the audio file
-        y, sr = librosa.load(input_path, sr=44100)  # Load as mono
         print(f"🔹 Processing: {input_path}")
+        with span("enhance_stem", file=os.path.basename(input_path), bytes=os.path.getsize(input_path)):
+            if not window:
+                # Load the audio file
+                y, sr = librosa.load(input_path, sr=SAMPLE_RATE)  # Load as mono
+                denoised_signal = _enhance_waveform(y, **settings)
+
+                # Save the denoised audio
+                sf.write(output_path, denoised_signal.T, sr, format='WAV', subtype='PCM_16')
+            else:
+                # Enhance window by window so memory stays bounded on long stems
+                overlap_samples = int(SAMPLE_RATE * ENHANCE_WINDOW_OVERLAP)
+                with OverlapAddWriter([output_path], SAMPLE_RATE, overlap_samples, channels=2, subtype='PCM_16') as writer:
+                    for y in stream_windows(input_path, segment_length=window, overlap=ENHANCE_WINDOW_OVERLAP):
+                        writer.write(_enhance_waveform(y, **settings)[np.newaxis])
+        print(f"✓ Denoised file saved: {output_path}")
+        return True
+    except Exception as e:
+        print(f"Error processing {input_path}: {str(e)}")
+        return False
 
-        # Convert mono to stereo (Demucs expects stereo input)
-        y_stereo = np.stack([y, y], axis=0)  # [2, samples]
-        waveform = torch.tensor(y_stereo).unsqueeze(0)  # Shape: [1, 2, samples]
+def enhance_batched(input_files, output_files, segment=ENHANCE_SEGMENT, overlap=ENHANCE_OVERLAP,
+                    shifts=ENHANCE_SHIFTS, split=ENHANCE_SPLIT, num_workers=ENHANCE_NUM_WORKERS,
+                    window=ENHANCE_WINDOW):
+    """
+    Denoise several stems of the same length with one model call per window.
 
-        # Apply the enhancement model
-        with torch.no_grad():
-            sources = apply_model(model, waveform, device="cpu")
+    Gives the same result as enhance_audio on each stem, with the stems
+    stacked into one batch.
 
-        # Extract the enhanced signal
-        denoised_signal = sources[0].numpy()
-        denoised_signal = np.mean(denoised_signal, axis=0)  # Convert back to mono
+    Args:
+        input_files (list): Audio files to enhance
+        output_files (list): Where to write the 16-bit stereo results, in the same order
+        window (float): Seconds processed and written per window; 0 or None loads the whole files
 
-        # Save the denoised audio
-        sf.write(output_path, denoised_signal.T, sr, format='WAV', subtype='PCM_16')
-        print(f"✓ Denoised file saved: {output_path}")
+    Returns:
+        bool: True if the enhanced files were written
+    """
+    settings = dict(segment=segment, overlap=overlap, shifts=shifts, split=split, num_workers=num_workers)
+    try:
+        print(f"🔹 Processing {len(input_files)} stems in one batch")
+        with span("enhance_batch", stems=len(input_files), bytes=sum(os.path.getsize(p) for p in input_files)):
+            overlap_samples = int(SAMPLE_RATE * ENHANCE_WINDOW_OVERLAP)
+            with OverlapAddWriter(output_files, SAMPLE_RATE, overlap_samples, channels=2, subtype='PCM_16') as writer:
+                for batch in _lockstep_windows(input_files, window):
+                    writer.write(np.mean(_separate_windows(batch, **settings), axis=1))
+        print(f"✓ Denoised files saved: {', '.join(output_files)}")
         return True
     except Exception as e:
-        print(f"Error processing {input_path}: {str(e)}")
+        print(f"Error processing batch: {str(e)}")
         return False
 
-def enhance_all_components(input_files, output_folder=None):
+def enhance_from_mix(mixture_path, input_files, output_files, weight=ENHANCE_FUSION_WEIGHT,
+                     segment=ENHANCE_SEGMENT, overlap=ENHANCE_OVERLAP, shifts=ENHANCE_SHIFTS, split=ENHANCE_SPLIT,
+                     num_workers=ENHANCE_NUM_WORKERS, window=ENHANCE_WINDOW):
+    """
+    Denoise separated stems with a single enhancement model pass over the original mix.
+
+    Each stem is blended with the model's estimate of the same source in the
+    mix. Per-stem enhancement averages the model's source estimates, which
+    add up to its input, so the fused stems are scaled the same way to keep
+    the output level of enhance_audio.
+
+    Args:
+        mixture_path (str): The original upload
+        input_files (dict): Stem names (keys of ENHANCE_SOURCE_MAP) mapped to the separated files
+        output_files (dict): Stem names mapped to where the 16-bit stereo results are written
+        weight (float): Share of the model's estimate in the fused stem, from 0 to 1
+
+    Returns:
+        bool: True if the enhanced files were written
+    """
+    settings = dict(segment=segment, overlap=overlap, shifts=shifts, split=split, num_workers=num_workers)
+    names = list(input_files)
+    try:
+        sources = list(get_model("enhancement").sources)
+        indices = [sources.index(ENHANCE_SOURCE_MAP[name]) for name in names]
+        print(f"🔹 Processing {mixture_path} once for {len(names)} stems")
+        with span("enhance_mix", stems=len(names), bytes=os.path.getsize(mixture_path)):
+            overlap_samples = int(SAMPLE_RATE * ENHANCE_WINDOW_OVERLAP)
+            paths = [mixture_path] + [input_files[name] for name in names]
+            with OverlapAddWriter([output_files[name] for name in names], SAMPLE_RATE, overlap_samples,
+                                  channels=2, subtype='PCM_16') as writer:
+                for batch in _lockstep_windows(paths, window, length_from=1):
+                    estimates = _separate_windows(batch[:1], **settings)[0, indices]  # [stems, 2, T]
+                    stems = batch[1:, np.newaxis, :]
+                    writer.write((weight * estimates + (1.0 - weight) * stems) / len(sources))
+        print(f"✓ Denoised files saved: {', '.join(output_files.values())}")
+        return True
+    except Exception as e:
+        print(f"Error processing {mixture_path}: {str(e)}")
+        return False
+
+def _is_readable(path):
+    """Check whether libsndfile can open an audio file."""
+    try:
+        sf.info(path)
+        return True
+    except Exception:
+        return False
+
+def enhance_all_components(input_files, output_folder=None, mode=None, mixture_path=None):
     """
     Enhance multiple audio files.
     
     Args:
         input_files (dict): Dictionary mapping component names to their file paths
         output_folder (str, optional): Folder to save enhanced files. If None, uses same folder as input
+        mode (str, optional): "per_stem", "batched" or "mix"; defaults to ENHANCE_MODE
+        mixture_path (str, optional): Original upload, required by "mix" mode
     """
     if not input_files:
         print("No input files provided")
@@ -63,6 +237,34 @@ def enhance_all_components(input_files, output_folder=None):
     
     # Dictionary to store enhanced file paths
     enhanced_files = {}
+
+    mode = mode or ENHANCE_MODE
+    if mode not in ENHANCE_MODES:
+        raise ValueError(f"Unknown enhancement mode: {mode}")
+    if mode == "mix" and not (mixture_path and os.path.exists(mixture_path)
+                              and set(input_files) <= set(ENHANCE_SOURCE_MAP)):
+        print("Original mix not available, enhancing the stems as one batch")
+        mode = "batched"
+    if mode == "mix" and not _is_readable(mixture_path):
+        # The mix is read window by window with libsndfile, which cannot decode e.g. m4a
+        print("Original mix format not supported for streaming, enhancing each stem")
+        mode = "per_stem"
+    if mode != "per_stem":
+        found = {name: path for name, path in input_files.items() if os.path.exists(path)}
+        for name in set(input_files) - set(found):
+            print(f"File {input_files[name]} not found.")
+        if not found:
+            return enhanced_files
+        output_files = {name: os.path.join(output_folder, f"denoised_{os.path.basename(path)}")
+                        for name, path in found.items()}
+        if mode == "mix":
+            ok = enhance_from_mix(mixture_path, found, output_files)
+        else:
+            ok = enhance_batched(list(found.values()), list(output_files.values()))
+        if not ok:
+            print(f"Failed to enhance {', '.join(found)}")
+            return enhanced_files
+        return output_files
     
     # Enhance each file
     for component_name, input_path in input_files.items():
@@ -107,6 +309,7 @@ def main():
     print("\nEnhanced files:", enhanced_files)
 
     # Test token access
+    from huggingface_hub import HfApi
     api = HfApi(token="your_token")
     api.model_info("pyannote/speaker-diarization-3.1")
 
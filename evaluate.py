@@ -0,0 +1,183 @@
+"""
+Score a separation checkpoint on the preprocessed test set.
+
+Segments are read from the memory-mapped shards by DataLoader workers, and
+separated in batches. SI-SNR and SDR are computed per segment and stem as
+batched tensor operations, then averaged per stem and per track. The
+summary is appended as one row of a CSV in the training_metrics.csv format
+read by evaluation.ipynb (Epoch, Train_Loss, Val_Loss, Avg_SDR, plus per-stem
+columns). Per-track scores go to a second CSV, and everything is written to
+JSON.
+
+Usage:
+    python evaluate.py --shards data/shards --epoch 100
+    python evaluate.py --variant optimized --output evaluation_metrics.csv
+"""
+import argparse
+import csv
+import json
+import os
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from sklearn.model_selection import train_test_split
+from audio_metrics import si_snr, sdr
+from training_data import ShardDataset, load_manifest
+from separation_model import load_checkpoint, get_device, LABELS, MODEL_PATH, OPTIMIZED_MODEL_PATH
+
+SPLITS = ["test", "val", "train", "all"]
+
+def split_indices(num_segments, split, val_ratio=0.15, test_ratio=0.15, seed=42):
+    """Segment indices of a split, using the same train_test_split calls as train_model.ipynb."""
+    indices = np.arange(num_segments)
+    if split == "all":
+        return indices
+    train_idx, temp_idx = train_test_split(indices, test_size=(val_ratio + test_ratio), random_state=seed)
+    if split == "train":
+        return train_idx
+    val_idx, test_idx = train_test_split(temp_idx, test_size=(test_ratio / (val_ratio + test_ratio)),
+                                         random_state=seed)
+    return val_idx if split == "val" else test_idx
+
+def segment_tracks(manifest):
+    """Track name of every segment, in shard order."""
+    return [track["name"] for track in manifest["tracks"] for _ in range(track["segments"])]
+
+def load_variant(variant, path=None):
+    """Load the fp32 checkpoint or the optimized TorchScript artifact for evaluation."""
+    path = path or (OPTIMIZED_MODEL_PATH if variant == "optimized" else MODEL_PATH)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Model file not found: {path}")
+    if variant == "optimized":
+        return torch.jit.load(path, map_location="cpu").eval()
+    return load_checkpoint(path).eval()
+
+def variant_device(variant):
+    """Device a loaded variant runs on: load_checkpoint's device, or the CPU for the quantized artifact."""
+    return torch.device("cpu") if variant == "optimized" else get_device()
+
+def score_batches(model, loader, device):
+    """
+    Separate every batch and score it.
+
+    Separation and scoring run in this process, one batch at a time; the
+    DataLoader workers only read segments from the shards.
+
+    Args:
+        model: Separation model, already on device
+        loader (DataLoader): Yields (song, *stems) batches
+        device (torch.device): Device the batches are moved to
+
+    Returns:
+        tuple: (si_snr, sdr) arrays of shape [segments, stems], in loader order
+    """
+    si_snr_scores, sdr_scores = [], []
+    with torch.no_grad():
+        for song, *stems in loader:
+            targets = torch.stack(stems, dim=1).to(device)  # [B, stems, T]
+            outputs = model(song.unsqueeze(1).to(device))
+            length = targets.shape[-1]
+            if outputs.shape[-1] < length:
+                outputs = F.pad(outputs, (0, length - outputs.shape[-1]))
+            outputs = outputs[..., :length]
+            si_snr_scores.append(si_snr(outputs, targets).cpu())
+            sdr_scores.append(sdr(outputs, targets).cpu())
+    return torch.cat(si_snr_scores).numpy(), torch.cat(sdr_scores).numpy()
+
+def summarize(si_snr_scores, sdr_scores, tracks):
+    """
+    Average the [segments, stems] scores per stem and per track.
+
+    Returns:
+        dict: Overall means, per-stem means and per-track per-stem means
+    """
+    names, track_ids = np.unique(tracks, return_inverse=True)
+    counts = np.bincount(track_ids, minlength=len(names))[:, None]
+    per_track = {}
+    for metric, scores in (("si_snr", si_snr_scores), ("sdr", sdr_scores)):
+        sums = np.zeros((len(names), scores.shape[1]))
+        np.add.at(sums, track_ids, scores)
+        per_track[metric] = sums / counts
+    return {
+        "segments": int(len(tracks)),
+        "si_snr": float(si_snr_scores.mean()),
+        "sdr": float(sdr_scores.mean()),
+        "per_stem": {label: {"si_snr": float(si_snr_scores[:, i].mean()), "sdr": float(sdr_scores[:, i].mean())}
+                     for i, label in enumerate(LABELS)},
+        "per_track": {str(name): {"segments": int(counts[t, 0]),
+                                  **{label: {"si_snr": float(per_track["si_snr"][t, i]),
+                                             "sdr": float(per_track["sdr"][t, i])}
+                                     for i, label in enumerate(LABELS)}}
+                      for t, name in enumerate(names)},
+    }
+
+def write_metrics_csv(path, epoch, summary):
+    """Append one training_metrics-style row; Val_Loss is the negative SI-SNR like the training loss."""
+    row = {"Epoch": epoch, "Train_Loss": "", "Val_Loss": -summary["si_snr"], "Avg_SDR": summary["sdr"]}
+    for label, scores in summary["per_stem"].items():
+        row[f"SI_SNR_{label}"] = scores["si_snr"]
+        row[f"SDR_{label}"] = scores["sdr"]
+    new_file = not os.path.exists(path)
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(row))
+        if new_file:
+            writer.writeheader()
+        writer.writerow(row)
+
+def write_tracks_csv(path, epoch, summary):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Epoch", "Track", "Stem", "SI_SNR", "SDR", "Segments"])
+        for track, scores in summary["per_track"].items():
+            for label in LABELS:
+                writer.writerow([epoch, track, label, scores[label]["si_snr"], scores[label]["sdr"],
+                                 scores["segments"]])
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a separation checkpoint on the preprocessed test set.")
+    parser.add_argument("--shards", default=os.path.join("data", "shards"), help="Output folder of training_data.py")
+    parser.add_argument("--variant", choices=["fp32", "optimized"], default="fp32")
+    parser.add_argument("--model", help="Checkpoint or artifact path (default: the variant's standard path)")
+    parser.add_argument("--split", choices=SPLITS, default="test")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4, help="DataLoader worker processes")
+    parser.add_argument("--threads", type=int, default=0, help="Torch CPU threads (0 = torch default)")
+    parser.add_argument("--epoch", default="eval", help="Value of the Epoch column (e.g. the checkpoint's epoch)")
+    parser.add_argument("--output", default="evaluation_metrics.csv", help="CSV the summary row is appended to")
+    parser.add_argument("--tracks-output", help="Per-track CSV (default: <output>_tracks.csv)")
+    parser.add_argument("--json", help="Full report (default: <output>.json)")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    base, _ = os.path.splitext(args.output)
+
+    manifest = load_manifest(args.shards)
+    indices = split_indices(sum(shard["segments"] for shard in manifest["shards"]), args.split)
+    tracks = np.asarray(segment_tracks(manifest))[indices]
+    dataset = ShardDataset(args.shards, indices, random_crop=False)
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.workers)
+    print(f"🔹 Evaluating {args.variant} model on {len(dataset)} {args.split} segments")
+
+    model = load_variant(args.variant, args.model)
+    start = time.perf_counter()
+    si_snr_scores, sdr_scores = score_batches(model, loader, variant_device(args.variant))
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(si_snr_scores, sdr_scores, tracks)
+    summary.update({"epoch": args.epoch, "variant": args.variant, "split": args.split, "seconds": elapsed,
+                    "audio_seconds": len(dataset) * dataset.crop_length / manifest["sample_rate"]})
+    for label, scores in summary["per_stem"].items():
+        print(f"   {label}: SI-SNR {scores['si_snr']:.2f} dB  SDR {scores['sdr']:.2f} dB")
+    print(f"   mean: SI-SNR {summary['si_snr']:.2f} dB  SDR {summary['sdr']:.2f} dB  ({elapsed:.1f}s)")
+
+    write_metrics_csv(args.output, args.epoch, summary)
+    write_tracks_csv(args.tracks_output or f"{base}_tracks.csv", args.epoch, summary)
+    with open(args.json or f"{base}.json", "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"✓ Metrics written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+Timing spans and Prometheus-style metrics for the processing pipeline.
+
+Every span is logged as one JSON line on the "audio_pipeline.spans" logger
+(stderr by default, or SPAN_LOG_FILE) and recorded in the stage latency
+histogram. Metrics are kept in memory. Once share_metrics() is called before
+forking server workers or spawning model pools, every process also writes
+its metrics to its own file in METRICS_DIR every METRICS_FLUSH_INTERVAL
+seconds and at exit, and render_metrics() adds up all of them in the
+Prometheus text exposition format.
+"""
+import atexit
+import json
+import logging
+import multiprocessing.util
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+span_logger = logging.getLogger("audio_pipeline.spans")
+if not span_logger.handlers:
+    _handler = logging.FileHandler(os.environ["SPAN_LOG_FILE"]) if os.getenv("SPAN_LOG_FILE") else logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    span_logger.addHandler(_handler)
+    span_logger.setLevel(logging.INFO)
+    span_logger.propagate = False
+
+# Folder shared by the processes of one server run, set by share_metrics() and
+# passed on to child processes through the environment
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))  # Seconds between writes of a process's file
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name, self.documentation = name, documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _metrics_changed()
+
+    def value(self, **labels):
+        """Value counted by this process."""
+        return self._values.get(_label_key(labels), 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def combine(total, value):
+        return total + value
+
+    def render(self, values=None):
+        """Render the given {label key: value} totals, or this process's values."""
+        values = self.snapshot() if values is None else values
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name, self.documentation = name, documentation
+        self.buckets = tuple(buckets)
+        self._series = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+        _metrics_changed()
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(series) for key, series in self._series.items()}
+
+    def reset(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def combine(total, series):
+        return [a + b for a, b in zip(total, series)]
+
+    def render(self, values=None):
+        """Render the given {label key: series} totals, or this process's series."""
+        values = self.snapshot() if values is None else values
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(values.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+STAGE_SECONDS = Histogram("pipeline_stage_seconds", "Duration of pipeline stages in seconds")
+JOB_SECONDS = Histogram("pipeline_job_seconds", "End-to-end duration of processing jobs in seconds")
+JOBS = Counter("pipeline_jobs_total", "Processing jobs by status")
+CHUNKS = Counter("pipeline_chunks_total", "Audio chunks separated")
+SILENT_CHUNKS = Counter("pipeline_silent_chunks_total", "Silent chunks given zero stems without running the model")
+AUDIO_SECONDS = Counter("pipeline_audio_seconds_total", "Seconds of input audio processed")
+CACHE_REQUESTS = Counter("pipeline_cache_requests_total", "Cache lookups by cache and result")
+METRICS = [STAGE_SECONDS, JOB_SECONDS, JOBS, CHUNKS, SILENT_CHUNKS, AUDIO_SECONDS, CACHE_REQUESTS]
+
+_metrics_file = None  # Name of this process's file in METRICS_DIR, chosen on the first write
+_metrics_file_lock = threading.Lock()
+_metrics_dirty = False  # Updated since the last write
+_flusher = None
+
+def _metrics_changed():
+    """Note an update; with METRICS_DIR set, a background thread writes it out."""
+    global _metrics_dirty, _flusher
+    _metrics_dirty = True
+    if METRICS_DIR and _flusher is None:
+        with _metrics_file_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_periodically, name="metrics-flush", daemon=True)
+                _flusher.start()
+                # Pool workers leave through multiprocessing, which runs its finalizers but not atexit handlers
+                multiprocessing.util.Finalize(None, flush_metrics, exitpriority=0)
+
+def _flush_periodically():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush_metrics()
+
+def flush_metrics():
+    """Write this process's metrics to its file in METRICS_DIR, if they changed since the last write."""
+    global _metrics_file, _metrics_dirty
+    if not METRICS_DIR:
+        return
+    with _metrics_file_lock:
+        if not _metrics_dirty:
+            return
+        _metrics_dirty = False
+        # The random part keeps a reused pid from overwriting the file of an exited process
+        _metrics_file = _metrics_file or f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+        data = {metric.name: [[list(key), value] for key, value in metric.snapshot().items()] for metric in METRICS}
+        path = os.path.join(METRICS_DIR, _metrics_file)
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                json.dump(data, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Warning: Could not write metrics: {str(e)}")
+
+def share_metrics():
+    """
+    Report this process's metrics, and those of the processes it starts from now on, through METRICS_DIR.
+
+    Called before forking server workers or spawning model pools. Without a
+    configured METRICS_DIR, a temporary one is created and removed at exit.
+    """
+    global METRICS_DIR, _metrics_dirty
+    if not METRICS_DIR:
+        METRICS_DIR = tempfile.mkdtemp(prefix="audio_pipeline_metrics-")
+        atexit.register(_remove_metrics_dir, METRICS_DIR, os.getpid())
+    os.environ["METRICS_DIR"] = METRICS_DIR
+    _metrics_dirty = True  # Include what was counted before sharing started
+    flush_metrics()
+
+def _remove_metrics_dir(path, owner):
+    if os.getpid() == owner:
+        shutil.rmtree(path, ignore_errors=True)
+
+def _reset_metrics_after_fork():
+    """A forked child starts counting from zero; its parent keeps reporting what it counted."""
+    global _metrics_file, _metrics_file_lock, _metrics_dirty, _flusher
+    _metrics_file = None
+    _metrics_file_lock = threading.Lock()
+    _metrics_dirty = False
+    _flusher = None
+    for metric in METRICS:
+        metric.reset()
+
+os.register_at_fork(after_in_child=_reset_metrics_after_fork)
+atexit.register(flush_metrics)
+
+def collect_metrics():
+    """
+    Add up the metrics written by every process, including those that have exited.
+
+    Returns:
+        dict: Metric name -> {label key: total}
+    """
+    totals = {metric.name: {} for metric in METRICS}
+    combine = {metric.name: metric.combine for metric in METRICS}
+    try:
+        names = [name for name in os.listdir(METRICS_DIR) if name.endswith(".json")]
+    except OSError:
+        names = []
+    for name in names:
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric_name, series in data.items():
+            if metric_name not in totals:
+                continue
+            for key, value in series:
+                key = tuple(tuple(pair) for pair in key)
+                current = totals[metric_name].get(key)
+                totals[metric_name][key] = value if current is None else combine[metric_name](current, value)
+    return totals
+
+def process_peak_rss_mb():
+    """Peak resident set size of this process over its whole lifetime, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def current_rss_mb():
+    """Current resident set size of this process in MB, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+def _round(value):
+    return None if value is None else round(value, 1)
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a block, then log it as a JSON line and record it in STAGE_SECONDS.
+
+    The yielded dict can be filled in inside the block (e.g. audio_seconds,
+    bytes, chunks); its contents are added to the log record.
+    """
+    start = time.perf_counter()
+    rss_start = current_rss_mb()
+    status = "ok"
+    try:
+        yield attributes
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        record = {"span": name, "status": status, "seconds": round(elapsed, 6),
+                  "rss_mb_start": _round(rss_start), "rss_mb_end": _round(current_rss_mb()),
+                  "process_peak_rss_mb": round(process_peak_rss_mb(), 1), "pid": os.getpid(),
+                  "thread": threading.current_thread().name}
+        record.update(attributes)
+        span_logger.info(json.dumps(record, default=str))
+
+def render_metrics():
+    """All metrics, added up over every sharing process, in the Prometheus text exposition format."""
+    if METRICS_DIR:
+        flush_metrics()
+        totals = collect_metrics()
+    else:
+        totals = {metric.name: metric.snapshot() for metric in METRICS}
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render(totals[metric.name]))
+    return "\n".join(lines) + "\n"
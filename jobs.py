@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import shutil
+import threading
+from contextlib import contextmanager
+from instrumentation import JOBS, JOB_SECONDS
+
+try:
+    import fcntl
+except ImportError:  # Windows: job.json updates are only serialized within the process
+    fcntl = None
+
+JOBS_FOLDER = os.path.join("static", "uploads", "jobs")
+NUM_WORKERS = int(os.getenv("JOB_WORKERS", 2))  # Background workers processing uploads
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+class JobQueue:
+    """
+    Run uploads through a handler on a pool of background worker threads.
+
+    Every job gets its own working directory under `jobs_folder`, and its
+    state is kept in a job.json file there, so status lookups never depend
+    on which thread or process handled the job. Updates to job.json hold a
+    file lock, so worker processes sharing the folder do not overwrite each
+    other's changes.
+    """
+
+    def __init__(self, handler, jobs_folder=JOBS_FOLDER, num_workers=NUM_WORKERS):
+        self.handler = handler
+        self.jobs_folder = jobs_folder
+        self.num_workers = num_workers
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+
+    def start(self):
+        """Start the worker threads (called lazily by submit)."""
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            print(f"✓ Started {self.num_workers} job workers")
+
+    def job_dir(self, job_id):
+        """Return the working directory of a job, rejecting malformed ids."""
+        if not job_id or not JOB_ID_PATTERN.match(job_id):
+            raise ValueError(f"Invalid job id: {job_id}")
+        return os.path.join(self.jobs_folder, job_id)
+
+    def create_job(self, filename):
+        """Create a job directory and return (job_id, path to save the upload to)."""
+        job_id = uuid.uuid4().hex
+        job_dir = self.job_dir(job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        self._write_state(job_id, {
+            "id": job_id,
+            "status": "created",
+            "filename": filename,
+            "created": time.time(),
+        })
+        return job_id, os.path.join(job_dir, os.path.basename(filename))
+
+    def submit(self, job_id, filepath, **options):
+        """Queue a created job for processing; options are passed on to the handler."""
+        self.update(job_id, status="queued", options=options)
+        JOBS.inc(status="queued")
+        self._queue.put((job_id, filepath, options, None))
+        self.start()
+
+    def submit_outputs(self, job_id, filepath, names, **options):
+        """
+        Queue more outputs of a finished job, unless they exist or are already queued.
+
+        The names are recorded under "pending" in job.json until the handler
+        finishes, and its files are then added to the job's "files". The job
+        keeps its "done" status throughout. Outputs whose file has since been
+        removed (e.g. expired) are dropped from "files" and queued again.
+
+        Args:
+            job_id (str): Id of a finished job
+            filepath (str): Input file passed to the handler
+            names (list): Output names the handler run produces
+            **options: Passed on to the handler
+
+        Returns:
+            dict: The job state, or None if the job is not finished
+        """
+        with self._state_lock(job_id):
+            state = self.get(job_id)
+            if not state or state.get("status") != "done":
+                return None
+            job_dir = self.job_dir(job_id)
+            files = state.get("files", {})
+            state["files"] = {name: filename for name, filename in files.items()
+                              if os.path.exists(os.path.join(job_dir, filename))}
+            # Entries of a process that died before finishing them are queued again
+            pending = {name: owner for name, owner in state.get("pending", {}).items() if _is_alive(owner["pid"])}
+            new = [name for name in names if name not in pending and name not in state["files"]]
+            for name in new:
+                pending[name] = {"pid": os.getpid(), "queued": time.time()}
+                state.get("errors", {}).pop(name, None)
+            state["pending"] = pending
+            self._write_state(job_id, state)
+        if new:
+            self._queue.put((job_id, filepath, options, new))
+            self.start()
+        return state
+
+    def get(self, job_id):
+        """Return the state of a job, or None if it does not exist."""
+        state_path = os.path.join(self.job_dir(job_id), "job.json")
+        try:
+            with open(state_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def update(self, job_id, **fields):
+        with self._state_lock(job_id):
+            state = self.get(job_id) or {"id": job_id}
+            state.update(fields)
+            self._write_state(job_id, state)
+        return state
+
+    @contextmanager
+    def _state_lock(self, job_id):
+        """Hold the job's state lock, shared with other processes when fcntl is available."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.job_dir(job_id), "job.lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_state(self, job_id, state):
+        state_path = os.path.join(self.job_dir(job_id), "job.json")
+        tmp_path = state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, state_path)
+
+    def _work(self):
+        while True:
+            job_id, filepath, options, names = self._queue.get()
+            if names:
+                try:
+                    self._add_outputs(job_id, filepath, options, names)
+                finally:
+                    self._queue.task_done()
+                continue
+            started = time.time()
+            try:
+                print(f"\n=== Job {job_id}: starting ===")
+                self.update(job_id, status="running", started=started)
+                files = self.handler(filepath, self.job_dir(job_id), **options)
+                files = {name: os.path.basename(path) for name, path in (files or {}).items()}
+                if not files:
+                    raise RuntimeError("Processing produced no output files")
+                self.update(job_id, status="done", finished=time.time(), files=files)
+                JOBS.inc(status="done")
+                print(f"=== Job {job_id}: completed ===")
+            except Exception as e:
+                print(f"Error in job {job_id}: {str(e)}")
+                self.update(job_id, status="failed", finished=time.time(), error=str(e))
+                JOBS.inc(status="failed")
+            finally:
+                JOB_SECONDS.observe(time.time() - started)
+                self._queue.task_done()
+
+    def _add_outputs(self, job_id, filepath, options, names):
+        files, error = {}, "Processing produced no output files"
+        try:
+            print(f"\n=== Job {job_id}: computing {', '.join(names)} ===")
+            files = self.handler(filepath, self.job_dir(job_id), **options)
+            files = {name: os.path.basename(path) for name, path in (files or {}).items()}
+            if not files:
+                raise RuntimeError("Processing produced no output files")
+            print(f"=== Job {job_id}: added {', '.join(files)} ===")
+        except Exception as e:
+            print(f"Error in job {job_id}: {str(e)}")
+            error = str(e)
+        with self._state_lock(job_id):
+            state = self.get(job_id) or {"id": job_id}
+            state.setdefault("files", {}).update(files)
+            for name in names:
+                state.get("pending", {}).pop(name, None)
+                if name not in files:
+                    # Reported by the job status; the next request for it retries
+                    state.setdefault("errors", {})[name] = error
+            self._write_state(job_id, state)
+
+    def cleanup_old_jobs(self, max_age, keep=None):
+        """
+        Remove finished or failed job directories older than max_age seconds.
+
+        Args:
+            max_age (float): Minimum age in seconds of removed job directories
+            keep (callable, optional): Called with a job id; jobs it returns True for are kept
+
+        Returns:
+            list: Ids of the removed jobs
+        """
+        removed = []
+        if not os.path.isdir(self.jobs_folder):
+            return removed
+        current_time = time.time()
+        for job_id in os.listdir(self.jobs_folder):
+            try:
+                state = self.get(job_id)
+                if state and (state.get("status") not in ("done", "failed") or state.get("pending")):
+                    continue
+                if keep and keep(job_id):
+                    continue
+                job_dir = self.job_dir(job_id)
+                if current_time - os.path.getmtime(job_dir) > max_age:
+                    shutil.rmtree(job_dir)
+                    removed.append(job_id)
+                    print(f"Cleaned up old job: {job_id}")
+            except Exception as e:
+                print(f"Error cleaning up job {job_id}: {str(e)}")
+        return removed
+
+def _is_alive(pid):
+    """Check whether a process with this pid is running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Running under another user
+    return True
@@ -0,0 +1,116 @@
+import importlib
+import threading
+import time
+
+# Model name -> (module, loader function). Modules are imported on first use,
+# so torch, demucs and pyannote are only imported when a model is needed.
+MODEL_LOADERS = {
+    "separation": ("separation_model", "load_model"),
+    "enhancement": ("enhancement", "load_enhancement_model"),
+    "diarization": ("speaker_separation", "load_diarization_pipeline"),
+}
+
+_models = {}
+_lock = threading.Lock()
+_loading_locks = {name: threading.Lock() for name in MODEL_LOADERS}
+
+def get_model(name):
+    """
+    Return the shared instance of a model, loading it on first use.
+
+    Args:
+        name (str): One of MODEL_LOADERS ("separation", "enhancement", "diarization")
+
+    Returns:
+        The loaded model, shared by every caller in this process
+    """
+    if name in _models:
+        return _models[name]
+    if name not in MODEL_LOADERS:
+        raise ValueError(f"Unknown model: {name}")
+
+    # One lock per model so a slow load does not block the others
+    with _loading_locks[name]:
+        if name not in _models:
+            module_name, loader_name = MODEL_LOADERS[name]
+            loader = getattr(importlib.import_module(module_name), loader_name)
+            print(f"🔄 Loading {name} model...")
+            start = time.time()
+            model = loader()
+            with _lock:
+                _models[name] = model
+            print(f"✓ {name} model ready in {time.time() - start:.1f}s")
+    return _models[name]
+
+def set_model(name, model):
+    """Install an already built model instance (e.g. a stand-in for benchmarks or tests)."""
+    if name not in MODEL_LOADERS:
+        raise ValueError(f"Unknown model: {name}")
+    with _lock:
+        _models[name] = model
+
+def is_loaded(name):
+    return name in _models
+
+def warmup(names=None):
+    """
+    Load models ahead of the first request.
+
+    Args:
+        names (list, optional): Models to load; defaults to all of them.
+            Failures are reported and skipped so one missing model (e.g. no
+            HuggingFace token) does not block the others.
+
+    Returns:
+        list: Names of the models that are loaded
+    """
+    for name in names or MODEL_LOADERS:
+        try:
+            get_model(name)
+        except Exception as e:
+            print(f"Warning: Could not warm up {name} model: {str(e)}")
+    return [name for name in MODEL_LOADERS if is_loaded(name)]
+
+def _torch_modules(obj, depth=2):
+    """Find the torch modules of a model: the model itself, or modules among its attributes (e.g. pyannote)."""
+    import torch
+
+    if isinstance(obj, torch.nn.Module):
+        return [obj]
+    if depth == 0 or not hasattr(obj, "__dict__"):
+        return []
+    modules = []
+    for value in vars(obj).values():
+        modules.extend(_torch_modules(value, depth - 1))
+    return modules
+
+def share_models():
+    """
+    Move the weights of every loaded model into shared memory.
+
+    Called in a pre-fork server's master process: the forked workers then
+    map the same weight pages instead of each holding a copy.
+
+    Returns:
+        list: Names of the models whose weights are shared
+    """
+    shared = []
+    for name, model in list(_models.items()):
+        modules = _torch_modules(model)
+        try:
+            for module in modules:
+                module.share_memory()
+        except Exception as e:
+            print(f"Warning: Could not share {name} model weights: {str(e)}")
+            continue
+        if modules:
+            shared.append(name)
+    return shared
+
+def unload(name=None):
+    """Drop cached models (all of them by default) so they are reloaded on next use."""
+    with _lock:
+        if name is None:
+            _models.clear()
+        else:
+            _models.pop(name, None)
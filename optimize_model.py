@@ -0,0 +1,126 @@
+"""
+Build an optimized CPU inference artifact for DemucsModel.
+
+BatchNorm layers are folded into the preceding convolutions, the LSTM and
+Linear layers are dynamically quantized to int8, and the result is traced
+with TorchScript. A parity check reports how far the optimized outputs are
+from the fp32 checkpoint (SI-SNR per stem) and how much faster it runs.
+
+Usage:
+    python optimize_model.py --output models/audio_separation_model_2_optimized.pt [--audio song.wav]
+"""
+import argparse
+import copy
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from audio_metrics import si_snr
+from separation_model import load_checkpoint, LABELS, SAMPLE_RATE, MODEL_PATH, OPTIMIZED_MODEL_PATH
+
+def fold_batchnorm(model):
+    """Return an eval-mode copy of model with every Conv/ConvTranspose + BatchNorm pair fused."""
+    model = copy.deepcopy(model).eval()
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for i in range(len(module) - 1):
+            conv, bn = module[i], module[i + 1]
+            if isinstance(conv, (nn.Conv1d, nn.ConvTranspose1d)) and isinstance(bn, nn.BatchNorm1d):
+                module[i] = fuse_conv_bn_eval(conv, bn, transpose=isinstance(conv, nn.ConvTranspose1d))
+                module[i + 1] = nn.Identity()
+    return model
+
+def quantize(model):
+    """Dynamically quantize the LSTM and Linear layers to int8."""
+    return torch.ao.quantization.quantize_dynamic(model, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+
+def build_optimized_model(model, example_seconds=10):
+    """Fold, quantize and trace a DemucsModel for CPU inference."""
+    model = quantize(fold_batchnorm(model.cpu()))
+    example = torch.zeros(1, 1, int(SAMPLE_RATE * example_seconds))
+    with torch.no_grad():
+        return torch.jit.trace(model, example, check_trace=False)
+
+def _load_chunks(audio_path, num_chunks, seconds):
+    if audio_path:
+        import librosa
+        audio, _ = librosa.load(audio_path, sr=SAMPLE_RATE, mono=True)
+    else:
+        # Reproducible noise when no audio is given
+        audio = np.random.default_rng(0).uniform(-0.5, 0.5, int(SAMPLE_RATE * seconds * num_chunks))
+    length = int(SAMPLE_RATE * seconds)
+    chunks = [audio[i:i + length] for i in range(0, len(audio) - length + 1, length)][:num_chunks]
+    if not chunks:
+        raise ValueError("Audio is shorter than one parity chunk")
+    return torch.tensor(np.stack(chunks), dtype=torch.float32).unsqueeze(1)
+
+def _timed(model, inputs, repeats):
+    with torch.no_grad():
+        model(inputs[:1])  # Warm-up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            outputs = model(inputs)
+    return outputs, (time.perf_counter() - start) / repeats
+
+def parity_check(reference, optimized, inputs, repeats=3):
+    """
+    Compare an optimized model against the fp32 reference.
+
+    Args:
+        reference (nn.Module): fp32 model
+        optimized: Optimized (e.g. TorchScript) model
+        inputs (torch.Tensor): [N, 1, T] input chunks
+        repeats (int): Timed forward passes per model
+
+    Returns:
+        dict: Per-stem SI-SNR (dB) of the optimized outputs measured against
+              the fp32 outputs (higher means closer), its minimum, and timings
+    """
+    reference_out, reference_time = _timed(reference.cpu().eval(), inputs, repeats)
+    optimized_out, optimized_time = _timed(optimized, inputs, repeats)
+    scores = si_snr(optimized_out, reference_out)  # [N, stems]
+    per_stem = {label: float(scores[:, i].mean()) for i, label in enumerate(LABELS)}
+    return {
+        "si_snr_vs_fp32": per_stem,
+        "min_si_snr_vs_fp32": float(scores.mean(dim=0).min()),
+        "fp32_seconds": reference_time,
+        "optimized_seconds": optimized_time,
+        "speedup": reference_time / optimized_time if optimized_time else float("inf"),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and validate an optimized DemucsModel artifact.")
+    parser.add_argument("--output", default=OPTIMIZED_MODEL_PATH, help="Where to save the TorchScript artifact")
+    parser.add_argument("--audio", help="Audio file used for the parity check (default: synthetic noise)")
+    parser.add_argument("--chunks", type=int, default=4, help="Number of chunks in the parity check")
+    parser.add_argument("--seconds", type=float, default=10, help="Chunk length in seconds")
+    parser.add_argument("--threshold", type=float, default=20.0,
+                        help="Minimum per-stem SI-SNR (dB) against fp32 to accept the artifact")
+    args = parser.parse_args()
+
+    print(f"🔹 Loading fp32 checkpoint: {MODEL_PATH}")
+    reference = load_checkpoint().cpu().eval()
+
+    print("🔹 Folding BatchNorm, quantizing LSTM/Linear to int8 and tracing...")
+    optimized = build_optimized_model(reference, args.seconds)
+
+    print("🔹 Running parity check...")
+    report = parity_check(reference, optimized, _load_chunks(args.audio, args.chunks, args.seconds))
+    for label, score in report["si_snr_vs_fp32"].items():
+        print(f"   {label}: {score:.2f} dB SI-SNR vs fp32")
+    print(f"   fp32: {report['fp32_seconds']:.3f}s  optimized: {report['optimized_seconds']:.3f}s  "
+          f"speedup: {report['speedup']:.2f}x")
+
+    if report["min_si_snr_vs_fp32"] < args.threshold:
+        print(f"✗ Parity check failed (minimum {report['min_si_snr_vs_fp32']:.2f} dB < {args.threshold} dB), "
+              "artifact not saved")
+        raise SystemExit(1)
+
+    torch.jit.save(optimized, args.output)
+    print(f"✓ Optimized model saved: {args.output}")
+    print("  Set SEPARATION_MODEL_VARIANT=optimized to serve it")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import os
+import shutil
+import hashlib
+import numpy as np
+import soundfile as sf
+from process import (split_audio, merge_audio, split_audio_arrays, merge_arrays, stream_windows,
+                     OverlapAddWriter, SAMPLE_RATE, STREAM_OVERLAP, UPLOAD_FOLDER)
+from separation_model import (separate_batch, separate_chunks, LABELS, BATCH_SIZE, SEPARATION_WORKERS, SKIP_SILENCE,
+                              CHUNK_CACHE, active_model_path)
+from activity import SILENCE_THRESHOLD_DB
+from enhancement import (enhance_all_components, ENHANCEMENT_MODEL_NAME, ENHANCE_SEGMENT, ENHANCE_OVERLAP,
+                         ENHANCE_SHIFTS, ENHANCE_SPLIT, ENHANCE_WINDOW, ENHANCE_MODE, ENHANCE_FUSION_WEIGHT)
+from disk_cache import DiskCache, file_digest, checkpoint_fingerprint
+from instrumentation import span, CHUNKS, AUDIO_SECONDS, CACHE_REQUESTS
+
+# "memory" passes NumPy arrays between split, separate and merge and only
+# writes the merged stems; "disk" keeps the original temp-file round-trips;
+# "stream" keeps memory constant for arbitrarily long inputs.
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "memory")
+
+# Bump when a change to the processing chain alters its output
+PIPELINE_VERSION = "1"
+
+# Finished stems are kept by upload content so re-uploads skip processing
+RESULT_CACHE_FOLDER = os.getenv("RESULT_CACHE_FOLDER", os.path.join(UPLOAD_FOLDER, "cache", "results"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 5 * 1024**3))
+result_cache = DiskCache(RESULT_CACHE_FOLDER, RESULT_CACHE_MAX_BYTES)
+
+def select_stems(stems=None):
+    """Validate requested stem names and return them in LABELS order (all of them by default)."""
+    if not stems:
+        return list(LABELS)
+    unknown = set(stems) - set(LABELS)
+    if unknown:
+        raise ValueError(f"Unknown stems: {', '.join(sorted(unknown))}")
+    return [label for label in LABELS if label in stems]
+
+def separate_and_merge_on_disk(filepath, output_folder=UPLOAD_FOLDER, stems=LABELS):
+    """Split to temp chunk files, separate each file and merge the requested stems."""
+    print("\n2. Splitting audio into chunks...")
+    with span("split", mode="disk") as attrs:
+        chunk_files, sr = split_audio(filepath, output_folder=output_folder)
+        attrs["chunks"] = len(chunk_files)
+    print(f"   ✓ Split into {len(chunk_files)} chunks")
+
+    print("\n3. Processing chunks for separation in batches...")
+    separated_files = {label: [] for label in stems}
+    with span("separate", mode="disk", chunks=len(chunk_files)):
+        for outputs in separate_batch(chunk_files, labels=stems):
+            if outputs:
+                for label in stems:
+                    separated_files[label].append(outputs[label])
+    CHUNKS.inc(len(chunk_files))
+    print("   ✓ All chunks processed successfully")
+
+    print("\n4. Merging separated components...")
+    merged_files = {}
+    for component in stems:
+        print(f"   Merging {component}...")
+        with span("merge", mode="disk", component=component):
+            merged_files[component] = merge_audio(separated_files[component], sr, f"merged_{component}.wav", output_folder)
+    print("   ✓ All components merged successfully")
+    return merged_files
+
+def separate_and_merge_in_memory(filepath, output_folder=UPLOAD_FOLDER, stems=LABELS, use_cache=CHUNK_CACHE):
+    """Split, separate and merge the requested stems without writing any intermediate files."""
+    print("\n2. Splitting audio into chunks...")
+    with span("split", mode="memory") as attrs:
+        chunks, sr = split_audio_arrays(filepath)
+        attrs["chunks"] = len(chunks)
+        attrs["audio_seconds"] = sum(len(chunk) for chunk in chunks) / sr
+    print(f"   ✓ Split into {len(chunks)} chunks")
+
+    print("\n3. Processing chunks for separation in batches...")
+    separated = {label: [] for label in stems}
+    with span("separate", mode="memory", chunks=len(chunks)):
+        for outputs in separate_chunks(chunks, use_cache=use_cache):
+            if outputs is not None:
+                for label in stems:
+                    separated[label].append(outputs[LABELS.index(label)])
+    CHUNKS.inc(len(chunks))
+    print("   ✓ All chunks processed successfully")
+
+    print("\n4. Merging separated components...")
+    merged_files = {}
+    for component in stems:
+        print(f"   Merging {component}...")
+        with span("merge", mode="memory", component=component):
+            merged_files[component] = merge_arrays(separated[component], sr, f"merged_{component}.wav", output_folder)
+    print("   ✓ All components merged successfully")
+    return merged_files
+
+def separate_and_merge_streaming(filepath, output_folder=UPLOAD_FOLDER, overlap=STREAM_OVERLAP, stems=LABELS,
+                                 use_cache=CHUNK_CACHE):
+    """Separate overlapping windows as they are read and overlap-add the requested stems straight to disk."""
+    print("\n2-4. Streaming split, separation and merge...")
+    os.makedirs(output_folder, exist_ok=True)
+    merged_files = {label: os.path.join(output_folder, f"merged_{label}.wav") for label in stems}
+    indices = [LABELS.index(label) for label in stems]
+    overlap_samples = int(SAMPLE_RATE * overlap)
+    # Enough windows per group to keep every separation worker busy
+    group_size = BATCH_SIZE * max(1, SEPARATION_WORKERS)
+    num_windows = 0
+    with span("stream_separate_merge", mode="stream") as attrs, \
+            OverlapAddWriter(merged_files.values(), SAMPLE_RATE, overlap_samples) as writer:
+        batch = []
+        for window in stream_windows(filepath, overlap=overlap):
+            batch.append(window)
+            if len(batch) == group_size:
+                num_windows += _write_separated(batch, writer, indices, use_cache)
+                batch = []
+        if batch:
+            num_windows += _write_separated(batch, writer, indices, use_cache)
+        attrs["chunks"] = num_windows
+    CHUNKS.inc(num_windows)
+    print(f"   ✓ Streamed {num_windows} windows")
+    return merged_files
+
+def _write_separated(windows, writer, indices, use_cache):
+    for window, stems in zip(windows, separate_chunks(windows, use_cache=use_cache)):
+        if stems is None:
+            stems = np.zeros((len(LABELS), len(window)), dtype=np.float32)
+        writer.write(stems[indices])
+    return len(windows)
+
+def result_cache_key(filepath, mode):
+    """Hash the upload together with everything that determines the output stems."""
+    hasher = hashlib.sha256()
+    file_digest(filepath, hasher)
+    settings = [PIPELINE_VERSION, checkpoint_fingerprint(active_model_path()), ENHANCEMENT_MODEL_NAME, mode,
+                f"{ENHANCE_SEGMENT}:{ENHANCE_OVERLAP}:{ENHANCE_SHIFTS}:{ENHANCE_SPLIT}:{ENHANCE_WINDOW}", ENHANCE_MODE]
+    if ENHANCE_MODE == "mix":
+        settings.append(str(ENHANCE_FUSION_WEIGHT))
+    if SKIP_SILENCE:
+        settings.append(f"silence:{SILENCE_THRESHOLD_DB}")
+    if mode == "stream":
+        settings.append(str(STREAM_OVERLAP))
+    hasher.update("|".join(settings).encode())
+    return hasher.hexdigest()
+
+def stem_cache_key(key, component):
+    """Each stem is its own cache entry, so any subset of stems can be served or stored."""
+    return f"{key}-{component}"
+
+def load_cached_result(key, output_folder, stems=LABELS):
+    """Copy the cached denoised stems into output_folder, returning the paths of those that were found."""
+    enhanced_files = {}
+    for component in stems:
+        entry_dir = result_cache.get(stem_cache_key(key, component))
+        if entry_dir is None:
+            continue
+        filename = f"denoised_merged_{component}.wav"
+        cached_path = os.path.join(entry_dir, filename)
+        if not os.path.exists(cached_path):
+            continue
+        os.makedirs(output_folder, exist_ok=True)
+        enhanced_files[component] = os.path.join(output_folder, filename)
+        shutil.copyfile(cached_path, enhanced_files[component])
+    return enhanced_files
+
+def store_result(key, enhanced_files):
+    """Store every denoised stem under its own cache entry."""
+    for component, path in enhanced_files.items():
+        result_cache.put(stem_cache_key(key, component), {os.path.basename(path): path})
+
+def process_upload(filepath, output_folder=UPLOAD_FOLDER, mode=None, use_cache=True, stems=None):
+    """
+    Run the split -> separate -> merge -> enhance chain on one file.
+
+    Args:
+        filepath (str): Path to the uploaded audio file
+        output_folder (str): Folder that receives the merged and denoised stems
+        mode (str, optional): "memory", "stream" or "disk"; defaults to PIPELINE_MODE
+        use_cache (bool): Serve and store results in the content-addressed result and chunk caches
+        stems (list, optional): Stems to merge and enhance; defaults to all of LABELS
+
+    Returns:
+        dict: Mapping of component names to their denoised file paths
+    """
+    mode = mode or PIPELINE_MODE
+    stems = select_stems(stems)
+    with span("process_upload", mode=mode, bytes=os.path.getsize(filepath), stems=",".join(stems)) as attrs:
+        try:
+            attrs["audio_seconds"] = sf.info(filepath).duration
+            AUDIO_SECONDS.inc(attrs["audio_seconds"])
+        except Exception:
+            pass  # Formats libsndfile cannot read are still decoded by librosa later
+        return _process_upload(filepath, output_folder, mode, use_cache, stems, attrs)
+
+def _process_upload(filepath, output_folder, mode, use_cache, stems, attrs):
+    cached_files = {}
+    if use_cache:
+        key = result_cache_key(filepath, mode)
+        try:
+            cached_files = load_cached_result(key, output_folder, stems)
+        except Exception as e:
+            print(f"Warning: Could not read result cache: {str(e)}")
+            cached_files = {}
+        CACHE_REQUESTS.inc(len(cached_files), cache="result", result="hit")
+        CACHE_REQUESTS.inc(len(stems) - len(cached_files), cache="result", result="miss")
+        attrs["cache"] = "hit" if len(cached_files) == len(stems) else "partial" if cached_files else "miss"
+        if len(cached_files) == len(stems):
+            print(f"\n✓ Result cache hit ({key[:12]}), skipping processing")
+            return cached_files
+        if cached_files:
+            print(f"\n✓ Result cache hit for {', '.join(cached_files)} ({key[:12]}), processing the other stems")
+    missing = [component for component in stems if component not in cached_files]
+
+    use_chunk_cache = use_cache and CHUNK_CACHE
+    if mode == "memory":
+        merged_files = separate_and_merge_in_memory(filepath, output_folder, missing, use_chunk_cache)
+    elif mode == "stream":
+        merged_files = separate_and_merge_streaming(filepath, output_folder, stems=missing, use_cache=use_chunk_cache)
+    elif mode == "disk":
+        merged_files = separate_and_merge_on_disk(filepath, output_folder, missing)
+    else:
+        raise ValueError(f"Unknown pipeline mode: {mode}")
+
+    print("\n5. Applying enhancement to denoise files...")
+    with span("enhance", components=len(merged_files), enhance_mode=ENHANCE_MODE):
+        enhanced_files = enhance_all_components(merged_files, output_folder, mixture_path=filepath)
+    print("   ✓ Enhancement completed successfully")
+
+    if use_cache:
+        try:
+            store_result(key, enhanced_files)
+        except Exception as e:
+            print(f"Warning: Could not store result in cache: {str(e)}")
+    enhanced_files.update(cached_files)
+    return {component: enhanced_files[component] for component in stems if component in enhanced_files}
@@ -1,30 +1,36 @@
 import librosa
 import numpy as np
 import soundfile as sf
+import soxr
 import os
 
 SAMPLE_RATE = 44100
 UPLOAD_FOLDER = "static/uploads"
+STREAM_BLOCK_SIZE = 65536  # Frames read from disk per block in streaming mode
+STREAM_OVERLAP = 1.0  # Seconds shared by consecutive windows in streaming mode
 
-def split_audio(audio_path, segment_length=10):
+def split_audio_arrays(audio_path, segment_length=10):
+    """Decode once and return the chunks as arrays instead of temp files."""
     audio, sr = librosa.load(audio_path, sr=SAMPLE_RATE)
-    num_samples = sr * segment_length
-    step_size = int(num_samples)
+    num_samples = int(sr * segment_length)
+    chunks = [audio[i:i+num_samples] for i in range(0, len(audio), num_samples)]
+    return chunks, sr
 
-    chunks = [audio[i:i+num_samples] for i in range(0, len(audio), step_size)]
+def split_audio(audio_path, segment_length=10, output_folder=UPLOAD_FOLDER):
+    chunks, sr = split_audio_arrays(audio_path, segment_length)
     temp_files = []
 
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    os.makedirs(output_folder, exist_ok=True)
     try:
         for i, chunk in enumerate(chunks):
-            temp_path = os.path.join(UPLOAD_FOLDER, f"temp_chunk_{i}.wav")
+            temp_path = os.path.join(output_folder, f"temp_chunk_{i}.wav")
             sf.write(temp_path, chunk, sr)
             temp_files.append(temp_path)
     except Exception as e:
         print(f"Error saving chunks: {e}")
     return temp_files, sr
 
-def merge_audio(chunk_files, sr, output_filename):
+def merge_audio(chunk_files, sr, output_filename, output_folder=UPLOAD_FOLDER):
     merged_audio = []
     try:
         for file in chunk_files:
@@ -33,9 +39,116 @@ def merge_audio(chunk_files, sr, output_filename):
             os.remove(file)
 
         output_audio = np.concatenate(merged_audio) if merged_audio else np.array([])
-        output_file = os.path.join(UPLOAD_FOLDER, output_filename)
+        output_file = os.path.join(output_folder, output_filename)
         sf.write(output_file, output_audio, sr)
         return output_file
     except Exception as e:
         print(f"Error merging audio: {e}")
         return None
+
+def merge_arrays(chunks, sr, output_filename, output_folder=UPLOAD_FOLDER):
+    """Concatenate in-memory stem chunks and write the merged file."""
+    try:
+        output_audio = np.concatenate(chunks) if chunks else np.array([])
+        os.makedirs(output_folder, exist_ok=True)
+        output_file = os.path.join(output_folder, output_filename)
+        sf.write(output_file, output_audio, sr)
+        return output_file
+    except Exception as e:
+        print(f"Error merging audio: {e}")
+        return None
+
+def stream_audio_blocks(audio_path, block_size=STREAM_BLOCK_SIZE):
+    """
+    Read an audio file block by block as mono float32 at SAMPLE_RATE.
+
+    Unlike librosa.load, only one block is decoded at a time and resampling
+    is done incrementally, so memory does not depend on the file length.
+    """
+    with sf.SoundFile(audio_path) as f:
+        resampler = None
+        if f.samplerate != SAMPLE_RATE:
+            resampler = soxr.ResampleStream(f.samplerate, SAMPLE_RATE, 1, dtype="float32")
+        while True:
+            block = f.read(block_size, dtype="float32", always_2d=True)
+            last = len(block) < block_size
+            mono = np.ascontiguousarray(block.mean(axis=1))
+            if resampler is not None:
+                mono = resampler.resample_chunk(mono, last=last)
+            if len(mono):
+                yield mono
+            if last:
+                break
+
+def stream_windows(audio_path, segment_length=10, overlap=STREAM_OVERLAP):
+    """
+    Yield windows of segment_length seconds where consecutive windows share
+    `overlap` seconds, keeping at most one window of audio in memory.
+    """
+    window = int(SAMPLE_RATE * segment_length)
+    overlap_samples = int(SAMPLE_RATE * overlap)
+    if not 0 <= overlap_samples < window:
+        raise ValueError("overlap must be shorter than segment_length")
+    hop = window - overlap_samples
+
+    buffer = np.zeros(0, dtype=np.float32)
+    yielded = False
+    for block in stream_audio_blocks(audio_path):
+        buffer = np.concatenate([buffer, block])
+        while len(buffer) >= window:
+            yield buffer[:window].copy()
+            buffer = buffer[hop:]
+            yielded = True
+    # The leftover overlap was already covered by the previous window
+    if len(buffer) > (overlap_samples if yielded else 0):
+        yield buffer
+
+class OverlapAddWriter:
+    """
+    Stitch overlapping windows of stems with linear crossfades and write them
+    to soundfile.SoundFile handles as soon as they are final.
+
+    Only the last `overlap_samples` of each stem are held back, waiting to be
+    crossfaded with the start of the next window.
+    """
+
+    def __init__(self, output_files, sr, overlap_samples, channels=1, subtype=None):
+        self.output_files = list(output_files)
+        self.overlap_samples = overlap_samples
+        self.handles = [sf.SoundFile(path, "w", samplerate=sr, channels=channels, subtype=subtype)
+                        for path in self.output_files]
+        self.tail = None
+
+    def write(self, stems):
+        """Append one window; stems is [num_stems, T] or [num_stems, channels, T]."""
+        stems = np.asarray(stems, dtype=np.float32)
+        length = stems.shape[-1]
+        start = 0
+        if self.tail is not None:
+            n = min(self.tail.shape[-1], length)
+            fade_in = (np.arange(n, dtype=np.float32) + 0.5) / n
+            blended = self.tail[..., :n] * (1.0 - fade_in) + stems[..., :n] * fade_in
+            self._write(blended)
+            start = n
+        body_end = max(start, length - self.overlap_samples)
+        self._write(stems[..., start:body_end])
+        self.tail = stems[..., body_end:].copy()
+
+    def _write(self, stems):
+        if stems.shape[-1]:
+            for handle, stem in zip(self.handles, stems):
+                handle.write(stem.T)
+
+    def close(self):
+        if self.tail is not None:
+            self._write(self.tail)
+            self.tail = None
+        for handle in self.handles:
+            handle.close()
+        return self.output_files
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
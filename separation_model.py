@@ -1,52 +1,315 @@
-import torch
 import librosa
 import numpy as np
 import soundfile as sf
 import os
-from models.model_architecture import DemucsModel
+import atexit
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from model_registry import get_model
+from instrumentation import span, share_metrics, SILENT_CHUNKS, CACHE_REQUESTS
+from activity import silent_chunks
+from disk_cache import DiskCache, checkpoint_fingerprint
 
 SAMPLE_RATE = 44100
 MODEL_PATH = "models/audio_separation_model_2.pth"
+# TorchScript int8 artifact built by optimize_model.py; served when SEPARATION_MODEL_VARIANT=optimized
+OPTIMIZED_MODEL_PATH = "models/audio_separation_model_2_optimized.pt"
+MODEL_VARIANT = os.getenv("SEPARATION_MODEL_VARIANT", "fp32")
+# Force a torch device ("cpu", "cuda"); by default CUDA is used when available
+SEPARATION_DEVICE = os.getenv("SEPARATION_DEVICE")
 UPLOAD_FOLDER = r"/path/to/uploads/"
+BATCH_SIZE = int(os.getenv("SEPARATION_BATCH_SIZE", 8))  # Chunks stacked into one forward pass
+LABELS = ["bass", "vocal", "drum", "music"]
 
+# Multi-process separation: shard chunks over SEPARATION_WORKERS processes (0 or 1 = in-process)
+SEPARATION_WORKERS = int(os.getenv("SEPARATION_WORKERS", 0))
+# Torch threads per worker process; 0 splits the CPU cores evenly between workers
+INTRA_OP_THREADS = int(os.getenv("SEPARATION_INTRA_OP_THREADS", 0))
+INTER_OP_THREADS = int(os.getenv("SEPARATION_INTER_OP_THREADS", 0))
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# Chunks below SILENCE_THRESHOLD_DB get zero stems without running the model (SKIP_SILENCE=0 disables)
+SKIP_SILENCE = os.getenv("SKIP_SILENCE", "1") != "0"
 
-def load_model():
+# Separated stems of every chunk, keyed by its samples and the model, so edits of
+# earlier uploads only run the model on the chunks that changed (CHUNK_CACHE=0 disables).
+# Used with the result cache, i.e. by the app and not by batch_cli.py unless it runs with --cache.
+CHUNK_CACHE = os.getenv("CHUNK_CACHE", "1") != "0"
+CHUNK_CACHE_FOLDER = os.getenv("CHUNK_CACHE_FOLDER", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                  "static", "uploads", "cache", "chunks"))
+CHUNK_CACHE_MAX_BYTES = int(os.getenv("CHUNK_CACHE_MAX_BYTES", 2 * 1024**3))
+chunk_cache = DiskCache(CHUNK_CACHE_FOLDER, CHUNK_CACHE_MAX_BYTES)
+
+def get_device():
+    import torch
+    if SEPARATION_DEVICE:
+        return torch.device(SEPARATION_DEVICE)
+    if MODEL_VARIANT == "optimized":
+        # Quantized kernels only run on CPU
+        return torch.device("cpu")
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+def active_model_path():
+    """Path of the checkpoint or artifact the separation model is loaded from."""
+    return OPTIMIZED_MODEL_PATH if MODEL_VARIANT == "optimized" else MODEL_PATH
+
+def load_checkpoint(path=MODEL_PATH):
+    """Build the fp32 DemucsModel and load its checkpoint."""
+    import torch
+    from models.model_architecture import DemucsModel
+
+    device = get_device()
     model = DemucsModel().to(device)
     try:
-        model.load_state_dict(torch.load(MODEL_PATH, map_location=device))
+        model.load_state_dict(torch.load(path, map_location=device))
         model.eval()
         print("Model loaded successfully!")
     except Exception as e:
         print(f"Error loading model: {e}")
     return model
 
-model = load_model()
+def load_model():
+    """Load the configured model variant (use get_model("separation") to share it)."""
+    import torch
 
-def separate_audio(chunk_path):
-    try:
-        audio, sr = librosa.load(chunk_path, sr=SAMPLE_RATE, mono=True)
-        input_tensor = torch.tensor(audio, dtype=torch.float32).unsqueeze(0).unsqueeze(0).to(device)
+    if MODEL_VARIANT == "optimized":
+        model = torch.jit.load(OPTIMIZED_MODEL_PATH, map_location="cpu")
+        model.eval()
+        print("Optimized model loaded successfully!")
+        return model
+    return load_checkpoint()
+
+def _fit_length(stems, length):
+    """Trim or zero-pad the model output so it matches the input length."""
+    if stems.shape[-1] >= length:
+        return stems[..., :length]
+    return np.pad(stems, [(0, 0)] * (stems.ndim - 1) + [(0, length - stems.shape[-1])])
+
+def separate_arrays(chunks, batch_size=BATCH_SIZE):
+    """
+    Separate in-memory chunks with one forward pass per batch.
 
-        with torch.no_grad():
-            output_tensors = model(input_tensor)
-        print(f"Model output shape: {output_tensors.shape}")
+    Chunks are stacked into a [N, 1, T] tensor. Shorter chunks (usually the
+    last one) are zero-padded to T and their stems are trimmed back afterwards.
 
-        output_tensors = output_tensors.squeeze(0).cpu().numpy()
-        labels = ["bass", "vocal", "drum", "music"]
+    Args:
+        chunks (list): Mono float32 arrays at SAMPLE_RATE, in order
+        batch_size (int): Maximum number of chunks per forward pass
+
+    Returns:
+        list: One [4, len(chunk)] array per chunk, stems ordered as LABELS
+              (None for chunks whose batch failed)
+    """
+    import torch
+
+    model = get_model("separation")
+    device = get_device()
+    results = []
+    for start in range(0, len(chunks), batch_size):
+        batch_chunks = chunks[start:start + batch_size]
+        try:
+            lengths = [len(chunk) for chunk in batch_chunks]
+            batch = np.zeros((len(batch_chunks), 1, max(lengths)), dtype=np.float32)
+            for i, chunk in enumerate(batch_chunks):
+                batch[i, 0, :len(chunk)] = chunk
+            input_tensor = torch.from_numpy(batch).to(device)
+
+            with span("separate_batch", first_chunk=start, chunks=len(batch_chunks),
+                      audio_seconds=sum(lengths) / SAMPLE_RATE), torch.no_grad():
+                output_tensors = model(input_tensor)
+            output_tensors = output_tensors.cpu().numpy()
+
+            for stems, length in zip(output_tensors, lengths):
+                results.append(_fit_length(stems, length))
+        except Exception as e:
+            print(f"Error processing batch starting at chunk {start}: {e}")
+            results.extend([None] * len(batch_chunks))
+    return results
+
+def separate_batch(chunk_paths, batch_size=BATCH_SIZE, labels=LABELS):
+    """
+    Separate several chunk files with one forward pass per batch.
+
+    Args:
+        chunk_paths (list): Paths to the chunk WAV files, in order
+        batch_size (int): Maximum number of chunks per forward pass
+        labels (list): Stems to write; the others are discarded
+
+    Returns:
+        list: One dict per chunk mapping each label to its separated file
+              (None for chunks that failed)
+    """
+    chunks = []
+    for path in chunk_paths:
+        try:
+            chunks.append(librosa.load(path, sr=SAMPLE_RATE, mono=True)[0])
+        except Exception as e:
+            print(f"Error loading {path}: {e}")
+            chunks.append(np.zeros(0, dtype=np.float32))
+
+    results = []
+    for chunk_path, chunk, stems in zip(chunk_paths, chunks, separate_chunks(chunks, batch_size)):
+        if stems is None or len(chunk) == 0:
+            results.append(None)
+            continue
         output_files = {}
-        
-        for i, label in enumerate(labels):
+        for label in labels:
+            i = LABELS.index(label)
             output_file = chunk_path.replace("temp_chunk", f"separated_{label}").replace(".wav", f"_{label}.wav")
-            sf.write(output_file, output_tensors[i], sr)
+            sf.write(output_file, stems[i], SAMPLE_RATE)
             output_files[label] = output_file
+        results.append(output_files)
+    return results
+
+def configure_threads(intra_op_threads=0, inter_op_threads=0):
+    """Set torch's intra-op and inter-op thread counts for this process (0 keeps the default)."""
+    import torch
+
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            # Can only be set once, before any inter-op parallel work
+            print(f"Warning: Could not set inter-op threads: {e}")
 
-        if not all(key in output_files for key in labels):
-            print(f"Error: Missing keys in output_files: {output_files.keys()}")
-            return None
-        
-        return output_files
+def _init_separation_worker(intra_op_threads, inter_op_threads):
+    configure_threads(intra_op_threads, inter_op_threads)
+    # Each worker loads its own copy of the model once, up front
+    get_model("separation")
+
+def _separate_shard(shard):
+    return separate_arrays(shard, batch_size=len(shard))
+
+_pool = None
+_pool_settings = None
+_pool_lock = threading.Lock()
+
+def get_separation_pool(num_workers=SEPARATION_WORKERS, intra_op_threads=INTRA_OP_THREADS,
+                        inter_op_threads=INTER_OP_THREADS):
+    """Return the shared worker pool, (re)creating it when the settings change."""
+    global _pool, _pool_settings
+    if not intra_op_threads:
+        intra_op_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    settings = (num_workers, intra_op_threads, inter_op_threads)
+    with _pool_lock:
+        if _pool is None or _pool_settings != settings:
+            if _pool is not None:
+                _pool.shutdown()
+            share_metrics()  # The workers report their stages through METRICS_DIR
+            # spawn: forking a process that already runs torch threads is unsafe
+            _pool = ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_separation_worker,
+                initargs=(intra_op_threads, inter_op_threads)
+            )
+            _pool_settings = settings
+            print(f"✓ Started {num_workers} separation workers with {intra_op_threads} threads each")
+        return _pool
+
+def shutdown_separation_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+atexit.register(shutdown_separation_pool)
+
+def separate_parallel(chunks, num_workers=SEPARATION_WORKERS, batch_size=BATCH_SIZE,
+                      intra_op_threads=INTRA_OP_THREADS, inter_op_threads=INTER_OP_THREADS):
+    """
+    Separate chunks on a pool of worker processes.
+
+    Chunks are cut into shards of batch_size; each shard is one batched
+    forward pass in a worker. Results come back in chunk order.
+
+    Args:
+        chunks (list): Mono float32 arrays at SAMPLE_RATE, in order
+        num_workers (int): Number of worker processes
+        batch_size (int): Chunks per shard
+        intra_op_threads (int): Torch intra-op threads per worker (0 = cores / workers)
+        inter_op_threads (int): Torch inter-op threads per worker (0 = torch default)
+
+    Returns:
+        list: Same as separate_arrays
+    """
+    pool = get_separation_pool(num_workers, intra_op_threads, inter_op_threads)
+    shards = [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+    results = []
+    for shard_results in pool.map(_separate_shard, shards):
+        results.extend(shard_results)
+    return results
+
+def chunk_cache_key(chunk):
+    """Hash a chunk's samples together with the model that separates them."""
+    hasher = hashlib.sha256()
+    hasher.update(f"{MODEL_VARIANT}|{checkpoint_fingerprint(active_model_path())}|{SAMPLE_RATE}|".encode())
+    hasher.update(np.ascontiguousarray(chunk, dtype=np.float32).tobytes())
+    return hasher.hexdigest()
+
+def load_cached_stems(key, length):
+    """Return the cached [4, length] stems of a chunk, or None."""
+    entry_dir = chunk_cache.get(key)
+    if entry_dir is None:
+        return None
+    try:
+        stems = np.load(os.path.join(entry_dir, "stems.npy"))
     except Exception as e:
-        print(f"Error processing {chunk_path}: {e}")
+        print(f"Warning: Could not read cached chunk {key[:12]}: {e}")
         return None
+    return stems if stems.shape == (len(LABELS), length) else None
+
+def store_stems(key, stems):
+    """Add a chunk's stems to the chunk cache; failures only print a warning."""
+    try:
+        chunk_cache.write(key, lambda entry_dir: np.save(os.path.join(entry_dir, "stems.npy"),
+                                                         np.asarray(stems, dtype=np.float32)))
+    except Exception as e:
+        print(f"Warning: Could not cache chunk {key[:12]}: {e}")
+
+def separate_chunks(chunks, batch_size=BATCH_SIZE, skip_silence=SKIP_SILENCE, use_cache=CHUNK_CACHE):
+    """
+    Separate chunks in-process, or on the worker pool when SEPARATION_WORKERS > 1.
+
+    With skip_silence, chunks whose loudest frame is below SILENCE_THRESHOLD_DB
+    get zero stems. With use_cache, chunks found in the chunk cache are served
+    from it. Only the remaining chunks are sent to the model.
+    """
+    silent = silent_chunks(chunks, SAMPLE_RATE) if skip_silence else np.zeros(len(chunks), dtype=bool)
+    results = [np.zeros((len(LABELS), len(chunk)), dtype=np.float32) if is_silent else None
+               for chunk, is_silent in zip(chunks, silent)]
+    if silent.any():
+        SILENT_CHUNKS.inc(int(silent.sum()))
+        print(f"Skipping {int(silent.sum())} of {len(chunks)} chunks as silent")
+
+    pending = [i for i, is_silent in enumerate(silent) if not is_silent]
+    keys = {}
+    if use_cache and pending:
+        misses = []
+        for i in pending:
+            keys[i] = chunk_cache_key(chunks[i])
+            results[i] = load_cached_stems(keys[i], len(chunks[i]))
+            if results[i] is None:
+                misses.append(i)
+        CACHE_REQUESTS.inc(len(pending) - len(misses), cache="chunk", result="hit")
+        CACHE_REQUESTS.inc(len(misses), cache="chunk", result="miss")
+        if len(misses) < len(pending):
+            print(f"Reusing {len(pending) - len(misses)} of {len(pending)} chunks from the chunk cache")
+        pending = misses
+
+    active = [chunks[i] for i in pending]
+    if not active:
+        separated = []
+    elif SEPARATION_WORKERS > 1 and len(active) > batch_size:
+        separated = separate_parallel(active, batch_size=batch_size)
+    else:
+        separated = separate_arrays(active, batch_size)
+    for i, stems in zip(pending, separated):
+        results[i] = stems
+        if stems is not None and i in keys:
+            store_stems(keys[i], stems)
+    return results
@@ -0,0 +1,162 @@
+"""
+Pre-fork production server for app.py.
+
+The master process imports the app, loads the models and moves their
+weights into shared memory, then forks the workers. Every worker serves
+requests from the same listening socket and maps the master's weight pages
+instead of loading its own copy, so memory stays flat as workers are added.
+Each worker gets its share of the CPU cores as torch threads, and starts its
+job queue and janitor threads on first use, after the fork.
+
+Models are served on the CPU. A CUDA context cannot be used across fork,
+and CUDA tensors cannot be shared this way, so the separation model is
+forced onto the CPU and the server refuses to fork
+if CUDA was initialized anyway. Run app.py in a single process to use a GPU.
+
+Usage:
+    python serve.py --host 0.0.0.0 --port 8000 --workers 4
+    SERVE_WORKERS=8 SERVE_THREADS=2 python serve.py
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import time
+
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", 2))
+# Torch threads per worker; 0 splits the CPU cores evenly between workers
+SERVE_THREADS = int(os.getenv("SERVE_THREADS", 0))
+SERVE_MODELS = os.getenv("SERVE_MODELS", "separation,enhancement,diarization")
+
+def load_shared_models(names):
+    """Load models in the master and move their weights into shared memory."""
+    import torch
+    from model_registry import warmup, share_models
+    from instrumentation import share_metrics
+
+    # Workers and their model pools write their metrics where any worker's /metrics adds them up
+    share_metrics()
+    # No intra-op thread pool may exist before fork; workers set their own thread count
+    torch.set_num_threads(1)
+    loaded = warmup(names)
+    if torch.cuda.is_initialized():
+        raise RuntimeError("CUDA was initialized while loading the models; forked workers could not use it. "
+                           "Serve with app.py to run on a GPU.")
+    shared = share_models()
+    print(f"✓ Loaded {', '.join(loaded) or 'no models'}; shared weights: {', '.join(shared) or 'none'}")
+    return loaded
+
+def run_worker(listener, host, port, threads):
+    """Serve requests on the inherited socket until SIGTERM (runs in the forked child)."""
+    import torch
+    from werkzeug.serving import make_server
+    from app import app
+
+    torch.set_num_threads(threads)
+    server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The master handles Ctrl+C
+    print(f"✓ Worker {os.getpid()} serving with {threads} torch threads")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+def spawn_worker(listener, host, port, threads):
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            run_worker(listener, host, port, threads)
+        except SystemExit:
+            pass
+        except Exception as e:
+            print(f"Error in worker {os.getpid()}: {str(e)}")
+            status = 1
+        finally:
+            # Skip the app's atexit cleanup, which belongs to the master
+            from instrumentation import flush_metrics
+            flush_metrics()
+            os._exit(status)
+    return pid
+
+def serve(host="127.0.0.1", port=8000, workers=SERVE_WORKERS, threads=SERVE_THREADS, models=None):
+    """
+    Run the pre-fork server until SIGTERM or Ctrl+C.
+
+    Args:
+        host (str): Interface to listen on
+        port (int): Port to listen on
+        workers (int): Worker processes
+        threads (int): Torch threads per worker (0 = CPU cores / workers)
+        models (list, optional): Models loaded before forking; defaults to SERVE_MODELS
+    """
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    listener = socket.create_server((host, port), backlog=128)
+    listener.set_inheritable(True)
+
+    print(f"=== Starting Audio Processing Server on {host}:{port} ===")
+    import separation_model
+    separation_model.SEPARATION_DEVICE = "cpu"  # CUDA contexts do not survive fork
+    import app  # noqa: F401  Imported once here so workers inherit the loaded modules
+    load_shared_models(models or [name for name in SERVE_MODELS.split(",") if name])
+    # Objects that exist now are never collected, so the GC does not write to (and copy) their pages
+    gc.collect()
+    gc.freeze()
+
+    children = {spawn_worker(listener, host, port, threads) for _ in range(workers)}
+    print(f"✓ Started {workers} workers: {', '.join(str(pid) for pid in sorted(children))}")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        while not stopping:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid in children:
+                # Replace workers that died
+                children.discard(pid)
+                print(f"Warning: Worker {pid} exited with status {status}, restarting")
+                children.add(spawn_worker(listener, host, port, threads))
+            else:
+                time.sleep(0.5)
+    finally:
+        print("\n=== Stopping workers ===")
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        listener.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app from pre-forked workers sharing one copy of the models.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="Worker processes")
+    parser.add_argument("--threads", type=int, default=SERVE_THREADS, help="Torch threads per worker (0 = cores / workers)")
+    parser.add_argument("--models", default=SERVE_MODELS, help="Comma-separated models loaded before forking")
+    args = parser.parse_args()
+    serve(args.host, args.port, max(1, args.workers), args.threads,
+          [name for name in args.models.split(",") if name])
+
+if __name__ == "__main__":
+    main()
@@ -1,107 +1,397 @@
-from pyannote.audio import Pipeline
-import torch
 import os
-from pydub import AudioSegment
+import json
 import numpy as np
+import soundfile as sf
 from dotenv import load_dotenv
 import warnings
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from model_registry import get_model
+from instrumentation import span, share_metrics
+from activity import active_regions, compact, map_turns
 
 # Suppress specific warnings
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 warnings.filterwarnings("ignore", category=UserWarning)
 
+# The shared pipeline is not guaranteed to be thread-safe
+_diarization_lock = threading.Lock()
+
+# Only the voiced regions of the vocal stem are diarized (DIARIZE_VOICED_ONLY=0 diarizes everything)
+DIARIZE_VOICED_ONLY = os.getenv("DIARIZE_VOICED_ONLY", "1") != "0"
+VOICED_GAP_SECONDS = 1.0  # Silence between voiced regions in the audio sent to diarization
+MAX_VOICED_RATIO = 0.9  # Diarize the whole file when this much of it is voiced anyway
+
+# Long-form mode: recordings longer than LONG_FORM_MIN_SECONDS are diarized in
+# overlapping windows, in DIARIZATION_WORKERS processes (0 or 1 = in-process)
+LONG_FORM_MIN_SECONDS = float(os.getenv("LONG_FORM_MIN_SECONDS", 1800))
+DIARIZE_WINDOW_SECONDS = float(os.getenv("DIARIZE_WINDOW_SECONDS", 600))
+DIARIZE_WINDOW_OVERLAP = float(os.getenv("DIARIZE_WINDOW_OVERLAP", 30))
+DIARIZATION_WORKERS = int(os.getenv("DIARIZATION_WORKERS", 0))
+# Cosine distance under which speakers of different windows are the same person
+SPEAKER_CLUSTER_THRESHOLD = float(os.getenv("SPEAKER_CLUSTER_THRESHOLD", 0.5))
+DIARIZATION_SAMPLE_RATE = 16000  # pyannote works at 16 kHz; windows are resampled before going to workers
+
 def validate_token(token):
     """Validate the HuggingFace token format."""
     if not token or len(token) < 10:
         return False
     return True
 
-def separate_speakers(audio_path, output_dir):
+def load_diarization_pipeline():
+    """
+    Load the pyannote speaker diarization pipeline.
+
+    Use get_model("diarization") to share one instance across requests.
+    """
+    from pyannote.audio import Pipeline
+
+    # Load environment variables
+    load_dotenv()
+
+    # Get and validate the token
+    token = os.getenv("HUGGINGFACE_TOKEN")
+    if not token:
+        raise ValueError("HUGGINGFACE_TOKEN not found in environment variables")
+
+    if not validate_token(token):
+        raise ValueError("Invalid HuggingFace token format")
+
+    print("🔑 Token validated successfully")
+
+    # Initialize the speaker diarization pipeline
+    print("🔄 Initializing speaker diarization pipeline...")
+    pipeline = Pipeline.from_pretrained(
+        "pyannote/speaker-diarization-3.1",
+        use_auth_token=token
+    )
+    print("✓ Pipeline initialized successfully")
+    return pipeline
+
+def diarize(waveform, sr):
+    """
+    Run the shared diarization pipeline on an in-memory waveform.
+
+    Args:
+        waveform (np.ndarray): Audio as [samples, channels] float32
+        sr (int): Sample rate
+
+    Returns:
+        list: (start_seconds, end_seconds, speaker) turns in time order
+    """
+    import torch
+
+    # Shared pipeline, loaded on first use
+    pipeline = get_model("diarization")
+    mono = torch.from_numpy(np.ascontiguousarray(waveform.mean(axis=1)))[None]
+    with _diarization_lock, span("diarize", audio_seconds=len(waveform) / sr):
+        diarization = pipeline({"waveform": mono, "sample_rate": sr})
+    return [(turn.start, turn.end, speaker) for turn, _, speaker in diarization.itertracks(yield_label=True)]
+
+def _speaker_embeddings_mfcc(mono, sr, turns):
+    """Mean MFCC vector of each speaker's turns, for pipelines that do not return embeddings."""
+    import librosa
+
+    embeddings = {}
+    for speaker in sorted({speaker for _, _, speaker in turns}):
+        audio = mono[speaker_mask([(s, e) for s, e, label in turns if label == speaker], len(mono), sr)]
+        if len(audio) >= sr // 10:
+            embeddings[speaker] = librosa.feature.mfcc(y=audio, sr=sr, n_mfcc=20)[1:].mean(axis=1)
+    return embeddings
+
+def diarize_window(mono, sr):
+    """
+    Diarize one window and return its turns with one embedding per speaker.
+
+    Returns:
+        tuple: (turns, {speaker: embedding vector})
+    """
+    import torch
+
+    pipeline = get_model("diarization")
+    file = {"waveform": torch.from_numpy(np.ascontiguousarray(mono, dtype=np.float32))[None], "sample_rate": sr}
+    with _diarization_lock, span("diarize_window", audio_seconds=len(mono) / sr):
+        try:
+            diarization, vectors = pipeline(file, return_embeddings=True)
+            embeddings = dict(zip(diarization.labels(), np.asarray(vectors)))
+        except TypeError:
+            # Pipeline without speaker embeddings
+            diarization, embeddings = pipeline(file), None
+    turns = [(turn.start, turn.end, speaker) for turn, _, speaker in diarization.itertracks(yield_label=True)]
+    if embeddings is None:
+        embeddings = _speaker_embeddings_mfcc(mono, sr, turns)
+    # Speakers with too little speech get no (or a NaN) embedding and stay unmatched
+    return turns, {speaker: vector for speaker, vector in embeddings.items() if np.all(np.isfinite(vector))}
+
+def _init_diarization_worker(intra_op_threads):
+    from separation_model import configure_threads
+    configure_threads(intra_op_threads)
+    get_model("diarization")
+
+def _diarize_window_task(args):
+    return diarize_window(*args)
+
+def window_bounds(num_samples, sr, window=DIARIZE_WINDOW_SECONDS, overlap=DIARIZE_WINDOW_OVERLAP):
+    """
+    Cut a recording into overlapping windows.
+
+    Returns:
+        list: (start, end, keep_start, keep_end) in samples. The kept parts tile
+              the recording, meeting in the middle of each overlap.
+    """
+    size = int(sr * window)
+    hop = size - int(sr * overlap)
+    if hop <= 0:
+        raise ValueError("DIARIZE_WINDOW_OVERLAP must be shorter than DIARIZE_WINDOW_SECONDS")
+    starts = list(range(0, max(1, num_samples - size + hop), hop))
+    bounds = []
+    for i, start in enumerate(starts):
+        end = min(start + size, num_samples)
+        keep_start = 0 if i == 0 else (start + bounds[-1][1]) // 2
+        bounds.append((start, end, keep_start, end))
+        if i:
+            previous = bounds[-2]
+            bounds[-2] = (previous[0], previous[1], previous[2], keep_start)
+    return bounds
+
+def cluster_speakers(embeddings, threshold=SPEAKER_CLUSTER_THRESHOLD):
+    """
+    Group window speakers into global speakers by clustering their embeddings.
+
+    Windows are visited in order. Each window's speakers are matched one to
+    one to the closest global speaker centroids (so two speakers the pipeline
+    told apart within a window are never merged); speakers farther than
+    threshold from every centroid start a new global speaker.
+
+    Args:
+        embeddings (dict): {(window, speaker): embedding vector}
+        threshold (float): Maximum cosine distance between a speaker and its centroid
+
+    Returns:
+        dict: {(window, speaker): global speaker label}
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    windows = {}
+    for window, speaker in embeddings:
+        windows.setdefault(window, []).append(speaker)
+    centroids, counts, labels = [], [], {}
+    for window in sorted(windows):
+        speakers = windows[window]
+        vectors = np.stack([embeddings[(window, speaker)] for speaker in speakers])
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        matches = {}
+        if centroids:
+            means = np.stack(centroids)
+            means = means / np.maximum(np.linalg.norm(means, axis=1, keepdims=True), 1e-12)
+            distances = 1.0 - vectors @ means.T
+            for row, col in zip(*linear_sum_assignment(distances)):
+                if distances[row, col] <= threshold:
+                    matches[row] = col
+        for row, speaker in enumerate(speakers):
+            if row in matches:
+                col = matches[row]
+                counts[col] += 1
+                centroids[col] = centroids[col] + (vectors[row] - centroids[col]) / counts[col]
+            else:
+                col = len(centroids)
+                centroids.append(vectors[row])
+                counts.append(1)
+            labels[(window, speaker)] = f"SPEAKER_{col:02d}"
+    return labels
+
+def diarize_long(waveform, sr, window=DIARIZE_WINDOW_SECONDS, overlap=DIARIZE_WINDOW_OVERLAP,
+                 workers=DIARIZATION_WORKERS, threshold=SPEAKER_CLUSTER_THRESHOLD):
+    """
+    Diarize a long recording in overlapping windows, in parallel.
+
+    Every window is diarized on its own, so run time grows linearly with the
+    length and memory is bounded by the window size. Each window keeps the
+    turns of its own part of the recording, and window speakers are mapped
+    to global speakers by clustering their embeddings.
+
+    Args:
+        waveform (np.ndarray): Audio as [samples, channels] float32
+        sr (int): Sample rate
+        window (float): Seconds per window
+        overlap (float): Seconds shared by consecutive windows
+        workers (int): Worker processes (0 or 1 = in-process)
+        threshold (float): Cosine distance under which window speakers are merged
+
+    Returns:
+        list: (start_seconds, end_seconds, speaker) turns in time order
+    """
+    import soxr
+
+    mono = waveform.mean(axis=1)
+    if sr != DIARIZATION_SAMPLE_RATE:
+        mono = soxr.resample(mono, sr, DIARIZATION_SAMPLE_RATE)
+    bounds = window_bounds(len(mono), DIARIZATION_SAMPLE_RATE, window, overlap)
+    tasks = [(mono[start:end], DIARIZATION_SAMPLE_RATE) for start, end, _, _ in bounds]
+    print(f"🔹 Diarizing {len(mono) / DIARIZATION_SAMPLE_RATE:.0f}s in {len(tasks)} windows")
+
+    with span("diarize_long", audio_seconds=len(mono) / DIARIZATION_SAMPLE_RATE, windows=len(tasks)):
+        if workers > 1 and len(tasks) > 1:
+            intra_op_threads = max(1, (os.cpu_count() or 1) // workers)
+            share_metrics()  # The workers report their stages through METRICS_DIR
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                     mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_init_diarization_worker, initargs=(intra_op_threads,)) as pool:
+                results = list(pool.map(_diarize_window_task, tasks))
+        else:
+            results = [diarize_window(*task) for task in tasks]
+
+    embeddings = {(i, speaker): vector for i, (_, vectors) in enumerate(results) for speaker, vector in vectors.items()}
+    labels = cluster_speakers(embeddings, threshold)
+    turns = []
+    for i, ((start, _, keep_start, keep_end), (window_turns, _)) in enumerate(zip(bounds, results)):
+        offset = start / DIARIZATION_SAMPLE_RATE
+        lo, hi = keep_start / DIARIZATION_SAMPLE_RATE, keep_end / DIARIZATION_SAMPLE_RATE
+        for turn_start, turn_end, speaker in window_turns:
+            turn_start, turn_end = max(turn_start + offset, lo), min(turn_end + offset, hi)
+            if turn_end > turn_start:
+                turns.append((turn_start, turn_end, labels.get((i, speaker), f"SPEAKER_W{i}_{speaker}")))
+    turns.sort()
+
+    # Join the pieces of turns cut at window boundaries
+    merged = []
+    for start, end, speaker in turns:
+        if merged and merged[-1][2] == speaker and start - merged[-1][1] < 1e-3:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end), speaker)
+        else:
+            merged.append((start, end, speaker))
+    return merged
+
+def diarize_any(waveform, sr):
+    """Diarize in one call, or in windows when the recording is longer than LONG_FORM_MIN_SECONDS."""
+    if len(waveform) > LONG_FORM_MIN_SECONDS * sr:
+        return diarize_long(waveform, sr)
+    return diarize(waveform, sr)
+
+def diarize_voiced(waveform, sr):
+    """
+    Diarize only the voiced regions of a waveform.
+
+    The regions found by an energy pre-pass are concatenated with short
+    silences in between, diarized together, and the turns are mapped back
+    to their positions in the original waveform.
+
+    Returns:
+        list: (start_seconds, end_seconds, speaker) turns in time order
+    """
+    regions = active_regions(waveform.mean(axis=1), sr)
+    voiced = int((regions[:, 1] - regions[:, 0]).sum())
+    if not voiced:
+        print("⚠️ No voiced audio found")
+        return []
+    if voiced > MAX_VOICED_RATIO * len(waveform):
+        return diarize_any(waveform, sr)
+    print(f"🔹 Diarizing {voiced / sr:.1f}s of voiced audio out of {len(waveform) / sr:.1f}s "
+          f"in {len(regions)} regions")
+    voiced_waveform, offsets = compact(waveform, regions, int(sr * VOICED_GAP_SECONDS))
+    return map_turns(diarize_any(voiced_waveform, sr), regions, offsets, sr)
+
+def save_timeline(turns, path, uri="audio"):
+    """Write diarization turns as RTTM (.rttm) or JSON (any other extension)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        if path.endswith(".rttm"):
+            for start, end, speaker in turns:
+                f.write(f"SPEAKER {uri} 1 {start:.3f} {end - start:.3f} <NA> <NA> {speaker} <NA> <NA>\n")
+        else:
+            json.dump([{"start": start, "end": end, "speaker": speaker} for start, end, speaker in turns], f, indent=2)
+
+def load_timeline(path):
+    """Read diarization turns written by save_timeline."""
+    with open(path) as f:
+        if path.endswith(".rttm"):
+            turns = []
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 8 and fields[0] == "SPEAKER":
+                    start, duration = float(fields[3]), float(fields[4])
+                    turns.append((start, start + duration, fields[7]))
+            return turns
+        return [(turn["start"], turn["end"], turn["speaker"]) for turn in json.load(f)]
+
+def speaker_mask(turns, num_samples, sr):
+    """Boolean mask over samples covered by any of the given (start, end) turns."""
+    bounds = np.round(np.asarray(turns, dtype=np.float64).reshape(-1, 2) * sr).astype(np.int64)
+    bounds = np.clip(bounds, 0, num_samples)
+    # +1 at every turn start and -1 at every end; a running sum > 0 is inside a turn
+    delta = np.zeros(num_samples + 1, dtype=np.int32)
+    np.add.at(delta, bounds[:, 0], 1)
+    np.add.at(delta, bounds[:, 1], -1)
+    return np.cumsum(delta[:-1]) > 0
+
+def separate_speakers(audio_path, output_dir, keep_timing=False, timeline_path=None):
     """
     Separate individual speakers from an audio file using pyannote.audio
     
     Args:
         audio_path (str): Path to the input audio file
         output_dir (str): Directory to save the separated speaker audio files
+        keep_timing (bool): Keep every turn at its original position with silence
+            in between, instead of concatenating a speaker's turns
+        timeline_path (str, optional): RTTM or JSON diarization timeline. It is
+            reused when newer than the audio file, otherwise it is (re)written
     
     Returns:
         dict: Dictionary containing paths to separated speaker audio files
     """
     try:
-        # Load environment variables
-        load_dotenv()
-        
-        # Get and validate the token
-        token = os.getenv("HUGGINGFACE_TOKEN")
-        if not token:
-            raise ValueError("HUGGINGFACE_TOKEN not found in environment variables")
-        
-        if not validate_token(token):
-            raise ValueError("Invalid HuggingFace token format")
-        
-        print("🔑 Token validated successfully")
-        
-        # Initialize the speaker diarization pipeline
-        print("🔄 Initializing speaker diarization pipeline...")
-        pipeline = Pipeline.from_pretrained(
-            "pyannote/speaker-diarization-3.1",
-            use_auth_token=token
-        )
-        print("✓ Pipeline initialized successfully")
-        
         # Check if input file exists
         if not os.path.exists(audio_path):
             raise FileNotFoundError(f"Input audio file not found: {audio_path}")
         
-        # Load the audio file
+        # Load the audio file once, as [samples, channels]
         print(f"🔊 Loading audio file: {audio_path}")
-        audio = AudioSegment.from_wav(audio_path)
+        waveform, sr = sf.read(audio_path, dtype="float32", always_2d=True)
         print("✓ Audio file loaded successfully")
         
-        # Perform speaker diarization
-        print("🎯 Performing speaker diarization...")
-        diarization = pipeline(audio_path)
-        print("✓ Diarization completed")
+        if (timeline_path and os.path.exists(timeline_path)
+                and os.path.getmtime(timeline_path) >= os.path.getmtime(audio_path)):
+            print(f"♻️ Reusing diarization timeline: {timeline_path}")
+            turns = load_timeline(timeline_path)
+        else:
+            # Perform speaker diarization
+            print("🎯 Performing speaker diarization...")
+            turns = diarize_voiced(waveform, sr) if DIARIZE_VOICED_ONLY else diarize_any(waveform, sr)
+            print("✓ Diarization completed")
+            if timeline_path:
+                save_timeline(turns, timeline_path, uri=os.path.splitext(os.path.basename(audio_path))[0])
+                print(f"✓ Diarization timeline saved: {timeline_path}")
+        
+        if not turns:
+            print("⚠️ No speaker segments were detected")
+            return {}
         
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
         print(f"📁 Output directory ready: {output_dir}")
         
-        # Dictionary to store speaker audio segments
-        speaker_segments = {}
-        
-        # Process each speaker segment
-        print("\n🔍 Processing speaker segments...")
-        for turn, _, speaker in diarization.itertracks(yield_label=True):
-            # Convert time to milliseconds
-            start_ms = int(turn.start * 1000)
-            end_ms = int(turn.end * 1000)
-            
-            # Extract the segment for this speaker
-            speaker_audio = audio[start_ms:end_ms]
-            
-            # Add to speaker segments dictionary
-            if speaker not in speaker_segments:
-                speaker_segments[speaker] = []
-            speaker_segments[speaker].append(speaker_audio)
-        
-        if not speaker_segments:
-            print("⚠️ No speaker segments were detected")
-            return {}
+        # Group turn boundaries by speaker
+        speaker_turns = {}
+        for start, end, speaker in turns:
+            speaker_turns.setdefault(speaker, []).append((start, end))
         
-        # Merge segments for each speaker and save to files
+        # Build each speaker's track with a single mask over the waveform
         speaker_files = {}
         print("\n💾 Saving speaker audio files...")
-        for speaker, segments in speaker_segments.items():
-            # Concatenate all segments for this speaker
-            merged_audio = sum(segments)
+        for speaker, bounds in speaker_turns.items():
+            mask = speaker_mask(bounds, len(waveform), sr)
+            if keep_timing:
+                speaker_audio = np.where(mask[:, None], waveform, 0.0)
+            else:
+                speaker_audio = waveform[mask]
             
             # Convert speaker label to lowercase and remove any special characters
             speaker_key = f"speaker_{speaker.lower().replace('_', '')}"
             
             # Save to file
             output_path = os.path.join(output_dir, f"{speaker_key}.wav")
-            merged_audio.export(output_path, format="wav")
+            sf.write(output_path, speaker_audio, sr, subtype="PCM_16")
             speaker_files[speaker_key] = output_path
             print(f"✓ Saved speaker {speaker} to {output_path}")
         
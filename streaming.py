@@ -0,0 +1,175 @@
+"""
+Block-by-block separation of live audio with DemucsModel.
+
+Every output block of `block` seconds is separated from a fixed-size window:
+`context` seconds of already emitted audio before it, then the block itself,
+a `crossfade` region shared with the next block and `lookahead` seconds of
+future audio. The edges of each window, where the model sees the least
+audio, are never emitted, and consecutive blocks are joined with a linear
+crossfade.
+
+A block can be emitted as soon as its lookahead has arrived, so the
+algorithmic latency is fixed at block + crossfade + lookahead seconds, and
+the model always runs on the same window length, which keeps the compute
+time per block constant.
+"""
+import os
+import time
+from functools import partial
+import numpy as np
+import soxr
+from separation_model import separate_chunks, SAMPLE_RATE, LABELS
+from instrumentation import span
+
+STREAM_BLOCK_SECONDS = float(os.getenv("STREAM_BLOCK_SECONDS", 1.0))
+STREAM_LOOKAHEAD_SECONDS = float(os.getenv("STREAM_LOOKAHEAD_SECONDS", 0.5))
+STREAM_CONTEXT_SECONDS = float(os.getenv("STREAM_CONTEXT_SECONDS", 2.0))
+STREAM_CROSSFADE_SECONDS = float(os.getenv("STREAM_CROSSFADE_SECONDS", 0.1))
+# Upper bound on block + crossfade + lookahead; configurations above it are rejected
+STREAM_MAX_LATENCY_SECONDS = float(os.getenv("STREAM_MAX_LATENCY_SECONDS", 2.0))
+
+PCM_FORMATS = {"f32": np.dtype("<f4"), "s16": np.dtype("<i2")}
+
+class StreamingSeparator:
+    """
+    Separate a mono stream pushed in arbitrary pieces into blocks of four stems.
+
+    Args:
+        block (float): Seconds of audio per emitted block
+        lookahead (float): Seconds of future audio the model sees after each block
+        context (float): Seconds of past audio carried over into each window
+        crossfade (float): Seconds blended between consecutive blocks
+        max_latency (float): Reject settings whose algorithmic latency exceeds this
+        separate (callable, optional): Maps a list of windows to a list of [4, T]
+            arrays; defaults to separation_model.separate_chunks, which skips silent windows
+            (live windows rarely repeat, so the chunk cache is not used)
+    """
+
+    def __init__(self, block=STREAM_BLOCK_SECONDS, lookahead=STREAM_LOOKAHEAD_SECONDS,
+                 context=STREAM_CONTEXT_SECONDS, crossfade=STREAM_CROSSFADE_SECONDS,
+                 max_latency=STREAM_MAX_LATENCY_SECONDS, separate=None):
+        self.block = int(SAMPLE_RATE * block)
+        self.lookahead = int(SAMPLE_RATE * lookahead)
+        self.context = int(SAMPLE_RATE * context)
+        self.crossfade = int(SAMPLE_RATE * crossfade)
+        if self.block <= 0 or min(self.lookahead, self.context, self.crossfade) < 0:
+            raise ValueError("block must be positive and lookahead, context and crossfade non-negative")
+        if self.crossfade > self.block:
+            raise ValueError("crossfade must not be longer than block")
+        if self.latency_seconds > max_latency:
+            raise ValueError(f"Algorithmic latency {self.latency_seconds:.3f}s exceeds the "
+                             f"{max_latency:.3f}s bound")
+        self.window = self.context + self.block + self.crossfade + self.lookahead
+        self.separate = separate or partial(separate_chunks, use_cache=False)
+        # The first window sees silence as its context
+        self._buffer = np.zeros(self.context, dtype=np.float32)
+        self._tail = None
+        self._received = 0
+        self._emitted = 0
+        self.last_compute_seconds = 0.0  # Model time of the latest block
+        self.max_compute_seconds = 0.0
+
+    @property
+    def latency_seconds(self):
+        """Algorithmic latency: how long after a sample arrives its block can be emitted."""
+        return (self.block + self.crossfade + self.lookahead) / SAMPLE_RATE
+
+    def push(self, samples):
+        """
+        Add mono float32 samples at SAMPLE_RATE.
+
+        Returns:
+            list: [4, block] float32 arrays (stems ordered as LABELS) that became ready
+        """
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+        self._buffer = np.concatenate([self._buffer, samples])
+        self._received += len(samples)
+        blocks = []
+        while len(self._buffer) >= self.window:
+            blocks.append(self._process(self._buffer[:self.window]))
+            self._buffer = self._buffer[self.block:]
+        return blocks
+
+    def flush(self):
+        """Emit the remaining audio once the input has ended; the last block may be shorter."""
+        blocks = []
+        while self._emitted < self._received:
+            pending = self._received - self._emitted
+            padding = max(0, self.window - len(self._buffer))
+            window = np.concatenate([self._buffer, np.zeros(padding, dtype=np.float32)])[:self.window]
+            stems = self._process(window)
+            blocks.append(stems[:, :min(self.block, pending)])
+            self._buffer = self._buffer[self.block:]
+        if blocks:
+            self._emitted = self._received
+        return blocks
+
+    def _process(self, window):
+        start = time.perf_counter()
+        with span("stream_block", samples=self.block):
+            stems = self.separate([window])[0]
+        self.last_compute_seconds = time.perf_counter() - start
+        self.max_compute_seconds = max(self.max_compute_seconds, self.last_compute_seconds)
+        if self.last_compute_seconds > self.block / SAMPLE_RATE:
+            print(f"Warning: Streaming block took {self.last_compute_seconds:.3f}s, "
+                  f"longer than its {self.block / SAMPLE_RATE:.3f}s of audio")
+        if stems is None:
+            stems = np.zeros((len(LABELS), self.window), dtype=np.float32)
+
+        body = stems[:, self.context:self.context + self.block + self.crossfade]
+        if self._tail is not None and self.crossfade:
+            fade_in = (np.arange(self.crossfade, dtype=np.float32) + 0.5) / self.crossfade
+            body = body.copy()
+            body[:, :self.crossfade] = self._tail * (1.0 - fade_in) + body[:, :self.crossfade] * fade_in
+        self._tail = body[:, self.block:].copy()
+        self._emitted += self.block
+        return np.ascontiguousarray(body[:, :self.block], dtype=np.float32)
+
+def decode_pcm(data, sample_format="f32", channels=1):
+    """
+    Convert little-endian PCM bytes into mono float32 samples.
+
+    Returns:
+        tuple: (samples, leftover bytes of an incomplete frame)
+    """
+    dtype = PCM_FORMATS[sample_format]
+    frame_bytes = dtype.itemsize * channels
+    usable = len(data) - len(data) % frame_bytes
+    frames = np.frombuffer(data[:usable], dtype=dtype).reshape(-1, channels)
+    samples = frames.astype(np.float32)
+    if dtype.kind == "i":
+        samples /= np.iinfo(dtype).max + 1
+    return samples.mean(axis=1), data[usable:]
+
+def separate_stream(read, separator, sample_rate=SAMPLE_RATE, sample_format="f32", channels=1,
+                    read_size=16384):
+    """
+    Separate PCM read from a byte stream and yield the stems as they become ready.
+
+    Args:
+        read (callable): read(n) -> bytes, returning b"" at the end of the input
+        separator (StreamingSeparator): Separator holding the stream's state
+        sample_rate (int): Rate of the incoming audio; resampled to SAMPLE_RATE
+        sample_format (str): "f32" or "s16" little-endian PCM
+        channels (int): Interleaved channels of the input, mixed down to mono
+        read_size (int): Bytes requested per read
+
+    Yields:
+        bytes: Each block as interleaved little-endian float32 frames with one channel per stem
+    """
+    resampler = None
+    if sample_rate != SAMPLE_RATE:
+        resampler = soxr.ResampleStream(sample_rate, SAMPLE_RATE, 1, dtype="float32")
+    leftover = b""
+    while True:
+        data = read(read_size)
+        last = not data
+        samples, leftover = decode_pcm(leftover + data, sample_format, channels)
+        if resampler is not None:
+            samples = resampler.resample_chunk(samples, last=last)
+        for stems in separator.push(samples):
+            yield stems.T.astype("<f4").tobytes()
+        if last:
+            break
+    for stems in separator.flush():
+        yield stems.T.astype("<f4").tobytes()
@@ -0,0 +1,39 @@
+import numpy as np
+from activity import silent_chunks, active_regions, compact, map_turns
+
+SR = 16000
+
+def tone(seconds, amplitude=0.5):
+    t = np.arange(int(SR * seconds)) / SR
+    return (amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+def test_silent_chunks_flags_only_quiet_chunks():
+    quiet = np.full(SR, 1e-5, dtype=np.float32)
+    # A short burst inside an otherwise silent chunk keeps it
+    burst = np.zeros(SR, dtype=np.float32)
+    burst[SR // 2:SR // 2 + 800] = tone(0.05)
+    chunks = [np.zeros(SR, dtype=np.float32), tone(1.0), quiet, burst, tone(0.3)]
+    assert silent_chunks(chunks, SR).tolist() == [True, False, True, False, False]
+
+def test_voiced_regions_map_back_to_original_timeline():
+    audio = np.concatenate([np.zeros(SR * 3), tone(2.0), np.zeros(int(SR * 0.2)), tone(1.0),
+                            np.zeros(SR * 5), tone(1.0), np.zeros(SR * 2)]).astype(np.float32)
+    regions = active_regions(audio, SR, padding=0.0)
+    # The 0.2 s pause is shorter than min_gap and does not split the first region
+    np.testing.assert_allclose(regions / SR, [[3.0, 6.2], [11.2, 12.2]], atol=0.05)
+
+    voiced, offsets = compact(audio, regions, gap=SR)
+    assert len(voiced) == (regions[:, 1] - regions[:, 0]).sum() + SR
+    # One turn per region, plus one spanning the gap between them
+    region_end = (offsets[0] + regions[0, 1] - regions[0, 0]) / SR
+    turns = [(0.5, 1.0, "A"), (offsets[1] / SR + 0.25, offsets[1] / SR + 0.5, "B"),
+             (region_end - 0.5, offsets[1] / SR + 0.5, "C")]
+    mapped = map_turns(turns, regions, offsets, SR)
+    start = regions[:, 0] / SR
+    np.testing.assert_allclose([m[:2] for m in mapped], [
+        (start[0] + 0.5, start[0] + 1.0),
+        (start[1] + 0.25, start[1] + 0.5),
+        (regions[0, 1] / SR - 0.5, regions[0, 1] / SR),
+        (start[1], start[1] + 0.5),
+    ])
+    assert [m[2] for m in mapped] == ["A", "B", "C", "C"]
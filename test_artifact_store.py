@@ -0,0 +1,25 @@
+import os
+import numpy as np
+import soundfile as sf
+from artifact_store import ArtifactIndex
+
+def test_index_reads_headers_and_evicts_least_recently_used(tmp_path):
+    index = ArtifactIndex(str(tmp_path / "artifacts.db"))
+    paths = []
+    for i in range(4):
+        path = tmp_path / f"stem_{i}.wav"
+        sf.write(path, np.zeros((44100, 2)), 44100, subtype="PCM_16")
+        paths.append(path)
+        index.register(str(path), "job", kind="stem")
+
+    record = index.lookup("job", "stem_0.wav")  # Most recently used from now on
+    assert (record["duration"], record["sample_rate"], record["channels"]) == (1.0, 44100, 2)
+    assert index.lookup("other", "stem_0.wav") is None
+
+    size = os.path.getsize(paths[0])
+    assert index.enforce(max_bytes=2 * size) == 2
+    assert [r["name"] for r in index.find("job")] == ["stem_0.wav", "stem_3.wav"]
+    assert not paths[1].exists() and not paths[2].exists()
+
+    assert index.enforce(max_age=-1) == 2
+    assert index.total_size() == 0
@@ -0,0 +1,33 @@
+import os
+import numpy as np
+import soundfile as sf
+from pydub import AudioSegment
+from audio_processing import normalize_volume, normalize_files, measure_loudness
+
+def test_normalize_volume_matches_pydub_dbfs(tmp_path):
+    audio = (np.random.default_rng(0).standard_normal((44100, 2)) * 0.05).astype(np.float32)
+    input_path = str(tmp_path / "stem.wav")
+    sf.write(input_path, audio, 44100, subtype="PCM_16")
+
+    output_path = normalize_volume(input_path, target_dBFS=-20.0)
+
+    assert output_path.endswith("_normalized.wav")
+    assert sf.info(output_path).subtype == "PCM_16"
+    assert abs(AudioSegment.from_wav(output_path).dBFS - -20.0) < 0.05
+    assert abs(measure_loudness(sf.read(input_path)[0])["rms"] - AudioSegment.from_wav(input_path).dBFS) < 0.01
+
+def test_repeat_normalization_is_served_from_cache(tmp_path):
+    paths = {}
+    for name in ("bass", "vocal"):
+        paths[name] = str(tmp_path / f"{name}.wav")
+        sf.write(paths[name], np.full(4410, 0.25, dtype=np.float32), 44100)
+
+    normalized, errors = normalize_files(paths, target_dBFS=-6.0, mode="peak")
+    assert not errors
+    mtimes = {name: os.path.getmtime(path) for name, path in normalized.items()}
+    peak = measure_loudness(sf.read(normalized["bass"])[0])["peak"]
+    assert abs(peak - -6.0) < 0.01
+
+    normalized_again, _ = normalize_files(paths, target_dBFS=-6.0, mode="peak")
+    assert normalized_again == normalized
+    assert {name: os.path.getmtime(path) for name, path in normalized_again.items()} == mtimes
@@ -0,0 +1,49 @@
+import json
+import os
+import sys
+import types
+from batch_cli import Ledger, read_manifest, file_fingerprint, process_file
+
+def test_ledger_skips_only_unchanged_finished_files(tmp_path):
+    song = tmp_path / "song.wav"
+    song.write_bytes(b"audio")
+    stem = tmp_path / "out" / "denoised_merged_bass.wav"
+    stem.parent.mkdir()
+    stem.write_bytes(b"stem")
+
+    ledger = Ledger(str(tmp_path / "ledger.jsonl"))
+    ledger.record({"path": str(song), "status": "failed", "error": "boom"})
+    ledger.record({"path": str(song), "status": "done", "fingerprint": file_fingerprint(song),
+                   "outputs": {"bass": str(stem)}})
+
+    resumed = Ledger(str(tmp_path / "ledger.jsonl"))
+    assert resumed.is_done(str(song))
+    os.utime(song, ns=(0, 0))
+    assert not resumed.is_done(str(song))
+
+def test_manifest_accepts_plain_and_json_lines(tmp_path):
+    manifest = tmp_path / "files.txt"
+    manifest.write_text("# catalog\nalbum/a.wav\n" + json.dumps({"path": "/elsewhere/b.mp3"}) + "\n")
+    assert read_manifest(str(manifest)) == [(str(tmp_path / "album" / "a.wav"), os.path.join("album", "a.wav")),
+                                            ("/elsewhere/b.mp3", "b.mp3")]
+
+def test_failed_speaker_step_is_not_recorded_as_done(tmp_path, monkeypatch):
+    song = tmp_path / "song.wav"
+    song.write_bytes(b"audio")
+    out = tmp_path / "out"
+
+    def fake_process_upload(path, output_dir, **options):
+        vocal = os.path.join(output_dir, "denoised_merged_vocal.wav")
+        open(vocal, "wb").close()
+        return {"vocal": vocal}
+
+    monkeypatch.setitem(sys.modules, "pipeline", types.SimpleNamespace(process_upload=fake_process_upload))
+    # separate_speakers returns {} when diarization fails (e.g. a bad token)
+    monkeypatch.setitem(sys.modules, "speaker_separation",
+                        types.SimpleNamespace(separate_speakers=lambda *args, **kwargs: {}))
+
+    entry = process_file(str(song), str(out), speakers=True)
+    assert entry["status"] == "failed"
+    ledger = Ledger(str(tmp_path / "ledger.jsonl"))
+    ledger.record(entry)
+    assert not Ledger(str(tmp_path / "ledger.jsonl")).is_done(str(song))
@@ -0,0 +1,27 @@
+import io
+import zipfile
+import numpy as np
+import soundfile as sf
+from bundle import get_bundle, bundle_members, bundle_size
+
+def test_streamed_bundle_is_cached_and_reused(tmp_path):
+    (tmp_path / "speakers").mkdir()
+    noise = np.random.default_rng(0).uniform(-0.5, 0.5, (44100 * 3, 2))
+    sf.write(tmp_path / "denoised_merged_bass.wav", noise, 44100, subtype="PCM_16")
+    sf.write(tmp_path / "speakers" / "speaker_SPEAKER_00.wav", noise[:, 0], 44100)
+
+    cached_path, chunks = get_bundle(str(tmp_path))
+    assert cached_path is None
+    streamed = b"".join(chunks)
+    assert len(streamed) == bundle_size(bundle_members(str(tmp_path)))
+
+    with zipfile.ZipFile(io.BytesIO(streamed)) as zipf:
+        assert zipf.namelist() == ["denoised_merged_bass.wav", "speakers/speaker_SPEAKER_00.wav"]
+        assert zipf.testzip() is None
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in zipf.infolist())
+        assert zipf.read("denoised_merged_bass.wav") == (tmp_path / "denoised_merged_bass.wav").read_bytes()
+
+    cached_path, chunks = get_bundle(str(tmp_path))
+    assert chunks is None
+    with open(cached_path, "rb") as f:
+        assert f.read() == streamed
@@ -0,0 +1,23 @@
+import numpy as np
+import separation_model
+from disk_cache import DiskCache
+
+def test_separate_chunks_runs_the_model_only_on_new_chunks(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_separate_arrays(chunks, batch_size):
+        calls.append(len(chunks))
+        return [np.stack([chunk * (i + 1) for i in range(4)]) for chunk in chunks]
+
+    monkeypatch.setattr(separation_model, "separate_arrays", fake_separate_arrays)
+    monkeypatch.setattr(separation_model, "chunk_cache", DiskCache(str(tmp_path), 1 << 30))
+    rng = np.random.default_rng(0)
+    original = [rng.standard_normal(1000).astype(np.float32) for _ in range(3)]
+    edited = original + [rng.standard_normal(400).astype(np.float32)]
+
+    first = separation_model.separate_chunks(original, use_cache=True)
+    second = separation_model.separate_chunks(edited, use_cache=True)
+    assert calls == [3, 1]
+    for stems, expected in zip(second, first):
+        np.testing.assert_array_equal(stems, expected)
+    assert second[3].shape == (4, 400)
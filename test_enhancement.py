@@ -0,0 +1,73 @@
+import numpy as np
+import soundfile as sf
+import torch
+import model_registry
+import enhancement
+from process import SAMPLE_RATE
+
+LSB = 1 / 32768
+GAINS = {"drums": 0.1, "bass": 0.2, "other": 0.3, "vocals": 0.4}
+
+class FakeDemucs(torch.nn.Module):
+    """Smooths its input and splits it into sources by fixed gains, which add up to the input like Demucs."""
+    sources = list(GAINS)
+    samplerate = SAMPLE_RATE
+    audio_channels = 2
+    segment = 1.5
+
+    def forward(self, mix):
+        kernel = torch.tensor([[[0.25, 0.5, 0.25]]]).repeat(mix.shape[1], 1, 1)
+        smoothed = torch.nn.functional.conv1d(mix, kernel, padding=1, groups=mix.shape[1])
+        gains = torch.tensor(list(GAINS.values()))[None, :, None, None]
+        return gains * smoothed[:, None]
+
+def write_audio(path, audio):
+    sf.write(str(path), audio, SAMPLE_RATE, subtype="FLOAT")
+    return str(path)
+
+def make_upload(tmp_path):
+    rng = np.random.default_rng(0)
+    mix = rng.uniform(-0.5, 0.5, int(SAMPLE_RATE * 4.3)).astype(np.float32)
+    # Stems equal to the model's estimate of their source in the mix
+    stems = {name: write_audio(tmp_path / f"merged_{name}.wav", GAINS[source] * mix)
+             for name, source in (("bass", "bass"), ("vocal", "vocals"))}
+    return write_audio(tmp_path / "upload.wav", mix), stems
+
+def test_batched_and_mix_match_per_stem(tmp_path, monkeypatch):
+    monkeypatch.setitem(model_registry._models, "enhancement", FakeDemucs())
+    mixture_path, stems = make_upload(tmp_path)
+    settings = dict(shifts=0, window=2.0)
+
+    per_stem = [str(tmp_path / f"per_stem_{name}.wav") for name in stems]
+    for input_path, output_path in zip(stems.values(), per_stem):
+        assert enhancement.enhance_audio(input_path, output_path, **settings)
+    batched = [str(tmp_path / f"batched_{name}.wav") for name in stems]
+    assert enhancement.enhance_batched(list(stems.values()), batched, **settings)
+    mix_dir = tmp_path / "mix"
+    mix_dir.mkdir()
+    monkeypatch.setattr(enhancement, "ENHANCE_SHIFTS", 0)
+    mixed = enhancement.enhance_all_components(stems, str(mix_dir), mode="mix", mixture_path=mixture_path)
+
+    assert {name: path.rsplit("/", 1)[1] for name, path in mixed.items()} == {
+        "bass": "denoised_merged_bass.wav", "vocal": "denoised_merged_vocal.wav"}
+    weight = enhancement.ENHANCE_FUSION_WEIGHT
+    for stem_path, expected_path, batched_path, mixed_path in zip(stems.values(), per_stem, batched, mixed.values()):
+        expected, _ = sf.read(expected_path)
+        assert np.abs(sf.read(batched_path)[0] - expected).max() <= LSB
+        # The model's estimate in the mix is the stem's own, so a fused stem is the per-stem output
+        # blended with the stem at the same scale
+        stem, _ = sf.read(stem_path)
+        fused = weight * expected + (1 - weight) * stem[:, None] / len(GAINS)
+        assert np.abs(sf.read(mixed_path)[0] - fused).max() <= 2 * LSB
+
+def test_mix_mode_falls_back_to_per_stem_for_unstreamable_uploads(tmp_path, monkeypatch):
+    monkeypatch.setitem(model_registry._models, "enhancement", FakeDemucs())
+    _, stems = make_upload(tmp_path)
+    upload = tmp_path / "upload.m4a"
+    upload.write_bytes(b"\x00\x00\x00\x20ftypM4A ")
+    calls = []
+    monkeypatch.setattr(enhancement, "enhance_from_mix", lambda *args, **kwargs: calls.append(args))
+
+    enhanced = enhancement.enhance_all_components(stems, str(tmp_path), mode="mix", mixture_path=str(upload))
+    assert not calls
+    assert sorted(enhanced) == ["bass", "vocal"]
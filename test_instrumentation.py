@@ -0,0 +1,26 @@
+import multiprocessing
+import os
+import instrumentation
+
+def count_job():
+    instrumentation.JOBS.inc(status="test")
+
+def test_render_metrics_adds_up_every_process(tmp_path, monkeypatch):
+    monkeypatch.setenv("METRICS_DIR", str(tmp_path))
+    monkeypatch.setattr(instrumentation, "METRICS_DIR", str(tmp_path))
+    instrumentation.JOBS.inc(status="test")
+    instrumentation.share_metrics()
+
+    # A spawned pool worker and a forked serve.py worker, which flushes before os._exit
+    child = multiprocessing.get_context("spawn").Process(target=count_job)
+    child.start()
+    child.join()
+    pid = os.fork()
+    if pid == 0:
+        count_job()
+        instrumentation.flush_metrics()
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert 'pipeline_jobs_total{status="test"} 3' in instrumentation.render_metrics().splitlines()
+    assert instrumentation.JOBS.value(status="test") == 1
@@ -0,0 +1,52 @@
+import os
+import threading
+from jobs import JobQueue
+
+def test_submit_outputs_queues_a_missing_output_once(tmp_path):
+    release = threading.Event()
+    calls = []
+
+    def handler(filepath, job_dir, stems=None):
+        calls.append(stems)
+        if stems:
+            release.wait(5)
+        files = {}
+        for stem in stems or ["vocal"]:
+            files[stem] = os.path.join(job_dir, f"denoised_merged_{stem}.wav")
+            open(files[stem], "wb").close()
+        return files
+
+    jobs = JobQueue(handler, jobs_folder=str(tmp_path), num_workers=2)
+    job_id, filepath = jobs.create_job("song.wav")
+    jobs.submit(job_id, filepath)
+    jobs._queue.join()
+    assert jobs.get(job_id)["status"] == "done"
+
+    first = jobs.submit_outputs(job_id, filepath, ["bass"], stems=["bass"])
+    second = jobs.submit_outputs(job_id, filepath, ["bass"], stems=["bass"])
+    assert list(first["pending"]) == list(second["pending"]) == ["bass"]
+    release.set()
+    jobs._queue.join()
+
+    state = jobs.get(job_id)
+    assert calls == [None, ["bass"]]
+    assert state["status"] == "done" and not state["pending"]
+    assert state["files"] == {"vocal": "denoised_merged_vocal.wav", "bass": "denoised_merged_bass.wav"}
+    assert jobs.submit_outputs(job_id, filepath, ["bass"], stems=["bass"])["pending"] == {}
+
+def test_submit_outputs_queues_outputs_whose_file_was_removed_again(tmp_path):
+    def handler(filepath, job_dir, stems=None):
+        path = os.path.join(job_dir, "denoised_merged_vocal.wav")
+        open(path, "wb").close()
+        return {"vocal": path}
+
+    jobs = JobQueue(handler, jobs_folder=str(tmp_path), num_workers=1)
+    job_id, filepath = jobs.create_job("song.wav")
+    jobs.submit(job_id, filepath)
+    jobs._queue.join()
+    os.remove(os.path.join(jobs.job_dir(job_id), "denoised_merged_vocal.wav"))
+
+    state = jobs.submit_outputs(job_id, filepath, ["vocal"], stems=["vocal"])
+    assert list(state["pending"]) == ["vocal"] and "vocal" not in state["files"]
+    jobs._queue.join()
+    assert jobs.get(job_id)["files"] == {"vocal": "denoised_merged_vocal.wav"}
@@ -0,0 +1,56 @@
+import os
+import pipeline
+from disk_cache import DiskCache
+
+def test_result_cache_serves_and_stores_each_stem_on_its_own(tmp_path, monkeypatch):
+    upload = tmp_path / "song.wav"
+    upload.write_bytes(b"audio")
+    processed = []
+
+    def fake_separate_and_merge(filepath, output_folder, stems, use_cache):
+        processed.append(list(stems))
+        os.makedirs(output_folder, exist_ok=True)
+        merged = {}
+        for label in stems:
+            merged[label] = os.path.join(output_folder, f"merged_{label}.wav")
+            with open(merged[label], "w") as f:
+                f.write(label)
+        return merged
+
+    def fake_enhance(merged_files, output_folder, mixture_path=None):
+        enhanced = {}
+        for label, path in merged_files.items():
+            enhanced[label] = os.path.join(output_folder, f"denoised_{os.path.basename(path)}")
+            os.replace(path, enhanced[label])
+        return enhanced
+
+    monkeypatch.setattr(pipeline, "separate_and_merge_in_memory", fake_separate_and_merge)
+    monkeypatch.setattr(pipeline, "enhance_all_components", fake_enhance)
+    monkeypatch.setattr(pipeline, "result_cache", DiskCache(str(tmp_path / "cache"), 1 << 30))
+
+    first = pipeline.process_upload(str(upload), str(tmp_path / "a"), mode="memory", stems=["vocal"])
+    second = pipeline.process_upload(str(upload), str(tmp_path / "b"), mode="memory", stems=["bass", "vocal"])
+    third = pipeline.process_upload(str(upload), str(tmp_path / "c"), mode="memory", stems=["vocal", "bass"])
+
+    assert processed == [["vocal"], ["bass"]]
+    assert list(first) == ["vocal"]
+    assert list(second) == list(third) == ["bass", "vocal"]
+    for files in (second, third):
+        assert {label: open(path).read() for label, path in files.items()} == {"bass": "bass", "vocal": "vocal"}
+
+def test_uncached_runs_do_not_use_the_chunk_cache(tmp_path, monkeypatch):
+    upload = tmp_path / "song.wav"
+    upload.write_bytes(b"audio")
+    calls = []
+
+    def fake_separate_chunks(chunks, use_cache=True):
+        calls.append(use_cache)
+        return [None for _ in chunks]
+
+    monkeypatch.setattr(pipeline, "split_audio_arrays", lambda path: ([[0.0] * 10], 44100))
+    monkeypatch.setattr(pipeline, "separate_chunks", fake_separate_chunks)
+    monkeypatch.setattr(pipeline, "merge_arrays", lambda chunks, sr, name, folder: os.path.join(folder, name))
+    monkeypatch.setattr(pipeline, "enhance_all_components", lambda merged, folder, mixture_path=None: merged)
+
+    pipeline.process_upload(str(upload), str(tmp_path), mode="memory", use_cache=False, stems=["vocal"])
+    assert calls == [False]
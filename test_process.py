@@ -0,0 +1,25 @@
+import numpy as np
+import soundfile as sf
+from process import stream_windows, OverlapAddWriter, SAMPLE_RATE
+
+def test_streaming_overlap_add_reconstructs_input(tmp_path):
+    # 25.3 seconds at a different rate exercises resampling and a short last window
+    audio = np.random.default_rng(0).uniform(-0.5, 0.5, int(48000 * 25.3)).astype(np.float32)
+    input_path = tmp_path / "input.wav"
+    sf.write(input_path, audio, 48000, subtype="FLOAT")
+    expected, _ = sf.read(input_path, dtype="float32")
+
+    overlap = 1.0
+    output_files = [tmp_path / "a.wav", tmp_path / "b.wav"]
+    with OverlapAddWriter(output_files, SAMPLE_RATE, int(SAMPLE_RATE * overlap)) as writer:
+        for window in stream_windows(input_path, segment_length=10, overlap=overlap):
+            writer.write(np.stack([window, -window]))
+
+    a, sr = sf.read(output_files[0], dtype="float32")
+    b, _ = sf.read(output_files[1], dtype="float32")
+    assert sr == SAMPLE_RATE
+    assert abs(len(a) - len(expected) * SAMPLE_RATE / 48000) <= 1
+    np.testing.assert_allclose(a, -b, atol=1e-4)
+    # Identity stems must come back unchanged apart from resampling error
+    reference = np.concatenate(list(stream_windows(input_path, segment_length=1000, overlap=0)))
+    np.testing.assert_allclose(a, reference[:len(a)], atol=1e-4)
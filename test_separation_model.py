@@ -0,0 +1,47 @@
+import numpy as np
+import soundfile as sf
+import torch
+import model_registry
+import separation_model
+from disk_cache import DiskCache
+from separation_model import SAMPLE_RATE
+
+GAINS = [0.1, 0.2, 0.3, 0.4]
+LSB = 1 / 32768
+
+class FakeSeparator(torch.nn.Module):
+    """Scales its input per stem and returns a few extra samples, like the real model."""
+
+    def __init__(self):
+        super().__init__()
+        self.batch_shapes = []
+
+    def forward(self, batch):
+        self.batch_shapes.append(tuple(batch.shape))
+        stems = torch.tensor(GAINS)[None, :, None] * batch
+        return torch.nn.functional.pad(stems, (0, 33), value=1.0)
+
+def test_separate_batch_pads_and_trims_a_short_final_chunk(tmp_path, monkeypatch):
+    model = FakeSeparator()
+    monkeypatch.setitem(model_registry._models, "separation", model)
+    monkeypatch.setattr(separation_model, "chunk_cache", DiskCache(str(tmp_path / "cache"), 1 << 30))
+    rng = np.random.default_rng(0)
+    chunks = [rng.uniform(-0.5, 0.5, length).astype(np.float32) for length in (1000, 1000, 400)]
+    chunk_paths = []
+    for i, chunk in enumerate(chunks):
+        chunk_paths.append(str(tmp_path / f"temp_chunk_{i}.wav"))
+        sf.write(chunk_paths[-1], chunk, SAMPLE_RATE, subtype="FLOAT")
+
+    results = separation_model.separate_batch(chunk_paths, batch_size=3, labels=["bass", "music"])
+
+    # One forward pass, with the short chunk zero-padded to the others' length
+    assert model.batch_shapes == [(3, 1, 1000)]
+    assert [sorted(outputs) for outputs in results] == [["bass", "music"]] * 3
+    for chunk, outputs in zip(chunks, results):
+        for label in ("bass", "music"):
+            stem, sr = sf.read(outputs[label], dtype="float32")
+            assert sr == SAMPLE_RATE
+            # Trimmed back to the chunk's own length, without the padding or the model's extra samples,
+            # and written as 16-bit PCM
+            np.testing.assert_allclose(stem, GAINS[separation_model.LABELS.index(label)] * chunk, atol=LSB)
+    assert results[2]["bass"].endswith("separated_bass_2_bass.wav")
@@ -1,5 +1,6 @@
 import os
-from speaker_separation import separate_speakers
+import numpy as np
+from speaker_separation import separate_speakers, window_bounds, cluster_speakers, speaker_mask
 from dotenv import load_dotenv
 
 def test_speaker_separation():
@@ -39,5 +40,29 @@ def test_speaker_separation():
         print(f"❌ Error during speaker separation: {str(e)}")
         print("Please check your HuggingFace token in the .env file")
 
+def test_window_bounds_tile_the_recording():
+    bounds = window_bounds(1000, 1, window=300, overlap=40)
+    assert [(start, end) for start, end, _, _ in bounds] == [(0, 300), (260, 560), (520, 820), (780, 1000)]
+    # Kept parts meet in the middle of each overlap and cover every sample once
+    assert [(lo, hi) for _, _, lo, hi in bounds] == [(0, 280), (280, 540), (540, 800), (800, 1000)]
+    assert window_bounds(100, 1, window=300, overlap=40) == [(0, 100, 0, 100)]
+
+def test_cluster_speakers_matches_speakers_across_windows():
+    a, b = np.array([1.0, 0.1, 0.0]), np.array([0.0, 0.2, 1.0])
+    labels = cluster_speakers({(0, "S0"): a, (0, "S1"): b, (1, "S0"): b * 1.1, (1, "S1"): a + 0.05,
+                               (2, "S0"): a, (2, "S1"): a * 0.9, (2, "S2"): np.array([0.0, 1.0, 0.0])})
+    assert labels == {(0, "S0"): "SPEAKER_00", (0, "S1"): "SPEAKER_01",
+                      (1, "S0"): "SPEAKER_01", (1, "S1"): "SPEAKER_00",
+                      # Speakers of one window are never merged with each other
+                      (2, "S0"): "SPEAKER_00", (2, "S1"): "SPEAKER_02", (2, "S2"): "SPEAKER_03"}
+
+def test_speaker_mask_covers_overlapping_and_out_of_range_turns():
+    # Turns in seconds at 10 samples per second; the first two overlap, the last runs past the end
+    mask = speaker_mask([(0.2, 0.5), (0.4, 0.7), (1.0, 1.1), (1.8, 2.5)], 20, 10)
+    expected = np.zeros(20, dtype=bool)
+    expected[2:7] = expected[10:11] = expected[18:20] = True
+    np.testing.assert_array_equal(mask, expected)
+    assert not speaker_mask([], 20, 10).any()
+
 if __name__ == "__main__":
     test_speaker_separation() 
\ No newline at end of file
@@ -0,0 +1,34 @@
+import numpy as np
+from streaming import StreamingSeparator, separate_stream
+
+def identity_stems(windows):
+    return [np.stack([window, -window, window, -window]) for window in windows]
+
+def test_streaming_blocks_reconstruct_input_without_seams():
+    audio = np.random.default_rng(0).uniform(-0.5, 0.5, 44100 * 3 + 123).astype(np.float32)
+    separator = StreamingSeparator(block=0.25, lookahead=0.1, context=0.5, crossfade=0.05, separate=identity_stems)
+
+    blocks = []
+    rng = np.random.default_rng(1)
+    position = 0
+    while position < len(audio):
+        size = int(rng.integers(1, 9000))
+        blocks.extend(separator.push(audio[position:position + size]))
+        position += size
+    assert all(block.shape == (4, separator.block) for block in blocks)
+    blocks.extend(separator.flush())
+
+    stems = np.concatenate(blocks, axis=1)
+    assert stems.shape == (4, len(audio))
+    np.testing.assert_allclose(stems[0], audio, atol=1e-6)
+    np.testing.assert_allclose(stems[1], -audio, atol=1e-6)
+
+def test_separate_stream_decodes_int16_frames():
+    audio = (np.random.default_rng(0).uniform(-0.5, 0.5, 44100) * 32767).astype("<i2")
+    data = np.repeat(audio, 2).tobytes()  # Interleaved stereo
+    chunks = iter([data[i:i + 999] for i in range(0, len(data), 999)] + [b""])
+    separator = StreamingSeparator(block=0.2, lookahead=0.05, context=0.2, crossfade=0.02, separate=identity_stems)
+
+    output = b"".join(separate_stream(lambda n: next(chunks), separator, sample_format="s16", channels=2))
+    stems = np.frombuffer(output, dtype="<f4").reshape(-1, 4)
+    np.testing.assert_allclose(stems[:, 0], audio / 32768, atol=1e-6)
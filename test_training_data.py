@@ -0,0 +1,23 @@
+import numpy as np
+import soundfile as sf
+from torch.utils.data import DataLoader
+from training_data import preprocess, load_segments, ShardDataset, SOURCES
+
+def test_shards_round_trip_and_random_crops(tmp_path):
+    rng = np.random.default_rng(0)
+    for source in SOURCES:
+        (tmp_path / "dataset" / source).mkdir(parents=True)
+        for track, seconds in enumerate([2.5, 1.2]):
+            sf.write(tmp_path / "dataset" / source / f"t{track}.wav", rng.uniform(-0.3, 0.3, int(seconds * 22050)), 22050)
+
+    shard_dir = str(tmp_path / "shards")
+    manifest = preprocess(str(tmp_path / "dataset"), shard_dir, shard_size=2, segment_seconds=1)
+    assert [shard["segments"] for shard in manifest["shards"]] == [2, 1]
+
+    full = ShardDataset(shard_dir, random_crop=False)
+    expected = load_segments(str(tmp_path / "dataset" / "vocal" / "t1.wav"), segment_length=44100)
+    np.testing.assert_allclose(full[2][2].numpy(), expected[0])
+
+    cropped = ShardDataset(shard_dir, indices=[0, 1], crop_length=1000)
+    batches = list(DataLoader(cropped, batch_size=2, num_workers=2))
+    assert [tuple(source.shape) for source in batches[0]] == [(2, 1000)] * len(SOURCES)
@@ -0,0 +1,202 @@
+"""
+Memory-mapped training data for the separation model.
+
+`preprocess` decodes every song and its stems once, resamples them to
+SAMPLE_RATE, cuts them into peak-normalized 10-second segments and writes
+them into .npy shards of shape [segments, 5, segment_length] (song, bass,
+vocal, drum, music), described by a manifest.json. `ShardDataset` reads
+the shards lazily through np.load(mmap_mode="r"), so the corpus never has
+to fit in RAM, and works with any number of DataLoader workers.
+
+Usage:
+    python training_data.py --dataset /path/to/dataset --output data/shards
+"""
+import argparse
+import json
+import os
+import numpy as np
+import librosa
+import torch
+from torch.utils.data import Dataset
+
+SAMPLE_RATE = 44100
+SEGMENT_SECONDS = 10
+SOURCES = ["song", "bass", "vocal", "drum", "music"]
+SHARD_SIZE = 64  # Segments per shard file (about 560 MB at 10 s)
+MANIFEST_NAME = "manifest.json"
+
+def get_file_paths(dataset_dir, folder_name):
+    """Return the sorted files of one source folder (song, bass, ...) of the dataset."""
+    path = os.path.join(dataset_dir, folder_name)
+    if not os.path.exists(path):
+        print(f"Warning: {folder_name} folder not found!")
+        return []
+    return sorted([os.path.join(path, f) for f in os.listdir(path)])
+
+def load_segments(file_path, target_sr=SAMPLE_RATE, segment_length=SAMPLE_RATE * SEGMENT_SECONDS):
+    """
+    Decode a file and cut it into peak-normalized segments.
+
+    Returns:
+        np.ndarray: [num_segments, segment_length] float32; shorter files are
+                    zero-padded to one segment and a trailing partial segment is dropped
+    """
+    audio, _ = librosa.load(file_path, sr=target_sr, mono=True)
+    if len(audio) < segment_length:
+        audio = np.pad(audio, (0, segment_length - len(audio)), mode='constant')
+
+    num_segments = len(audio) // segment_length
+    segments = audio[:num_segments * segment_length].reshape(num_segments, segment_length)
+    peaks = np.max(np.abs(segments), axis=1, keepdims=True)
+    return (segments / np.where(peaks > 0, peaks, 1.0)).astype(np.float32)
+
+class _ShardWriter:
+    """Fills fixed-capacity memory-mapped shards one segment at a time."""
+
+    def __init__(self, output_dir, shard_size, segment_length):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.segment_length = segment_length
+        self.shards = []  # {"file", "segments"} per finished shard
+        self._current = None
+        self._filled = 0
+
+    def append(self, segment):
+        """Write one [5, segment_length] sample."""
+        if self._current is None:
+            filename = f"shard_{len(self.shards):05d}.npy"
+            self._current = np.lib.format.open_memmap(
+                os.path.join(self.output_dir, filename), mode="w+", dtype=np.float32,
+                shape=(self.shard_size, len(SOURCES), self.segment_length))
+            self.shards.append({"file": filename, "segments": 0})
+        self._current[self._filled] = segment
+        self._filled += 1
+        self.shards[-1]["segments"] = self._filled
+        if self._filled == self.shard_size:
+            self.close()
+
+    def close(self):
+        if self._current is not None:
+            self._current.flush()
+            if self._filled < self.shard_size:
+                # Shrink the last shard to the segments actually written
+                path = os.path.join(self.output_dir, self.shards[-1]["file"])
+                data = np.array(self._current[:self._filled])
+                del self._current
+                np.save(path, data)
+            self._current = None
+            self._filled = 0
+
+def preprocess(dataset_dir, output_dir, shard_size=SHARD_SIZE, segment_seconds=SEGMENT_SECONDS,
+               target_sr=SAMPLE_RATE):
+    """
+    Write the dataset as memory-mapped shards plus a manifest.
+
+    Args:
+        dataset_dir (str): Folder with song/, bass/, vocal/, drum/ and music/ subfolders
+            whose sorted files line up track by track
+        output_dir (str): Where the shards and manifest.json are written
+        shard_size (int): Segments per shard
+        segment_seconds (float): Length of each stored segment
+        target_sr (int): Sample rate of the stored audio
+
+    Returns:
+        dict: The manifest
+    """
+    segment_length = int(target_sr * segment_seconds)
+    paths = {source: get_file_paths(dataset_dir, source) for source in SOURCES}
+    num_tracks = min(len(files) for files in paths.values())
+    print(f"Using {num_tracks} tracks for training.")
+
+    os.makedirs(output_dir, exist_ok=True)
+    writer = _ShardWriter(output_dir, shard_size, segment_length)
+    tracks = []
+    try:
+        for i in range(num_tracks):
+            # Only one track's audio is held in memory at a time
+            stems = [load_segments(paths[source][i], target_sr, segment_length) for source in SOURCES]
+            num_segments = min(len(segments) for segments in stems)
+            for j in range(num_segments):
+                writer.append(np.stack([segments[j] for segments in stems]))
+            tracks.append({"name": os.path.basename(paths["song"][i]), "segments": num_segments})
+            print(f"   ✓ {tracks[-1]['name']}: {num_segments} segments")
+    finally:
+        writer.close()
+
+    manifest = {
+        "sample_rate": target_sr,
+        "segment_length": segment_length,
+        "sources": SOURCES,
+        "shards": writer.shards,
+        "tracks": tracks,
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"✓ Wrote {sum(s['segments'] for s in writer.shards)} segments in {len(writer.shards)} shards")
+    return manifest
+
+def load_manifest(shard_dir):
+    with open(os.path.join(shard_dir, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+class ShardDataset(Dataset):
+    """
+    Lazily read (song, bass, vocal, drum, music) samples from preprocessed shards.
+
+    Shards are memory-mapped on first access in each process, so the dataset
+    can be pickled to DataLoader workers cheaply. With `crop_length` shorter
+    than a segment, every access takes a crop at a fresh random offset
+    (drawn from torch's per-worker generator), or from the segment start
+    when `random_crop` is False.
+
+    Args:
+        shard_dir (str): Output folder of `preprocess`
+        indices (sequence, optional): Segment indices to expose, e.g. one split
+        crop_length (int, optional): Samples per item; defaults to the full segment
+        random_crop (bool): Crop at a random offset instead of the start
+    """
+
+    def __init__(self, shard_dir, indices=None, crop_length=None, random_crop=True):
+        self.shard_dir = shard_dir
+        manifest = load_manifest(shard_dir)
+        self.segment_length = manifest["segment_length"]
+        self.crop_length = min(crop_length or self.segment_length, self.segment_length)
+        self.random_crop = random_crop
+        self._files = [shard["file"] for shard in manifest["shards"]]
+        # Global segment index -> (shard, row)
+        self._positions = [(s, row) for s, shard in enumerate(manifest["shards"]) for row in range(shard["segments"])]
+        self.indices = list(range(len(self._positions))) if indices is None else list(indices)
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shards"] = {}  # Each worker opens its own memory maps
+        return state
+
+    def _shard(self, s):
+        if s not in self._shards:
+            self._shards[s] = np.load(os.path.join(self.shard_dir, self._files[s]), mmap_mode="r")
+        return self._shards[s]
+
+    def __getitem__(self, idx):
+        s, row = self._positions[self.indices[idx]]
+        offset = 0
+        if self.random_crop and self.crop_length < self.segment_length:
+            offset = int(torch.randint(0, self.segment_length - self.crop_length + 1, ()))
+        sample = np.array(self._shard(s)[row, :, offset:offset + self.crop_length])
+        return tuple(torch.from_numpy(source) for source in sample)
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocess the training dataset into memory-mapped shards.")
+    parser.add_argument("--dataset", required=True, help="Folder with song/, bass/, vocal/, drum/, music/")
+    parser.add_argument("--output", default=os.path.join("data", "shards"))
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="Segments per shard")
+    parser.add_argument("--segment-seconds", type=float, default=SEGMENT_SECONDS)
+    args = parser.parse_args()
+    preprocess(args.dataset, args.output, args.shard_size, args.segment_seconds)
+
+if __name__ == "__main__":
+    main()